@@ -0,0 +1 @@
+"""Benchmarks of the HTD integration against simulated gateways"""
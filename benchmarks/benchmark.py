@@ -0,0 +1,258 @@
+"""
+Benchmarks the hot paths of the integration against simulated gateways, so a
+regression shows up before an upgrade does. `test_benchmark.py` runs it under
+pytest with thresholds, this reports the numbers.
+
+A bare Home Assistant instance loads the integration from this repository,
+one config entry per simulated gateway, and measures:
+
+- startup, from adding the entries until every zone has a consistent state
+- incoming frames, the CPU time and state writes per frame
+- a keypad flood, back to back keypad frames arriving in large reads
+- volume bursts, many `async_set_volume_level` calls on one zone
+- full refreshes, every zone of every gateway answering a query
+
+.. code-block:: shell
+
+    python -m benchmarks.benchmark --zones 6 12 48 --frames 2000 --output before.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import tempfile
+import time
+from typing import Any
+
+from homeassistant import core
+from htd_client import HtdConstants
+
+from tools.harness import HOST, async_create_hass, create_entry
+from tools.simulator import HtdGatewaySimulator
+
+_LOGGER = logging.getLogger(__name__)
+
+FIRST_PORT = 20006
+
+# how long a single scenario may take before the benchmark gives up on it
+SCENARIO_TIMEOUT = 120
+
+# the bytes a transport hands over per read during the keypad flood
+FLOOD_READ_SIZE = 1024
+
+
+class _Timer:
+    """Measures the wall and CPU time of a block, the CPU time covers every thread."""
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, *_):
+        self.wall = time.perf_counter() - self._wall
+        self.cpu = time.process_time() - self._cpu
+
+
+def _models_for(zones: int) -> list[str]:
+    """The gateways to simulate for a zone count, more than 12 zones needs several entries."""
+    if zones <= 6:
+        return ["lync6"]
+
+    return ["lync12"] * math.ceil(zones / 12)
+
+
+async def _async_feed_frames(incoming: list) -> None:
+    """Hand each frame to its client like the transport would, it's dispatched before data_received returns."""
+    for client, frame in incoming:
+        client.data_received(frame)
+
+        # the coalesced state write runs on the next iteration of the loop
+        await asyncio.sleep(0)
+
+
+async def _async_wait_for_updates(runtime_data: list, expected: list[int]) -> None:
+    """Wait until every dispatcher has seen the expected number of frames."""
+    while any(
+        data.dispatcher.updates_received < count for data, count in zip(runtime_data, expected)
+    ):
+        await asyncio.sleep(0.001)
+
+
+def _count_state_writes(runtime_data: list) -> tuple[int, int]:
+    return (
+        sum(data.dispatcher.state_writes for data in runtime_data),
+        sum(data.dispatcher.state_writes_skipped for data in runtime_data),
+    )
+
+
+async def async_run_scenario(hass: core.HomeAssistant, zones: int, frames: int, burst: int, port: int) -> dict[str, Any]:
+    models = _models_for(zones)
+    simulators = [HtdGatewaySimulator(model=model, seed=index) for index, model in enumerate(models)]
+    servers = [
+        await simulator.async_start_tcp(HOST, port + index)
+        for index, simulator in enumerate(simulators)
+    ]
+    entries = [create_entry(model, port + index) for index, model in enumerate(models)]
+
+    result: dict[str, Any] = {
+        "zones": sum(len(simulator.zones) for simulator in simulators),
+        "entries": len(entries),
+    }
+
+    try:
+        # startup, the restart path with a cached model
+        with _Timer() as timer:
+            for entry in entries:
+                await hass.config_entries.async_add(entry)
+
+            runtime_data = [entry.runtime_data for entry in entries]
+
+            await asyncio.gather(*(data.dispatcher.async_wait_for_first_state() for data in runtime_data))
+            await hass.async_block_till_done()
+
+        result["startup_seconds"] = timer.wall
+        result["startup_cpu_seconds"] = timer.cpu
+
+        # incoming frames one at a time, every other frame changes its zone so half of them should be written
+        clients = [data.client for data in runtime_data]
+        incoming = []
+
+        for frame in range(frames):
+            index = frame % len(simulators)
+            simulator = simulators[index]
+            zone = frame // len(simulators) % len(simulator.zones) + 1
+
+            if frame // len(simulators) % 2 == 0:
+                state = simulator.zones[zone]
+                state.volume = (state.volume + 1) % HtdConstants.MAX_VOLUME
+
+            incoming.append((clients[index], simulator.build_status_frame(zone)))
+
+        writes_before, skipped_before = _count_state_writes(runtime_data)
+
+        with _Timer() as timer:
+            await _async_feed_frames(incoming)
+
+        writes, skipped = _count_state_writes(runtime_data)
+
+        result["frame_cpu_microseconds"] = timer.cpu / frames * 1e6
+        result["frame_wall_microseconds"] = timer.wall / frames * 1e6
+        result["state_writes_per_frame"] = (writes - writes_before) / frames
+        result["state_writes_skipped_per_frame"] = (skipped - skipped_before) / frames
+
+        # a keypad flood, every frame wakes every zone of its gateway and changes nothing
+        writes_before, _ = _count_state_writes(runtime_data)
+
+        with _Timer() as timer:
+            for client, simulator in zip(clients, simulators):
+                flood = simulator.build_keypad_frame() * frames
+
+                for index in range(0, len(flood), FLOOD_READ_SIZE):
+                    client.data_received(flood[index:index + FLOOD_READ_SIZE])
+
+            await hass.async_block_till_done()
+
+        result["keypad_flood_cpu_microseconds"] = timer.cpu / (frames * len(clients)) * 1e6
+        result["keypad_flood_state_writes"] = _count_state_writes(runtime_data)[0] - writes_before
+
+        # a burst of volume changes on the first zone of each gateway, like dragging a slider
+        for data in runtime_data:
+            await data.groups.get_entity(1).async_turn_on()
+
+        sent_before = sum(data.scheduler.commands_sent for data in runtime_data)
+
+        with _Timer() as timer:
+            await asyncio.gather(
+                *(
+                    data.groups.get_entity(1).async_set_volume_level(step / burst)
+                    for data in runtime_data
+                    for step in range(1, burst + 1)
+                )
+            )
+            await hass.async_block_till_done()
+
+        commands_sent = sum(data.scheduler.commands_sent for data in runtime_data) - sent_before
+
+        result["volume_burst_seconds"] = timer.wall
+        result["volume_burst_cpu_seconds"] = timer.cpu
+        result["volume_burst_commands_sent"] = commands_sent
+        result["volume_burst_calls"] = burst * len(runtime_data)
+
+        # a full refresh of every gateway
+        expected = [
+            data.dispatcher.updates_received + data.client.get_zone_count()
+            for data in runtime_data
+        ]
+
+        with _Timer() as timer:
+            for data in runtime_data:
+                data.client.refresh()
+
+            await _async_wait_for_updates(runtime_data, expected)
+            await hass.async_block_till_done()
+
+        result["refresh_seconds"] = timer.wall
+        result["refresh_cpu_seconds"] = timer.cpu
+
+    finally:
+        for entry in entries:
+            await hass.config_entries.async_remove(entry.entry_id)
+
+        for server in servers:
+            server.close()
+
+        for simulator in simulators:
+            simulator.stop()
+
+    return result
+
+
+async def async_main(args: argparse.Namespace) -> list[dict[str, Any]]:
+    results = []
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = await async_create_hass(config_dir)
+
+        try:
+            for index, zones in enumerate(args.zones):
+                async with asyncio.timeout(SCENARIO_TIMEOUT):
+                    results.append(
+                        await async_run_scenario(hass, zones, args.frames, args.burst, FIRST_PORT + index * 100)
+                    )
+
+        finally:
+            await hass.async_stop()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the HTD integration against simulated gateways")
+    parser.add_argument("--zones", type=int, nargs="+", default=[6, 12, 48], help="the zone counts to benchmark")
+    parser.add_argument("--frames", type=int, default=1200, help="the incoming frames per zone count")
+    parser.add_argument("--burst", type=int, default=20, help="the volume changes per gateway")
+    parser.add_argument("--output", help="also write the results to this json file")
+    parser.add_argument("--debug", action="store_true")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+
+    results = asyncio.run(async_main(args))
+
+    for result in results:
+        print("%d zones over %d entries" % (result["zones"], result["entries"]))
+
+        for key, value in result.items():
+            if key not in ("zones", "entries"):
+                print("  %-32s %12.3f" % (key, value))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+The benchmark scenarios with thresholds, so a change that writes more state
+or sends more commands than it should fails instead of only showing up in
+the numbers. Times are reported, not checked, they depend on the machine.
+"""
+
+import asyncio
+import tempfile
+
+import pytest
+import pytest_asyncio
+
+from benchmarks.benchmark import FIRST_PORT, SCENARIO_TIMEOUT, async_run_scenario
+from tools.harness import async_create_hass
+
+FRAMES = 240
+BURST = 20
+
+# every other frame changes the volume of its zone, which the media player and the volume sensor show
+MAX_STATE_WRITES_PER_FRAME = 1.0
+
+# a burst of volume changes on one zone is sent as its first and its last value at most
+MAX_BURST_COMMANDS_PER_GATEWAY = 2
+
+
+@pytest_asyncio.fixture(scope="module", loop_scope="module")
+async def hass():
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = await async_create_hass(config_dir)
+        yield hass
+        await hass.async_stop()
+
+
+@pytest.mark.asyncio(loop_scope="module")
+@pytest.mark.parametrize("zones", [6, 24])
+async def test_scenario(hass, zones: int):
+    async with asyncio.timeout(SCENARIO_TIMEOUT):
+        result = await async_run_scenario(hass, zones, FRAMES, BURST, FIRST_PORT + zones * 10)
+
+    print(result)
+
+    assert result["zones"] == zones
+
+    # unchanged frames are coalesced away instead of written
+    assert result["state_writes_per_frame"] <= MAX_STATE_WRITES_PER_FRAME
+    assert result["state_writes_skipped_per_frame"] > 0
+    assert result["keypad_flood_state_writes"] == 0
+
+    # the queued volume changes of a slider drag replace each other
+    assert result["volume_burst_calls"] == BURST * result["entries"]
+    assert result["volume_burst_commands_sent"] <= MAX_BURST_COMMANDS_PER_GATEWAY * result["entries"]
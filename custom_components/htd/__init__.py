@@ -1,18 +1,74 @@
 """Support for Home Theater Direct products"""
 
+import asyncio
 import logging
+from typing import Tuple
 
 import voluptuous as vol
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import Platform, CONF_PORT, CONF_HOST, CONF_PATH, CONF_UNIQUE_ID
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.exceptions import ConfigEntryError, ConfigEntryNotReady
 from homeassistant.helpers import config_validation as cv, discovery
-from htd_client import async_get_client
+from homeassistant.helpers.dispatcher import async_dispatcher_send
+from htd_client import async_get_model_info
+from htd_client.constants import HtdModelInfo
 
-from .const import DOMAIN, CONF_DEVICE_NAME
-from .utils import _async_cleanup_registry_entries
+from .capture import HtdTrafficCapture
+from .client import HtdGatewayClient
+from .connection import HtdConnectionManager, async_get_connection_registry, configure_client, create_client
+from .const import (
+    DOMAIN,
+    CONF_ACTIVE_ZONES,
+    CONF_CAPTURE,
+    CONF_COMMAND_INTERVAL,
+    CONF_DEVICE_NAME,
+    CONF_ENABLED_ZONES,
+    CONF_KEEPALIVE,
+    CONF_MODEL,
+    CONF_RECONNECT_MAX_DELAY,
+    CONF_RETRY_ATTEMPTS,
+    CONF_SOCKET_TIMEOUT,
+    CONF_SOURCES,
+    CONF_STALE_TIMEOUT,
+    DEFAULT_CONNECT_TIMEOUT,
+    SIGNAL_OPTIONS_UPDATED,
+)
+from .dispatcher import HtdZoneDispatcher
+from .models import HtdClientConfigEntry, HtdRuntimeData
+from .ramp import HtdVolumeRamps
+from .scheduler import HtdCommandScheduler
+from .services import async_setup_services
+from .utils import (
+    _async_cleanup_registry_entries,
+    get_option,
+    get_source_names,
+    model_info_from_dict,
+    model_info_to_dict,
+)
+from .watchdog import HtdStaleWatchdog
+
+PLATFORMS: list[Platform] = [Platform.MEDIA_PLAYER, Platform.NUMBER, Platform.SENSOR]
+
+# options that are applied to the running client, connection and scheduler
+TRANSPORT_OPTIONS = {
+    CONF_CAPTURE,
+    CONF_SOCKET_TIMEOUT,
+    CONF_RETRY_ATTEMPTS,
+    CONF_KEEPALIVE,
+    CONF_RECONNECT_MAX_DELAY,
+    CONF_COMMAND_INTERVAL,
+    CONF_STALE_TIMEOUT,
+}
+
+# options the entities pick up in place
+ENTITY_OPTIONS = {CONF_DEVICE_NAME, CONF_SOURCES, CONF_ACTIVE_ZONES, CONF_ENABLED_ZONES}
 
-PLATFORMS: list[Platform] = [Platform.MEDIA_PLAYER]
+# options that only need a reconnect
+ADDRESS_OPTIONS = {CONF_HOST, CONF_PORT}
+
+# changing anything else reloads the entry
+LIVE_OPTIONS = TRANSPORT_OPTIONS | ENTITY_OPTIONS | ADDRESS_OPTIONS
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -34,50 +90,147 @@ CONFIG_SCHEMA = vol.Schema(
 
 
 async def async_setup(hass: HomeAssistant, config: dict):
+    async_setup_services(hass)
+
     htd_config = config.get(DOMAIN)
 
     if htd_config is None:
         return True
 
-    devices = []
+    # identify every serial gateway at the same time, the slowest one sets the pace
+    devices = await asyncio.gather(
+        *(_async_setup_serial_device(hass, device_config) for device_config in htd_config)
+    )
 
-    for config in htd_config:
-        serial_address = config[CONF_PATH]
-        device_name = config[CONF_DEVICE_NAME]
+    hass.data[DOMAIN] = [device for device in devices if device is not None]
 
-        client = await async_get_client(
-            serial_address=serial_address,
-            loop=hass.loop
-        )
+    # gateways set up in yaml only get media players
+    await discovery.async_load_platform(hass, Platform.MEDIA_PLAYER, DOMAIN, {}, config)
+
+    return True
 
-        unique_id = f"{client.model['name']}-{serial_address}"
 
-        devices.append({
-            "client": client,
-            CONF_UNIQUE_ID: unique_id,
-            CONF_DEVICE_NAME: device_name
-        })
+async def _async_setup_serial_device(hass: HomeAssistant, device_config: dict) -> dict | None:
+    serial_address = device_config[CONF_PATH]
+    device_name = device_config[CONF_DEVICE_NAME]
 
-    hass.data[DOMAIN] = devices
+    try:
+        async with asyncio.timeout(DEFAULT_CONNECT_TIMEOUT):
+            model_info = await async_get_model_info(serial_address=serial_address)
 
-    for component in PLATFORMS:
-        await discovery.async_load_platform(hass, component, DOMAIN, {}, config)
+    except (OSError, TimeoutError) as e:
+        _LOGGER.error("Unable to identify HTD gateway at %s: %s", serial_address, e)
+        return None
 
-    return True
+    if model_info is None:
+        _LOGGER.error("Unknown HTD model at %s", serial_address)
+        return None
+
+    client = create_client(hass, model_info, serial_address=serial_address)
+    runtime_data = await _async_create_runtime_data(hass, client, device_name)
+
+    hass.async_create_background_task(
+        runtime_data.connection.async_run(),
+        f"{DOMAIN} connection {serial_address}",
+    )
+
+    hass.async_create_background_task(
+        runtime_data.watchdog.async_run(),
+        f"{DOMAIN} watchdog {serial_address}",
+    )
+
+    return {
+        "runtime_data": runtime_data,
+        CONF_UNIQUE_ID: f"{model_info['name']}-{serial_address}",
+        CONF_DEVICE_NAME: device_name
+    }
 
 
-async def async_setup_entry(hass: HomeAssistant, config_entry: ConfigEntry):
+async def async_setup_entry(hass: HomeAssistant, config_entry: HtdClientConfigEntry):
     host = config_entry.data.get(CONF_HOST)
     port = config_entry.data.get(CONF_PORT)
 
     network_address = (host, port)
 
-    client = await async_get_client(
+    # a gateway only takes a few connections, one entry per address
+    if async_get_connection_registry(hass).get_client(network_address) is not None:
+        raise ConfigEntryError(f"{host}:{port} is already set up as another HTD gateway")
+
+    # the model is cached in the entry, so restarts and reloads skip the handshake
+    model_info = model_info_from_dict(config_entry.data.get(CONF_MODEL))
+    validate_model = model_info is not None
+
+    if model_info is None:
+        model_info = await _async_identify_gateway(hass, network_address)
+
+        hass.config_entries.async_update_entry(
+            config_entry,
+            data={**config_entry.data, CONF_MODEL: model_info_to_dict(model_info)}
+        )
+
+    # the client connects in the background, entities start out unavailable
+    client = create_client(
+        hass,
+        model_info,
         network_address=network_address,
-        loop=hass.loop
+        retry_attempts=get_option(config_entry.data, CONF_RETRY_ATTEMPTS),
+        socket_timeout=get_option(config_entry.data, CONF_SOCKET_TIMEOUT),
     )
+    runtime_data = await _async_create_runtime_data(hass, client, config_entry.title)
+    runtime_data.capture = HtdTrafficCapture(
+        hass,
+        client.codec,
+        hass.config.path(DOMAIN, f"capture_{config_entry.entry_id}.bin"),
+        model_info["name"],
+    )
+    _apply_live_options(runtime_data, _get_applied_data(config_entry))
+
+    config_entry.runtime_data = runtime_data
+    config_entry.async_on_unload(runtime_data.dispatcher.async_stop)
+    config_entry.async_on_unload(runtime_data.scheduler.async_stop)
+    config_entry.async_on_unload(runtime_data.ramps.async_stop)
+    config_entry.async_on_unload(runtime_data.connection.async_stop)
+    config_entry.async_on_unload(runtime_data.capture.async_stop)
 
-    config_entry.runtime_data = client
+    @callback
+    def _async_enabled_zones_changed(enabled_zones: list[int]) -> None:
+        # saved like the model, the update listener adds and removes the zone entities
+        if enabled_zones != config_entry.data.get(CONF_ENABLED_ZONES):
+            hass.config_entries.async_update_entry(
+                config_entry,
+                data={**config_entry.data, CONF_ENABLED_ZONES: enabled_zones}
+            )
+
+    config_entry.async_on_unload(
+        runtime_data.dispatcher.async_register_enabled_listener(_async_enabled_zones_changed)
+    )
+
+    # started first so its probe holds the gateway, the client connects once it's done
+    # instead of opening a second connection next to it
+    if validate_model:
+        config_entry.async_create_background_task(
+            hass,
+            _async_validate_model(hass, config_entry, network_address),
+            f"{DOMAIN} validate model {host}:{port}",
+        )
+
+    config_entry.async_create_background_task(
+        hass,
+        runtime_data.connection.async_run(),
+        f"{DOMAIN} connection {host}:{port}",
+    )
+
+    config_entry.async_create_background_task(
+        hass,
+        runtime_data.watchdog.async_run(),
+        f"{DOMAIN} watchdog {host}:{port}",
+    )
+
+    config_entry.async_create_background_task(
+        hass,
+        runtime_data.capture.async_run(),
+        f"{DOMAIN} capture {host}:{port}",
+    )
 
     config_entry.async_on_unload(
         config_entry.add_update_listener(async_update_listener)
@@ -92,12 +245,141 @@ async def async_setup_entry(hass: HomeAssistant, config_entry: ConfigEntry):
     return True
 
 
+async def _async_identify_gateway(hass: HomeAssistant, network_address: Tuple[str, int]) -> HtdModelInfo:
+    host, port = network_address
+
+    try:
+        model_info = await async_get_connection_registry(hass).async_get_model_info(network_address)
+
+    except (OSError, TimeoutError) as e:
+        raise ConfigEntryNotReady(f"Unable to reach HTD gateway at {host}:{port}") from e
+
+    if model_info is None:
+        raise ConfigEntryNotReady(f"Unknown HTD model at {host}:{port}")
+
+    return model_info
+
+
+async def _async_validate_model(
+    hass: HomeAssistant,
+    config_entry: HtdClientConfigEntry,
+    network_address: Tuple[str, int]
+) -> None:
+    """Confirm the cached model, the entry is only updated if the gateway was swapped."""
+    try:
+        model_info = await async_get_connection_registry(hass).async_probe(network_address)
+
+    except (OSError, TimeoutError) as e:
+        _LOGGER.debug("Unable to validate the model of %s: %s", config_entry.title, e)
+        return
+
+    stored = config_entry.data.get(CONF_MODEL)
+
+    if model_info is None or model_info_to_dict(model_info) == stored:
+        return
+
+    _LOGGER.info(
+        "%s now reports model %s instead of %s, reloading",
+        config_entry.title,
+        model_info["name"],
+        stored["name"],
+    )
+
+    # updating the entry data triggers a reload through the update listener
+    hass.config_entries.async_update_entry(
+        config_entry,
+        data={**config_entry.data, CONF_MODEL: model_info_to_dict(model_info)}
+    )
+
+
+async def _async_create_runtime_data(
+    hass: HomeAssistant,
+    client: HtdGatewayClient,
+    name: str
+) -> HtdRuntimeData:
+    dispatcher = HtdZoneDispatcher(hass, client)
+    dispatcher.zones.sources = get_source_names({}, client.get_source_count())
+    await dispatcher.async_start()
+
+    connection = HtdConnectionManager(
+        hass,
+        client,
+        name,
+        on_change=dispatcher.async_update_all,
+        registry=async_get_connection_registry(hass),
+    )
+
+    scheduler = HtdCommandScheduler(hass, client)
+    watchdog = HtdStaleWatchdog(hass, client, dispatcher, scheduler, connection)
+
+    ramps = HtdVolumeRamps(hass, client, scheduler)
+
+    return HtdRuntimeData(client, dispatcher, connection, scheduler, watchdog, ramps)
+
+
+def _get_applied_data(config_entry: HtdClientConfigEntry) -> dict:
+    # the title is the device name, renaming the entry is an option change like any other
+    return {**config_entry.data, CONF_DEVICE_NAME: config_entry.title}
+
+
+def _apply_live_options(runtime_data: HtdRuntimeData, data: dict) -> None:
+    """Configure the running gateway from the entry data."""
+    socket_timeout = get_option(data, CONF_SOCKET_TIMEOUT)
+
+    configure_client(
+        runtime_data.client,
+        retry_attempts=get_option(data, CONF_RETRY_ATTEMPTS),
+        socket_timeout=socket_timeout,
+    )
+
+    runtime_data.connection.async_configure(
+        connect_timeout=socket_timeout,
+        max_delay=get_option(data, CONF_RECONNECT_MAX_DELAY),
+        keepalive=get_option(data, CONF_KEEPALIVE),
+    )
+
+    runtime_data.scheduler.command_interval = get_option(data, CONF_COMMAND_INTERVAL)
+    runtime_data.watchdog.async_configure(get_option(data, CONF_STALE_TIMEOUT))
+
+    if runtime_data.capture is not None:
+        runtime_data.capture.async_configure(get_option(data, CONF_CAPTURE))
+
+    # one list of labels for all zones, the entities read it from the store
+    runtime_data.dispatcher.zones.sources = get_source_names(data, runtime_data.client.get_source_count())
+
+    runtime_data.connection.name = data[CONF_DEVICE_NAME]
+    runtime_data.applied_data = dict(data)
+
+
 async def async_update_listener(
     hass: HomeAssistant,
-    config_entry: ConfigEntry
+    config_entry: HtdClientConfigEntry
 ) -> None:
     """Handle options update."""
-    await hass.config_entries.async_reload(config_entry.entry_id)
+    runtime_data = config_entry.runtime_data
+    applied = runtime_data.applied_data
+    data = _get_applied_data(config_entry)
+    changed = {
+        key for key in {*applied, *data}
+        if get_option(applied, key) != get_option(data, key)
+    }
+
+    if changed - LIVE_OPTIONS:
+        await hass.config_entries.async_reload(config_entry.entry_id)
+        return
+
+    if not changed:
+        return
+
+    _LOGGER.debug("Applying %s to %s without a reload", ", ".join(sorted(changed)), config_entry.title)
+    _apply_live_options(runtime_data, data)
+
+    if changed & ADDRESS_OPTIONS:
+        runtime_data.connection.async_set_network_address((data[CONF_HOST], data[CONF_PORT]))
+
+    if changed & ENTITY_OPTIONS:
+        _async_cleanup_registry_entries(hass, config_entry)
+        async_dispatcher_send(hass, SIGNAL_OPTIONS_UPDATED.format(config_entry.entry_id))
 
 
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
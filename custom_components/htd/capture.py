@@ -0,0 +1,231 @@
+"""
+Raw traffic capture of a gateway, for replaying what happened in production.
+
+A capture file starts with a header (magic, version, the start as a unix
+timestamp and the model name), followed by one record per read from or
+write to the gateway: the microseconds since the record before it, the
+direction, the length and the raw bytes. Files rotate at a fixed size and
+only the newest few are kept, each can be replayed on its own.
+"""
+
+import asyncio
+import logging
+import os
+import struct
+import time
+from typing import Iterator, NamedTuple
+
+from homeassistant.core import HomeAssistant, callback
+
+from .protocol import HtdClientCodec
+
+_LOGGER = logging.getLogger(__name__)
+
+MAGIC = b"HTDCAP"
+VERSION = 1
+
+# magic, version, start time, length of the model name that follows
+FILE_HEADER = struct.Struct("<6sBdB")
+
+# microseconds since the previous record, direction, length of the bytes that follow
+RECORD_HEADER = struct.Struct("<IBH")
+
+MAX_RECORD_LENGTH = 0xffff
+MAX_RECORD_DELAY = 0xffffffff
+
+# a capture file rotates at this size, the current one and this many rotated files are kept
+CAPTURE_FILE_SIZE = 1024 * 1024
+CAPTURE_ROTATED_FILES = 3
+
+# the seconds between writes to the file, a busy gateway fills the buffer sooner
+CAPTURE_FLUSH_INTERVAL = 5
+CAPTURE_FLUSH_SIZE = 64 * 1024
+
+# records are dropped rather than buffered beyond this while the disk can't keep up
+CAPTURE_MAX_PENDING = 1024 * 1024
+
+
+class CaptureRecord(NamedTuple):
+    # seconds since the start of the file
+    timestamp: float
+    direction: int
+    data: bytes
+
+
+class HtdTrafficCapture:
+    """
+    Records the raw bytes of a gateway connection while it is turned on.
+    Records are packed in memory as they happen and written to disk from
+    the executor every few seconds, so capturing never blocks the loop.
+    """
+
+    hass: HomeAssistant = None
+
+    def __init__(self, hass: HomeAssistant, codec: HtdClientCodec, path: str, model_name: str):
+        self.hass = hass
+        self.path = path
+        self._codec = codec
+        self._model_name = model_name.encode()
+        self._pending = bytearray()
+        self._last_record: float | None = None
+        self._file_size: int | None = None
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+
+        self.enabled = False
+        self.records = 0
+        self.records_dropped = 0
+        self.bytes_written = 0
+        self.files_rotated = 0
+
+    @callback
+    def async_configure(self, enabled: bool) -> None:
+        """Start or stop capturing, a new capture always starts a new file."""
+        if enabled == self.enabled:
+            return
+
+        self.enabled = enabled
+        self._codec.recorder = self.record if enabled else None
+
+        if enabled:
+            _LOGGER.info("Capturing the traffic of %s to %s", self._model_name.decode(), self.path)
+            self._last_record = None
+            self._file_size = None
+
+        self._wake.set()
+
+    def record(self, direction: int, data: bytes) -> None:
+        """Called by the codec for every read and write, on the loop."""
+        if len(self._pending) > CAPTURE_MAX_PENDING:
+            self.records_dropped += 1
+            return
+
+        now = self.hass.loop.time()
+        delay = 0 if self._last_record is None else min(int((now - self._last_record) * 1_000_000), MAX_RECORD_DELAY)
+        self._last_record = now
+
+        for index in range(0, len(data), MAX_RECORD_LENGTH):
+            chunk = data[index:index + MAX_RECORD_LENGTH]
+            self._pending += RECORD_HEADER.pack(delay, direction, len(chunk))
+            self._pending += chunk
+            self.records += 1
+            delay = 0
+
+        if len(self._pending) >= CAPTURE_FLUSH_SIZE:
+            self._wake.set()
+
+    async def async_run(self) -> None:
+        """Run for the lifetime of the client, cancelled on unload."""
+        while True:
+            self._wake.clear()
+
+            try:
+                async with asyncio.timeout(CAPTURE_FLUSH_INTERVAL if self.enabled else None):
+                    await self._wake.wait()
+            except TimeoutError:
+                pass
+
+            await self.async_flush()
+
+    async def async_flush(self) -> None:
+        # the final flush on unload may overlap the periodic one
+        async with self._flush_lock:
+            if not self._pending:
+                return
+
+            pending, self._pending = self._pending, bytearray()
+
+            try:
+                await self.hass.async_add_executor_job(self._write, pending)
+
+            except OSError as e:
+                _LOGGER.warning("Unable to write the capture to %s: %s", self.path, e)
+
+    async def async_stop(self) -> None:
+        """Write what is left on unload."""
+        self.async_configure(False)
+        await self.async_flush()
+
+    def _write(self, data: bytearray) -> None:
+        # a new capture, or a full file, continues in a fresh file
+        if self._file_size is None or self._file_size + len(data) > CAPTURE_FILE_SIZE:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+            if os.path.exists(self.path):
+                self._rotate()
+
+            header = FILE_HEADER.pack(MAGIC, VERSION, time.time(), len(self._model_name)) + self._model_name
+
+            with open(self.path, "wb") as f:
+                f.write(header)
+
+            self._file_size = len(header)
+
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+        self._file_size += len(data)
+        self.bytes_written += len(data)
+
+    def _rotate(self) -> None:
+        for index in range(CAPTURE_ROTATED_FILES, 0, -1):
+            source = self.path if index == 1 else f"{self.path}.{index - 1}"
+
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index}")
+
+        self.files_rotated += 1
+
+    @property
+    def stats(self) -> dict[str, int | bool | str]:
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "records": self.records,
+            "records_dropped": self.records_dropped,
+            "bytes_written": self.bytes_written,
+            "files_rotated": self.files_rotated,
+        }
+
+
+def read_capture(path: str) -> tuple[str, Iterator[CaptureRecord]]:
+    """
+    Read a capture file.
+
+    Returns:
+        tuple[str, Iterator[CaptureRecord]]: the model name, and the records in the order they happened
+
+    Raises:
+        ValueError: the file is not a capture, or from a newer version
+    """
+    with open(path, "rb") as f:
+        content = f.read()
+
+    if len(content) < FILE_HEADER.size:
+        raise ValueError(f"{path} is not an HTD capture")
+
+    magic, version, _, name_length = FILE_HEADER.unpack_from(content)
+
+    if magic != MAGIC or version > VERSION:
+        raise ValueError(f"{path} is not an HTD capture this version can read")
+
+    offset = FILE_HEADER.size + name_length
+    model_name = content[FILE_HEADER.size:offset].decode()
+
+    def _records() -> Iterator[CaptureRecord]:
+        position = offset
+        timestamp = 0.0
+
+        # a capture cut short ends with a partial record, it's left out
+        while position + RECORD_HEADER.size <= len(content):
+            delay, direction, length = RECORD_HEADER.unpack_from(content, position)
+            position += RECORD_HEADER.size
+
+            if position + length > len(content):
+                break
+
+            timestamp += delay / 1_000_000
+            yield CaptureRecord(timestamp, direction, content[position:position + length])
+            position += length
+
+    return model_name, _records()
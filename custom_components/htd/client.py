@@ -0,0 +1,178 @@
+"""HTD clients that leave the framing to the integration"""
+
+import logging
+from asyncio import Transport
+from typing import Callable, Tuple
+
+from htd_client import BaseClient, HtdLyncClient, HtdMcaClient
+from htd_client.constants import HtdCommonCommands
+from htd_client.models import ZoneDetail
+
+from .protocol import VIEW_COMMANDS, HtdClientCodec
+from .state import HtdZoneStore
+
+_LOGGER = logging.getLogger(__name__)
+
+# what the framing uses of BaseClient, checked when a client is created so a
+# version of htd_client without any of them fails right away instead of silently
+CLIENT_MEMBERS = (
+    "_loop",
+    "_network_address",
+    "_connection",
+    "_connected",
+    "_heartbeat_task",
+    "_socket_lock",
+    "_zone_data",
+    "_zones_loaded",
+    "_ready",
+    "_parse_command",
+    "_broadcast",
+)
+
+
+class HtdGatewayClient(BaseClient):
+    """
+    An htd_client client that receives and sends through the codec.
+    htd_client copies its whole receive buffer for every frame it parses and
+    formats every chunk for its debug log, the decoder does neither, and
+    commands are sent from the prebuilt table. Parsing the frames is still
+    left to htd_client, but for the keypad frame. Every parsed zone is copied
+    into the zone store once.
+    """
+
+    codec: HtdClientCodec = None
+    zones: HtdZoneStore = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        missing = [name for name in CLIENT_MEMBERS if not hasattr(self, name)]
+
+        if missing:
+            raise TypeError(f"This version of htd_client is not supported, it has no {', '.join(missing)}")
+
+        self.codec = HtdClientCodec(self.model)
+        self.zones = HtdZoneStore(self.get_zone_count())
+
+        # called when the connection is lost, reconnecting is up to whoever set it
+        self.on_connection_lost: Callable[[], None] | None = None
+        self._closed = False
+
+        self.parse_errors = 0
+
+    @property
+    def network_address(self) -> Tuple[str, int] | None:
+        return self._network_address
+
+    @network_address.setter
+    def network_address(self, network_address: Tuple[str, int]) -> None:
+        """Where the next connection goes, the current one is left open."""
+        self._network_address = network_address
+
+    def connection_made(self, transport: Transport) -> None:
+        # a connection that was still being opened when the client was closed
+        if self._closed:
+            transport.close()
+            return
+
+        super().connection_made(transport)
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        """
+        htd_client opens a new connection right here, next to the one the
+        connection manager opens. The client only notes that it's down and
+        leaves reconnecting to the manager.
+        """
+        _LOGGER.debug("Connection lost: %s", exc)
+        self._ready = False
+        self._connected = False
+
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+
+        if self.on_connection_lost is not None:
+            self.on_connection_lost()
+
+    def close(self) -> None:
+        """Close the connection for good, the client is not connected again."""
+        self._closed = True
+        self._connected = False
+        self._ready = False
+
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def data_received(self, data: bytes) -> None:
+        for zone, command, frame_data in self.codec.decode(data, self._connection):
+            self._handle_frame(zone, command, frame_data)
+
+    def _handle_frame(self, zone: int, command: int, data: memoryview) -> None:
+        try:
+            if command == HtdCommonCommands.KEYPAD_EXISTS_RECEIVE_COMMAND:
+                self._parse_keypad_frame(data)
+
+            else:
+                # names are decoded from bytes, the status is only indexed
+                self._parse_command(zone, command, data if command in VIEW_COMMANDS else data.tobytes())
+
+            if command == HtdCommonCommands.ZONE_STATUS_RECEIVE_COMMAND and zone <= self.zones.zone_count:
+                self.zones.update(zone, self.get_zone(zone))
+
+        except Exception:
+            self.parse_errors += 1
+            _LOGGER.exception("Unable to parse command %02x for zone %d", command, zone)
+            return
+
+        # the client is ready once every zone reported, like BaseClient counts it
+        if not self._ready and command == HtdCommonCommands.ZONE_STATUS_RECEIVE_COMMAND:
+            self._zones_loaded += 1
+
+            if self._zones_loaded == self.get_zone_count():
+                self._ready = True
+
+        # already on the loop, the subscribers are called right away instead of from the executor
+        self._broadcast(zone)
+
+    def _parse_keypad_frame(self, data: memoryview) -> None:
+        """
+        htd_client replaces zones 9-16 with empty ones when it parses this
+        frame, and gives zones 1-8 their flags, only the flags change here.
+        """
+        # the second byte has a bit for each of zones 1-8, the fourth for zones 9-16
+        flags = data[1] | data[3] << 8
+
+        for zone in range(1, self.get_zone_count() + 1):
+            enabled = flags & (1 << (zone - 1)) != 0
+            self.zones.set_enabled(zone, enabled)
+
+            if self.has_zone_data(zone):
+                self.get_zone(zone).enabled = enabled
+            else:
+                self._zone_data[zone] = ZoneDetail(zone, enabled)
+
+    def _send_cmd(self, zone: int, command: int, data_code: int, extra_data: bytearray = None) -> None:
+        frame = self.codec.encode(zone, command, data_code, extra_data)
+
+        with self._socket_lock:
+            self._connection.write(frame)
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            **self.codec.stats,
+            "parse_errors": self.parse_errors,
+            "zone_updates": self.zones.updates,
+            "zone_updates_unchanged": self.zones.updates_unchanged,
+        }
+
+
+class HtdGatewayLyncClient(HtdGatewayClient, HtdLyncClient):
+    pass
+
+
+class HtdGatewayMcaClient(HtdGatewayClient, HtdMcaClient):
+    pass
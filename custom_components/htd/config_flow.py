@@ -1,16 +1,40 @@
+import asyncio
+import ipaddress
 import logging
 from typing import Any
 
 import homeassistant.helpers.config_validation as cv
 import voluptuous as vol
-from homeassistant.components import dhcp
+from homeassistant.components import dhcp, network
 from homeassistant.config_entries import ConfigEntry, ConfigFlow, OptionsFlow, OptionsFlowWithConfigEntry
 from homeassistant.const import CONF_HOST, CONF_NAME, CONF_PORT, CONF_UNIQUE_ID
 from homeassistant.core import callback, HomeAssistant
-from htd_client import async_get_model_info
-from htd_client.constants import HtdConstants
-
-from .const import CONF_DEVICE_NAME, DOMAIN
+from homeassistant.helpers.selector import TextSelector, TextSelectorConfig
+from htd_client.constants import HtdConstants, HtdModelInfo
+
+from .const import (
+    CONF_ACTIVE_ZONES,
+    CONF_CAPTURE,
+    CONF_COMMAND_INTERVAL,
+    CONF_DEBUG_SENSORS,
+    CONF_DEVICE_NAME,
+    CONF_ENABLED_ZONES,
+    CONF_KEEPALIVE,
+    CONF_MODEL,
+    CONF_NETWORK,
+    CONF_OPTIMISTIC,
+    CONF_RECONNECT_MAX_DELAY,
+    CONF_RETRY_ATTEMPTS,
+    CONF_SOCKET_TIMEOUT,
+    CONF_SOURCES,
+    CONF_STALE_TIMEOUT,
+    DOMAIN,
+    MAX_DISCOVERY_HOSTS,
+    RECONNECT_MIN_DELAY,
+)
+from .connection import async_get_connection_registry
+from .discovery import async_get_probe_cache, async_scan_network
+from .utils import get_active_zones, get_option, get_source_names, model_info_to_dict
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -29,6 +53,10 @@ class HtdConfigFlow(ConfigFlow, domain=DOMAIN):
     host: str = None
     port: int = HtdConstants.DEFAULT_PORT
     unique_id: str = None
+    model_info: HtdModelInfo = None
+    scan_network: ipaddress.IPv4Network = None
+    scan_task: asyncio.Task | None = None
+    discovered: dict[str, HtdModelInfo] = None
 
     async def async_step_dhcp(
         self, discovery_info: dhcp.DhcpServiceInfo
@@ -37,36 +65,125 @@ class HtdConfigFlow(ConfigFlow, domain=DOMAIN):
         _LOGGER.info("HTD device detected: %s %s" % (discovery_info.ip, self.port))
         host = discovery_info.ip
         network_address = (host, self.port)
-        model_info = await async_get_model_info(network_address=network_address)
+        unique_id = "htd-%s" % discovery_info.macaddress
+
+        # lease renewals of configured gateways end here, without touching the gateway,
+        # a new address is saved and the update listener reconnects to it
+        await self.async_set_unique_id(unique_id)
+        self._abort_if_unique_id_configured(updates={CONF_HOST: host}, reload_on_update=False)
+        self._async_abort_entries_match({CONF_HOST: host})
+
+        try:
+            model_info = await async_get_probe_cache(self.hass).async_get_model_info(
+                discovery_info.macaddress, network_address
+            )
+        except (OSError, TimeoutError) as e:
+            _LOGGER.debug("Unable to identify %s: %s", host, e)
+            return self.async_abort(reason="cannot_connect")
 
         if model_info is None:
             return self.async_abort(reason="unknown_model")
 
         _LOGGER.info("Model identified as: %s" % model_info)
 
-        unique_id = "htd-%s" % discovery_info.macaddress
-
-        await self.async_set_unique_id(unique_id)
-
+        self.host = host
         self.unique_id = unique_id
-        new_user_input = {
-            CONF_HOST: discovery_info.ip,
-            CONF_PORT: self.port,
-            CONF_UNIQUE_ID: unique_id,
-        }
-
-        self._abort_if_unique_id_configured()
+        self.model_info = model_info
 
         self.context["title_placeholders"] = {
             CONF_NAME: f"{model_info['friendly_name']} ({host})",
         }
 
-        return await self.async_step_custom_connection(new_user_input)
+        # the probe already identified the gateway, don't ask it again
+        return await self.async_step_options()
 
     async def async_step_user(
         self, user_input: dict[str, Any] | None = None
     ):
-        return await self.async_step_custom_connection(user_input)
+        return self.async_show_menu(menu_options=["scan", "custom_connection"])
+
+    async def async_step_scan(
+        self, user_input: dict[str, Any] | None = None
+    ):
+        errors = {}
+
+        # the flow comes back to this step once the scan is done
+        if self.scan_task is not None:
+            return self._async_scan_progress()
+
+        if user_input is not None:
+            try:
+                scan_network = ipaddress.ip_network(user_input[CONF_NETWORK], strict=False)
+            except ValueError:
+                scan_network = None
+                errors[CONF_NETWORK] = "invalid_network"
+
+            if scan_network is not None and scan_network.num_addresses > MAX_DISCOVERY_HOSTS:
+                errors[CONF_NETWORK] = "network_too_large"
+
+            if not errors:
+                self.scan_network = scan_network
+                self.port = user_input[CONF_PORT]
+                self.scan_task = self.hass.async_create_task(self._async_scan())
+
+                return self._async_scan_progress()
+
+        return self.async_show_form(
+            step_id='scan',
+            data_schema=get_scan_schema(await _async_get_default_network(self.hass)),
+            errors=errors
+        )
+
+    @callback
+    def _async_scan_progress(self):
+        if not self.scan_task.done():
+            return self.async_show_progress(
+                progress_action="scan",
+                progress_task=self.scan_task,
+                description_placeholders={CONF_NETWORK: str(self.scan_network)},
+            )
+
+        self.discovered = self.scan_task.result()
+        self.scan_task = None
+
+        return self.async_show_progress_done(next_step_id="pick")
+
+    async def _async_scan(self) -> dict[str, HtdModelInfo]:
+        # gateways that are set up are not probed, they only take a few connections
+        configured = {
+            entry.data.get(CONF_HOST) for entry in self.hass.config_entries.async_entries(DOMAIN)
+        }
+        configured |= async_get_connection_registry(self.hass).get_hosts(self.port)
+        discovered = {}
+
+        async for host, model_info in async_scan_network(self.scan_network, self.port, skip=configured):
+            _LOGGER.info("Found %s at %s" % (model_info["friendly_name"], host))
+            discovered[host] = model_info
+
+        return discovered
+
+    async def async_step_pick(
+        self, user_input: dict[str, Any] | None = None
+    ):
+        if not self.discovered:
+            return self.async_abort(reason="no_gateways_found")
+
+        if user_input is not None:
+            self.host = user_input[CONF_HOST]
+            self.unique_id = "htd-%s-%s" % (self.host, self.port)
+            self.model_info = self.discovered[self.host]
+
+            return await self.async_step_options()
+
+        gateways = {
+            host: f"{model_info['friendly_name']} ({host})"
+            for host, model_info in self.discovered.items()
+        }
+
+        return self.async_show_form(
+            step_id='pick',
+            data_schema=vol.Schema({vol.Required(CONF_HOST): vol.In(gateways)})
+        )
 
     async def async_step_custom_connection(
         self, user_input: dict[str, Any] | None = None
@@ -80,11 +197,14 @@ class HtdConfigFlow(ConfigFlow, domain=DOMAIN):
             port = int(user_input[CONF_PORT])
             unique_id = user_input[CONF_UNIQUE_ID] if CONF_UNIQUE_ID in user_input else "htd-%s-%s" % (host, port)
 
+            # a gateway only takes a few connections, it's never set up twice
+            self._async_abort_entries_match({CONF_HOST: host, CONF_PORT: port})
+
             try:
                 network_address = host, port
-                response = await async_get_model_info(network_address=network_address)
+                model_info = await async_get_connection_registry(self.hass).async_get_model_info(network_address)
 
-                if response is not None:
+                if model_info is not None:
                     success = True
 
             except Exception as e:
@@ -96,13 +216,14 @@ class HtdConfigFlow(ConfigFlow, domain=DOMAIN):
                 self.host = host
                 self.port = port
                 self.unique_id = unique_id
+                self.model_info = model_info
 
                 return await self.async_step_options()
 
             errors['base'] = "no_connection"
 
         return self.async_show_form(
-            step_id='user',
+            step_id='custom_connection',
             data_schema=get_connection_settings_schema(),
             errors=errors
         )
@@ -118,6 +239,7 @@ class HtdConfigFlow(ConfigFlow, domain=DOMAIN):
                 CONF_HOST: self.host,
                 CONF_PORT: self.port,
                 CONF_UNIQUE_ID: self.unique_id,
+                CONF_MODEL: model_info_to_dict(self.model_info),
             }
 
             return self.async_create_entry(
@@ -126,35 +248,56 @@ class HtdConfigFlow(ConfigFlow, domain=DOMAIN):
                 options={}
             )
 
-        network_address = (self.host, self.port)
-        model_info = await async_get_model_info(network_address=network_address)
-
+        # the model was identified in the previous step, no need to ask the gateway again
         return self.async_show_form(
             step_id='options',
             data_schema=get_options_schema(
-                model_info["friendly_name"],
+                self.model_info["friendly_name"],
             )
         )
 
 
 class HtdOptionsFlowHandler(OptionsFlowWithConfigEntry):
     async def async_step_init(self, user_input: dict[str, Any] | None = None):
-        if user_input is not None:
-            options = {
-                **self.config_entry.data,
-                **user_input
-            }
+        errors = {}
 
-            self.hass.config_entries.async_update_entry(
-                self.config_entry,
-                data=options
+        if user_input is not None:
+            source_count = (self.config_entry.data.get(CONF_MODEL) or {}).get("sources", 0)
+            sources = get_source_names(
+                {CONF_SOURCES: [label.strip() for label in user_input[CONF_SOURCES]]}, source_count
             )
 
-            return self.async_create_entry(title=self.config_entry.title, data={})
+            if len(set(sources)) != len(sources):
+                errors["base"] = "duplicate_sources"
+            else:
+                title = user_input.pop(CONF_DEVICE_NAME)
+
+                options = {
+                    **self.config_entry.data,
+                    **user_input,
+                    CONF_SOURCES: sources,
+                    CONF_ACTIVE_ZONES: sorted(int(zone) for zone in user_input[CONF_ACTIVE_ZONES]),
+                }
+
+                # the update listener applies what it can without a reload
+                self.hass.config_entries.async_update_entry(
+                    self.config_entry,
+                    title=title,
+                    data=options
+                )
+
+                return self.async_create_entry(title=title, data={})
 
         return self.async_show_form(
             step_id='init',
-            data_schema=get_connection_settings_schema(self.config_entry)
+            data_schema=get_zones_schema(self.config_entry).extend(
+                get_connection_settings_schema(self.config_entry).schema
+            ).extend(
+                get_transport_schema(self.config_entry).schema
+            ).extend(
+                get_behavior_schema(self.config_entry).schema
+            ),
+            errors=errors
         )
 
 
@@ -168,6 +311,31 @@ def get_options_schema(friendly_name: str):
     )
 
 
+def get_zones_schema(config_entry: ConfigEntry):
+    data = config_entry.data
+    model = data.get(CONF_MODEL) or {}
+    zone_count = model.get("zones", 0)
+    enabled_zones = data.get(CONF_ENABLED_ZONES)
+
+    zones = {
+        str(zone): f"Zone {zone}" if enabled_zones is None or zone in enabled_zones
+        else f"Zone {zone} (disabled on the gateway)"
+        for zone in range(1, zone_count + 1)
+    }
+
+    return vol.Schema(
+        {
+            vol.Required(CONF_DEVICE_NAME, default=config_entry.title): cv.string,
+            vol.Optional(
+                CONF_SOURCES, default=get_source_names(data, model.get("sources", 0))
+            ): TextSelector(TextSelectorConfig(multiple=True)),
+            vol.Optional(
+                CONF_ACTIVE_ZONES, default=[str(zone) for zone in get_active_zones(data, zone_count)]
+            ): cv.multi_select(zones),
+        }
+    )
+
+
 def get_connection_settings_schema(config_entry: ConfigEntry | None = None):
     if config_entry is not None:
         host = config_entry.data.get(CONF_HOST)
@@ -182,3 +350,64 @@ def get_connection_settings_schema(config_entry: ConfigEntry | None = None):
             vol.Required(CONF_PORT, default=port): cv.port,
         }
     )
+
+
+def get_transport_schema(config_entry: ConfigEntry):
+    data = config_entry.data
+
+    return vol.Schema(
+        {
+            vol.Optional(
+                CONF_SOCKET_TIMEOUT, default=get_option(data, CONF_SOCKET_TIMEOUT)
+            ): vol.All(vol.Coerce(float), vol.Range(min=1, max=120)),
+            vol.Optional(
+                CONF_RETRY_ATTEMPTS, default=get_option(data, CONF_RETRY_ATTEMPTS)
+            ): vol.All(vol.Coerce(int), vol.Range(min=1, max=10)),
+            vol.Optional(
+                CONF_KEEPALIVE, default=get_option(data, CONF_KEEPALIVE)
+            ): vol.All(vol.Coerce(int), vol.Range(min=0, max=3600)),
+            vol.Optional(
+                CONF_RECONNECT_MAX_DELAY, default=get_option(data, CONF_RECONNECT_MAX_DELAY)
+            ): vol.All(vol.Coerce(int), vol.Range(min=RECONNECT_MIN_DELAY, max=3600)),
+            vol.Optional(
+                CONF_COMMAND_INTERVAL, default=get_option(data, CONF_COMMAND_INTERVAL)
+            ): vol.All(vol.Coerce(float), vol.Range(min=0, max=1)),
+            vol.Optional(
+                CONF_STALE_TIMEOUT, default=get_option(data, CONF_STALE_TIMEOUT)
+            ): vol.All(vol.Coerce(int), vol.Range(min=0, max=3600)),
+        }
+    )
+
+
+def get_scan_schema(default_network: str | None):
+    return vol.Schema(
+        {
+            vol.Required(CONF_NETWORK, default=default_network): cv.string,
+            vol.Required(CONF_PORT, default=HtdConstants.DEFAULT_PORT): cv.port,
+        }
+    )
+
+
+async def _async_get_default_network(hass: HomeAssistant) -> str | None:
+    """The network of the default adapter, at most a /24 around Home Assistant."""
+    for adapter in await network.async_get_adapters(hass):
+        if adapter["enabled"] and adapter["default"] and adapter["ipv4"]:
+            address = adapter["ipv4"][0]
+            prefix = max(address["network_prefix"], 24)
+            return str(ipaddress.ip_network(f"{address['address']}/{prefix}", strict=False))
+
+    return None
+
+
+def get_behavior_schema(config_entry: ConfigEntry):
+    optimistic = get_option(config_entry.data, CONF_OPTIMISTIC)
+    debug_sensors = get_option(config_entry.data, CONF_DEBUG_SENSORS)
+    capture = get_option(config_entry.data, CONF_CAPTURE)
+
+    return vol.Schema(
+        {
+            vol.Optional(CONF_OPTIMISTIC, default=optimistic): cv.boolean,
+            vol.Optional(CONF_DEBUG_SENSORS, default=debug_sensors): cv.boolean,
+            vol.Optional(CONF_CAPTURE, default=capture): cv.boolean,
+        }
+    )
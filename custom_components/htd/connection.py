@@ -0,0 +1,342 @@
+"""Background connection handling for HTD gateways"""
+
+import asyncio
+import contextlib
+import logging
+import socket
+from typing import Callable, Tuple
+
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.helpers.singleton import singleton
+from htd_client import BaseClient, HtdDeviceKind, async_get_model_info
+from htd_client.constants import HtdConstants, HtdModelInfo, ONE_SECOND
+
+from .client import HtdGatewayClient, HtdGatewayLyncClient, HtdGatewayMcaClient
+from .const import (
+    CONNECTION_CHECK_INTERVAL,
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_KEEPALIVE,
+    DOMAIN,
+    RECONNECT_MAX_DELAY,
+    RECONNECT_MIN_DELAY,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+DATA_CONNECTIONS = f"{DOMAIN}_connections"
+
+# the number of unanswered keepalive probes before the connection is dropped
+KEEPALIVE_PROBES = 3
+
+
+def create_client(
+    hass: HomeAssistant,
+    model_info: HtdModelInfo,
+    network_address: Tuple[str, int] = None,
+    serial_address: str = None,
+    retry_attempts: int = HtdConstants.DEFAULT_RETRY_ATTEMPTS,
+    socket_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+) -> HtdGatewayClient:
+    """
+    Create a client for the model without connecting it, so entities can be
+    created before the gateway answers.
+
+    Args:
+        hass (HomeAssistant): the Home Assistant instance
+        model_info (HtdModelInfo): the model information of the gateway
+        network_address (Tuple[str, int]): the host and port of the gateway
+        serial_address (str): the location of the serial port
+        retry_attempts (int): how often a command is sent before it fails
+        socket_timeout (float): the number of seconds to wait on the connection
+
+    Returns:
+        HtdGatewayClient: a client that has not been connected yet
+    """
+    if model_info["kind"] == HtdDeviceKind.mca:
+        client_class = HtdGatewayMcaClient
+
+    elif model_info["kind"] == HtdDeviceKind.lync:
+        client_class = HtdGatewayLyncClient
+
+    else:
+        raise ValueError(f"Unknown Device Kind: {model_info['kind']}")
+
+    return client_class(
+        hass.loop,
+        model_info,
+        network_address=network_address,
+        serial_address=serial_address,
+        retry_attempts=retry_attempts,
+        socket_timeout=socket_timeout * ONE_SECOND,
+    )
+
+
+def configure_client(client: BaseClient, retry_attempts: int, socket_timeout: float) -> None:
+    """
+    Change the retry attempts and socket timeout of a client that already
+    exists, htd_client only takes them in its constructor.
+    """
+    client._retry_attempts = retry_attempts
+    client._socket_timeout_sec = socket_timeout
+
+
+class HtdConnectionRegistry:
+    """
+    Keeps one live connection per gateway address. The client of a config
+    entry registers its address, probes of that address use what its
+    connection already knows, and everything else that talks to the address
+    takes turns so no two connections are ever open at the same time.
+    """
+
+    def __init__(self):
+        self._clients: dict[Tuple[str, int], BaseClient] = {}
+        self._locks: dict[Tuple[str, int], asyncio.Lock] = {}
+
+    def get_client(self, network_address: Tuple[str, int]) -> BaseClient | None:
+        return self._clients.get(network_address)
+
+    def get_hosts(self, port: int) -> set[str]:
+        """The hosts with a client registered on the port."""
+        return {host for host, client_port in self._clients if client_port == port}
+
+    def get_lock(self, network_address: Tuple[str, int]) -> asyncio.Lock:
+        """The lock held while a connection to the address is being opened."""
+        return self._locks.setdefault(network_address, asyncio.Lock())
+
+    @callback
+    def async_register(self, network_address: Tuple[str, int], client: BaseClient) -> CALLBACK_TYPE:
+        self._clients[network_address] = client
+
+        @callback
+        def _unregister() -> None:
+            if self._clients.get(network_address) is client:
+                del self._clients[network_address]
+
+        return _unregister
+
+    async def async_get_model_info(self, network_address: Tuple[str, int]) -> HtdModelInfo | None:
+        """
+        Identify the gateway at an address, without a second connection if a
+        client is already connected to it.
+
+        Raises:
+            OSError, TimeoutError: the gateway could not be reached
+        """
+        client = self._clients.get(network_address)
+
+        if client is not None and client.connected:
+            return client.model
+
+        return await self.async_probe(network_address)
+
+    async def async_probe(self, network_address: Tuple[str, int]) -> HtdModelInfo | None:
+        """
+        Ask the gateway for its model, waiting for any connection that is
+        being opened to the same address first.
+
+        Raises:
+            OSError, TimeoutError: the gateway could not be reached
+        """
+        async with self.get_lock(network_address):
+            async with asyncio.timeout(DEFAULT_CONNECT_TIMEOUT):
+                return await async_get_model_info(network_address=network_address)
+
+
+@singleton(DATA_CONNECTIONS)
+@callback
+def async_get_connection_registry(hass: HomeAssistant) -> HtdConnectionRegistry:
+    return HtdConnectionRegistry()
+
+
+class HtdConnectionManager:
+    """
+    Connects a client in the background and keeps it connected, so a slow
+    or powered off gateway never holds up Home Assistant.
+    """
+
+    hass: HomeAssistant = None
+    client: HtdGatewayClient = None
+    name: str = None
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        client: HtdGatewayClient,
+        name: str,
+        on_change: Callable[[], None] | None = None,
+        registry: HtdConnectionRegistry | None = None,
+    ):
+        self.hass = hass
+        self.client = client
+        self.name = name
+        self._on_change = on_change
+        self._registry = registry
+        self._unregister: CALLBACK_TYPE | None = None
+        self._was_connected = False
+        self._has_connected = False
+        self._wake = asyncio.Event()
+
+        self.connect_timeout: float = DEFAULT_CONNECT_TIMEOUT
+        self.max_delay: float = RECONNECT_MAX_DELAY
+        self.keepalive: int = DEFAULT_KEEPALIVE
+
+        self.connect_attempts = 0
+        self.reconnects = 0
+
+        # only the manager reconnects, a lost connection is retried right away
+        client.on_connection_lost = self._wake.set
+
+        self._async_register()
+
+    @callback
+    def async_configure(self, connect_timeout: float, max_delay: float, keepalive: int) -> None:
+        """Change the connection settings, they apply to the current connection right away."""
+        self.connect_timeout = connect_timeout
+        self.max_delay = max_delay
+        self.keepalive = keepalive
+
+        if self.client.connected:
+            self._apply_keepalive()
+
+        # a shorter backoff ceiling shouldn't wait out the old, longer delay
+        self._wake.set()
+
+    @callback
+    def async_set_network_address(self, network_address: Tuple[str, int]) -> None:
+        """Point the client at a new address, the current connection is dropped and reopened."""
+        if self.client.network_address == network_address:
+            return
+
+        _LOGGER.info("%s moved to %s:%d, reconnecting", self.name, *network_address)
+
+        # a connection that is still being opened to the old address is dropped once it's open
+        self.client.network_address = network_address
+        self._async_register()
+        self.async_reconnect()
+
+    @callback
+    def async_reconnect(self) -> None:
+        """Drop the connection and open it again right away."""
+        if self.client.connected:
+            self.client.disconnect()
+
+        self._wake.set()
+
+    @callback
+    def async_request_reconnect(self) -> None:
+        """Skip the current wait and check the connection right away."""
+        self._wake.set()
+
+    @callback
+    def async_stop(self) -> None:
+        """Close the connection for good, the client is not used again."""
+        if self._unregister is not None:
+            self._unregister()
+            self._unregister = None
+
+        self.client.on_connection_lost = None
+        self.client.close()
+
+    @callback
+    def _async_register(self) -> None:
+        if self._unregister is not None:
+            self._unregister()
+            self._unregister = None
+
+        if self._registry is not None and self.client.network_address is not None:
+            self._unregister = self._registry.async_register(self.client.network_address, self.client)
+
+    async def async_run(self) -> None:
+        """Run for the lifetime of the config entry, cancelled on unload."""
+        delay = RECONNECT_MIN_DELAY
+
+        while True:
+            # a wake while connecting is not lost, the wait below returns right away
+            self._wake.clear()
+
+            if not self.client.connected:
+                if await self._async_try_connect():
+                    delay = RECONNECT_MIN_DELAY
+                else:
+                    delay = min(delay * 2, self.max_delay)
+
+            self._async_check_state_change()
+
+            wait = CONNECTION_CHECK_INTERVAL if self.client.connected else min(delay, self.max_delay)
+
+            try:
+                async with asyncio.timeout(wait):
+                    await self._wake.wait()
+            except TimeoutError:
+                pass
+
+    async def _async_try_connect(self) -> bool:
+        address = self.client.network_address
+
+        # a probe of the same gateway finishes before the client connects
+        lock = self._registry.get_lock(address) if self._registry is not None and address else contextlib.nullcontext()
+
+        try:
+            async with lock:
+                # connected while waiting for the lock, a second connection would replace the first
+                if self.client.connected:
+                    return True
+
+                self.connect_attempts += 1
+
+                async with asyncio.timeout(self.connect_timeout):
+                    await self.client.async_connect()
+
+        except (OSError, TimeoutError) as e:
+            _LOGGER.debug("Unable to connect to %s: %s", self.name, e)
+            return False
+
+        # the address changed while connecting, closing this connection wakes the manager again
+        if self.client.network_address != address:
+            _LOGGER.debug("%s moved while connecting to %s:%d", self.name, *address)
+            self.client.disconnect()
+            return False
+
+        if self._has_connected:
+            self.reconnects += 1
+
+        self._has_connected = True
+        self._apply_keepalive()
+
+        _LOGGER.debug("Connected to %s", self.name)
+        return True
+
+    @callback
+    def _async_check_state_change(self) -> None:
+        connected = self.client.connected
+
+        if connected == self._was_connected:
+            return
+
+        if not connected:
+            _LOGGER.warning("Lost connection to %s, reconnecting in the background", self.name)
+
+        self._was_connected = connected
+
+        if self._on_change is not None:
+            self._on_change()
+
+    def _apply_keepalive(self) -> None:
+        # htd_client keeps its transport to itself, a serial port has no socket
+        transport = getattr(self.client, "_connection", None)
+        sock = transport.get_extra_info("socket") if transport is not None else None
+
+        if sock is None or sock.family not in (socket.AF_INET, socket.AF_INET6):
+            return
+
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1 if self.keepalive else 0)
+
+            # the probe timing options are not available on every platform
+            if self.keepalive and hasattr(socket, "TCP_KEEPIDLE"):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.keepalive)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(self.keepalive // KEEPALIVE_PROBES, 1))
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, KEEPALIVE_PROBES)
+
+        except OSError as e:
+            _LOGGER.debug("Unable to set keepalive for %s: %s", self.name, e)
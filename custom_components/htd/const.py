@@ -1,3 +1,5 @@
+from htd_client.constants import HtdConstants
+
 MANUFACTURER = "Home Theater Direct"
 DOMAIN = "htd"
 
@@ -5,3 +7,70 @@ CONF_DEVICE_NAME = 'device_name'
 CONF_SOURCES = 'sources'
 CONF_RETRY_ATTEMPTS = 'retry_attempts'
 CONF_SOCKET_TIMEOUT = 'socket_timeout'
+CONF_OPTIMISTIC = 'optimistic'
+CONF_DEBUG_SENSORS = 'debug_sensors'
+CONF_KEEPALIVE = 'keepalive'
+CONF_RECONNECT_MAX_DELAY = 'reconnect_max_delay'
+CONF_COMMAND_INTERVAL = 'command_interval'
+CONF_ACTIVE_ZONES = 'active_zones'
+CONF_STALE_TIMEOUT = 'stale_timeout'
+CONF_CAPTURE = 'capture'
+
+# the number of seconds to wait for a gateway before setup is retried in the background
+DEFAULT_CONNECT_TIMEOUT = 10
+
+# the number of seconds between connection checks, and the reconnect backoff bounds
+CONNECTION_CHECK_INTERVAL = 5
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+
+# the number of idle seconds before tcp keepalive probes start, 0 leaves keepalive off
+DEFAULT_KEEPALIVE = 0
+
+# the number of seconds without updates before a gateway is considered stale,
+# the client refreshes every zone once a minute so a healthy gateway is never silent this long
+DEFAULT_STALE_TIMEOUT = 90
+
+# the number of seconds a stale gateway has to answer a resync before the next, bigger one
+RESYNC_TIMEOUT = 3
+
+CONF_MODEL = 'model'
+
+# the zones the gateway reported as enabled, cached like the model
+CONF_ENABLED_ZONES = 'enabled_zones'
+
+# sent with the entry id once the name, source labels or active zones changed
+SIGNAL_OPTIONS_UPDATED = f"{DOMAIN}_options_updated_{{}}"
+
+# the minimum number of seconds between two commands sent to the same gateway
+DEFAULT_COMMAND_INTERVAL = 0.05
+
+# the number of seconds an optimistic value is shown before the gateway's value wins
+OPTIMISTIC_TIMEOUT = 10
+
+CONF_NETWORK = 'network'
+
+# how many hosts a network scan probes at once, and the seconds each host gets
+# to accept a connection and then to identify itself
+DISCOVERY_CONCURRENCY = 128
+DISCOVERY_HOST_TIMEOUT = 1
+DISCOVERY_MODEL_TIMEOUT = 5
+
+# the largest network a scan accepts, a /22
+MAX_DISCOVERY_HOSTS = 1024
+
+# the number of seconds a probed model is remembered, dhcp renewals within it don't probe again
+PROBE_CACHE_TTL = 15 * 60
+
+# what an option means while it is missing from the entry data
+OPTION_DEFAULTS = {
+    CONF_OPTIMISTIC: False,
+    CONF_DEBUG_SENSORS: False,
+    CONF_SOCKET_TIMEOUT: DEFAULT_CONNECT_TIMEOUT,
+    CONF_RETRY_ATTEMPTS: HtdConstants.DEFAULT_RETRY_ATTEMPTS,
+    CONF_KEEPALIVE: DEFAULT_KEEPALIVE,
+    CONF_RECONNECT_MAX_DELAY: RECONNECT_MAX_DELAY,
+    CONF_COMMAND_INTERVAL: DEFAULT_COMMAND_INTERVAL,
+    CONF_STALE_TIMEOUT: DEFAULT_STALE_TIMEOUT,
+    CONF_CAPTURE: False,
+}
@@ -0,0 +1,51 @@
+"""Diagnostics support for HTD gateways"""
+
+from typing import Any
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.const import CONF_HOST, CONF_UNIQUE_ID
+from homeassistant.core import HomeAssistant
+
+from .models import HtdClientConfigEntry
+from .snapshot import SNAPSHOT_FIELDS
+
+TO_REDACT = {CONF_HOST, CONF_UNIQUE_ID}
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, entry: HtdClientConfigEntry
+) -> dict[str, Any]:
+    """Return diagnostics for a config entry."""
+    runtime_data = entry.runtime_data
+    client = runtime_data.client
+    connection = runtime_data.connection
+    scheduler = runtime_data.scheduler
+
+    zones = {}
+
+    if client.connected:
+        for zone in range(1, client.get_zone_count() + 1):
+            if client.has_zone_data(zone):
+                zone_info = client.get_zone(zone)
+                zones[zone] = {field: getattr(zone_info, field) for field in (*SNAPSHOT_FIELDS, "enabled")}
+
+    return {
+        "entry": async_redact_data(dict(entry.data), TO_REDACT),
+        "connection": {
+            "connected": client.connected,
+            "ready": client.ready,
+            "connect_attempts": connection.connect_attempts,
+            "reconnects": connection.reconnects,
+        },
+        "updates": runtime_data.dispatcher.stats,
+        "watchdog": runtime_data.watchdog.stats,
+        "protocol": client.stats,
+        "capture": runtime_data.capture.stats,
+        "commands": {
+            **scheduler.stats,
+            "latency": scheduler.latency.as_dict(),
+        },
+        "ramps": runtime_data.ramps.stats,
+        "optimistic": {field: dict(outcomes) for field, outcomes in runtime_data.optimistic_stats.items()},
+        "zones": zones,
+    }
@@ -0,0 +1,231 @@
+"""Network discovery of HTD gateways"""
+
+import asyncio
+import contextlib
+import ipaddress
+import logging
+import time
+from typing import AsyncIterator, Callable, Collection, Tuple
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.singleton import singleton
+from htd_client.constants import MAX_BYTES_TO_RECEIVE, HtdCommonCommands, HtdConstants, HtdModelInfo
+
+from .connection import HtdConnectionRegistry, async_get_connection_registry
+from .const import (
+    DISCOVERY_CONCURRENCY,
+    DISCOVERY_HOST_TIMEOUT,
+    DISCOVERY_MODEL_TIMEOUT,
+    DOMAIN,
+    PROBE_CACHE_TTL,
+)
+from .protocol import build_frame
+
+_LOGGER = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[int, int], None]
+
+DATA_PROBE_CACHE = f"{DOMAIN}_probe_cache"
+
+MODEL_QUERY_FRAME = build_frame(1, HtdCommonCommands.MODEL_QUERY_COMMAND_CODE, [0])
+
+
+def get_model_info_from_reply(reply: bytes) -> HtdModelInfo | None:
+    """The model whose identifier is in the reply to the model query, like htd_client matches it."""
+    for model_info in HtdConstants.SUPPORTED_MODELS.values():
+        if model_info["identifier"] in reply:
+            return model_info
+
+    return None
+
+
+async def async_probe_gateway(
+    host: str,
+    port: int = HtdConstants.DEFAULT_PORT,
+    timeout: float = DISCOVERY_HOST_TIMEOUT,
+) -> HtdModelInfo | None:
+    """
+    Check whether a host runs an HTD gateway. Hosts that accept a connection
+    within the timeout are asked for their model over that same connection,
+    so a gateway only sees one connection per probe.
+
+    Args:
+        host (str): the host to probe
+        port (int): the port of the gateway
+        timeout (float): the number of seconds to wait for the connection
+
+    Returns:
+        HtdModelInfo: the model of the gateway, or None if there is none
+    """
+    try:
+        async with asyncio.timeout(timeout):
+            reader, writer = await asyncio.open_connection(host, port)
+
+    except (OSError, TimeoutError):
+        return None
+
+    try:
+        async with asyncio.timeout(DISCOVERY_MODEL_TIMEOUT):
+            writer.write(MODEL_QUERY_FRAME)
+            await writer.drain()
+            reply = await reader.read(MAX_BYTES_TO_RECEIVE)
+
+    except (OSError, TimeoutError) as e:
+        _LOGGER.debug("%s:%d accepted a connection but did not identify itself: %s", host, port, e)
+        return None
+
+    finally:
+        writer.close()
+
+        with contextlib.suppress(OSError):
+            await writer.wait_closed()
+
+    return get_model_info_from_reply(reply)
+
+
+async def async_scan_network(
+    network: str | ipaddress.IPv4Network,
+    port: int = HtdConstants.DEFAULT_PORT,
+    concurrency: int = DISCOVERY_CONCURRENCY,
+    timeout: float = DISCOVERY_HOST_TIMEOUT,
+    on_progress: ProgressCallback | None = None,
+    skip: Collection[str] = (),
+) -> AsyncIterator[tuple[str, HtdModelInfo]]:
+    """
+    Probe every host of a network, a bounded number at a time, and yield
+    each gateway as soon as it is confirmed. Closing the iterator cancels the
+    probes that are still running.
+
+    Args:
+        network (str): the network to scan, e.g. 192.168.1.0/24
+        port (int): the port of the gateways
+        concurrency (int): the most hosts probed at the same time
+        timeout (float): the number of seconds to wait for each host
+        on_progress (ProgressCallback): called with the hosts probed so far and the total
+        skip (Collection[str]): hosts that are never probed, e.g. gateways already set up
+
+    Yields:
+        tuple[str, HtdModelInfo]: the host and model of each gateway found
+    """
+    hosts = [
+        str(host) for host in ipaddress.ip_network(network, strict=False).hosts() if str(host) not in skip
+    ]
+    pending = iter(hosts)
+    found: asyncio.Queue[tuple[str, HtdModelInfo] | None] = asyncio.Queue()
+    probed = 0
+
+    async def _async_worker() -> None:
+        nonlocal probed
+
+        try:
+            # the workers share one iterator, so each host is probed once
+            for host in pending:
+                model_info = await async_probe_gateway(host, port, timeout)
+                probed += 1
+
+                if on_progress is not None:
+                    on_progress(probed, len(hosts))
+
+                if model_info is not None:
+                    found.put_nowait((host, model_info))
+
+        finally:
+            found.put_nowait(None)
+
+    workers = [asyncio.create_task(_async_worker()) for _ in range(min(concurrency, len(hosts)))]
+    running = len(workers)
+
+    try:
+        while running:
+            result = await found.get()
+
+            if result is None:
+                running -= 1
+                continue
+
+            yield result
+
+    finally:
+        for worker in workers:
+            worker.cancel()
+
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+class HtdProbeCache:
+    """
+    Remembers which model was found behind a key, e.g. a MAC address, for a
+    while, and merges concurrent probes of the same address into one.
+    """
+
+    def __init__(self, registry: HtdConnectionRegistry, ttl: float = PROBE_CACHE_TTL):
+        self._registry = registry
+        self._ttl = ttl
+        self._results: dict[str, tuple[float, HtdModelInfo | None]] = {}
+        self._in_flight: dict[Tuple[str, int], asyncio.Future] = {}
+
+    async def async_get_model_info(self, key: str, network_address: Tuple[str, int]) -> HtdModelInfo | None:
+        """
+        Get the model of a gateway, probing it only if there is no recent result.
+
+        Args:
+            key (str): what the result is remembered by
+            network_address (Tuple[str, int]): the host and port of the gateway
+
+        Returns:
+            HtdModelInfo: the model of the gateway, or None if the model is unknown
+
+        Raises:
+            OSError, TimeoutError: the gateway could not be reached, this is not remembered
+        """
+        now = time.monotonic()
+        cached = self._results.get(key)
+
+        if cached is not None and cached[0] > now:
+            _LOGGER.debug("Using the cached model of %s", key)
+            return cached[1]
+
+        future = self._in_flight.get(network_address)
+
+        if future is None:
+            future = asyncio.ensure_future(self._registry.async_get_model_info(network_address))
+            self._in_flight[network_address] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(network_address, None))
+        else:
+            _LOGGER.debug("Joining the probe of %s:%d in flight", *network_address)
+
+        # one waiter giving up must not cancel the probe for the others
+        model_info = await asyncio.shield(future)
+
+        self._results = {
+            cached_key: result for cached_key, result in self._results.items() if result[0] > now
+        }
+        self._results[key] = (time.monotonic() + self._ttl, model_info)
+
+        return model_info
+
+
+@singleton(DATA_PROBE_CACHE)
+@callback
+def async_get_probe_cache(hass: HomeAssistant) -> HtdProbeCache:
+    return HtdProbeCache(async_get_connection_registry(hass))
+
+
+def discover_gateways(network: str, port: int = HtdConstants.DEFAULT_PORT) -> list[tuple[str, HtdModelInfo]]:
+    """
+    Scan a network from outside of Home Assistant.
+
+    Args:
+        network (str): the network to scan, a base address like 192.168.1. is taken as its /24
+        port (int): the port of the gateways
+
+    Returns:
+        list[tuple[str, HtdModelInfo]]: the host and model of each gateway found
+    """
+    if network.endswith("."):
+        network = f"{network}0/24"
+
+    async def _async_discover():
+        return [gateway async for gateway in async_scan_network(network, port)]
+
+    return asyncio.run(_async_discover())
@@ -0,0 +1,319 @@
+"""Zone-indexed dispatch of client updates for HTD entities"""
+
+import asyncio
+import logging
+import time
+from typing import Callable, Iterable
+
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from htd_client.constants import HtdCommonCommands
+
+from .client import HtdGatewayClient
+from .metrics import HtdFrameRate
+from .state import FIELD_MASK
+
+_LOGGER = logging.getLogger(__name__)
+
+GLOBAL_ZONE = 0
+
+ZoneListener = Callable[[int], None]
+FieldListener = Callable[[], None]
+EnabledZonesListener = Callable[[list[int]], None]
+
+
+class HtdZoneDispatcher:
+    """
+    Subscribes to a client once and routes each update to the listener
+    registered for that zone, instead of waking every entity on every frame.
+    Listeners of single fields are only called when one of their fields changed.
+    """
+
+    hass: HomeAssistant = None
+    client: HtdGatewayClient = None
+
+    def __init__(self, hass: HomeAssistant, client: HtdGatewayClient):
+        self.hass = hass
+        self.client = client
+        self._listeners: dict[int, ZoneListener] = {}
+        self._field_listeners: dict[int, list[tuple[int, FieldListener]]] = {}
+        self._client_ready = False
+        self._enabled_listeners: list[EnabledZonesListener] = []
+        self._subscribed = False
+        self._refresh_requested = False
+        self._started_at: float | None = None
+        self._first_state: asyncio.Future = hass.loop.create_future()
+
+        self.first_consistent_state: float | None = None
+        self.updates_received = 0
+        self.callbacks_dispatched = 0
+        self.callbacks_avoided = 0
+        self.updates_ignored = 0
+        self.state_writes = 0
+        self.state_writes_skipped = 0
+        self.enabled_zones: list[int] | None = None
+        self.last_update: float | None = None
+        self.zone_updates: dict[int, float] = {}
+        self.frame_rate = HtdFrameRate()
+        self.zones = client.zones
+
+    async def async_start(self) -> None:
+        """Subscribe to the client, this is only done once per client."""
+        if self._subscribed:
+            return
+
+        self._started_at = time.monotonic()
+        self.client.codec.add_frame_handler(self._handle_frame)
+        await self.client.async_subscribe(self._async_dispatch)
+        self._subscribed = True
+
+    @callback
+    def async_request_refresh(self) -> None:
+        """
+        Ask the gateway for a full status dump. This is only done once per
+        client, every zone shares the result through the dispatcher.
+        """
+        if self._refresh_requested:
+            return
+
+        self._refresh_requested = True
+
+        # the client refreshes all zones by itself as soon as it connects
+        if self.client.connected:
+            self.client.refresh()
+
+    async def async_wait_for_first_state(self) -> float:
+        """
+        Wait until every zone has reported its state at least once.
+
+        Returns:
+            float: the time to the first consistent state, in seconds
+        """
+        return await asyncio.shield(self._first_state)
+
+    async def async_stop(self) -> None:
+        """Unsubscribe from the client and drop all listeners."""
+        if not self._subscribed:
+            return
+
+        await self.client.async_unsubscribe(self._async_dispatch)
+        self._subscribed = False
+        self._listeners.clear()
+        self._field_listeners.clear()
+        self._enabled_listeners.clear()
+
+        self.client.codec.remove_frame_handler(self._handle_frame)
+
+        if not self._first_state.done():
+            self._first_state.cancel()
+
+        _LOGGER.debug(
+            "Dispatcher stopped after %d updates, %d callbacks dispatched, %d avoided",
+            self.updates_received,
+            self.callbacks_dispatched,
+            self.callbacks_avoided,
+        )
+
+    @callback
+    def async_register(self, zone: int, listener: ZoneListener) -> CALLBACK_TYPE:
+        """
+        Register the listener for a zone.
+
+        Returns:
+            CALLBACK_TYPE: a callback that removes the listener again
+        """
+        self._listeners[zone] = listener
+
+        @callback
+        def _remove() -> None:
+            if self._listeners.get(zone) is listener:
+                del self._listeners[zone]
+
+        return _remove
+
+    @callback
+    def async_register_fields(self, zone: int, fields: Iterable[str], listener: FieldListener) -> CALLBACK_TYPE:
+        """
+        Register a listener for some fields of a zone, e.g. the bass. It's also
+        called when the connection changes and when the client becomes ready,
+        as the availability may have changed. The keypad frame of zone 0 is
+        not passed on, it never changes the fields.
+
+        Returns:
+            CALLBACK_TYPE: a callback that removes the listener again
+        """
+        mask = 0
+
+        for field in fields:
+            mask |= FIELD_MASK[field]
+
+        registration = (mask, listener)
+        self._field_listeners.setdefault(zone, []).append(registration)
+
+        @callback
+        def _remove() -> None:
+            listeners = self._field_listeners.get(zone)
+
+            if listeners is not None and registration in listeners:
+                listeners.remove(registration)
+
+        return _remove
+
+    @callback
+    def async_register_enabled_listener(self, listener: EnabledZonesListener) -> CALLBACK_TYPE:
+        """
+        Register a listener for the zones the gateway reports as enabled, it's
+        called whenever they change.
+
+        Returns:
+            CALLBACK_TYPE: a callback that removes the listener again
+        """
+        self._enabled_listeners.append(listener)
+
+        @callback
+        def _remove() -> None:
+            if listener in self._enabled_listeners:
+                self._enabled_listeners.remove(listener)
+
+        return _remove
+
+    @callback
+    def async_record_ignored(self) -> None:
+        """A listener had nothing to do with an update, e.g. the zone has no data yet."""
+        self.updates_ignored += 1
+
+    @callback
+    def async_record_state_write(self, written: bool) -> None:
+        """Count the state writes of the zones, and the ones skipped because nothing changed."""
+        if written:
+            self.state_writes += 1
+        else:
+            self.state_writes_skipped += 1
+
+    @callback
+    def async_update_all(self) -> None:
+        """Wake every zone, e.g. when the connection state has changed."""
+        self._async_dispatch(GLOBAL_ZONE)
+        self._async_dispatch_all_fields()
+
+    def _handle_frame(self, zone: int, command: int, data: memoryview) -> None:
+        """Read the enabled zones off the keypad frame, to notice when they change."""
+        if command == HtdCommonCommands.KEYPAD_EXISTS_RECEIVE_COMMAND:
+            self._handle_keypad_frame(data)
+
+    def _handle_keypad_frame(self, data: memoryview) -> None:
+        # the second byte has a bit for each of zones 1-8, the fourth for zones 9-16
+        flags = data[1] | data[3] << 8
+        enabled_zones = [
+            zone for zone in range(1, self.client.get_zone_count() + 1) if flags & (1 << (zone - 1))
+        ]
+
+        # a gateway without any enabled zone is more likely a garbled frame
+        if enabled_zones and enabled_zones != self.enabled_zones:
+            self._async_enabled_zones_changed(enabled_zones)
+
+    @callback
+    def _async_enabled_zones_changed(self, enabled_zones: list[int]) -> None:
+        if enabled_zones == self.enabled_zones:
+            return
+
+        _LOGGER.debug("The gateway reports zones %s as enabled", ", ".join(map(str, enabled_zones)))
+        self.enabled_zones = enabled_zones
+
+        for listener in list(self._enabled_listeners):
+            listener(enabled_zones)
+
+    @callback
+    def _async_dispatch(self, zone: int | None) -> None:
+        now = self.hass.loop.time()
+        self.updates_received += 1
+        self.last_update = now
+        self.frame_rate.record(now)
+
+        if self.first_consistent_state is None:
+            self._async_check_first_state()
+
+        # the field listeners don't see every frame, tell them when the zones became available
+        if self.client.ready != self._client_ready:
+            self._client_ready = self.client.ready
+            self._async_dispatch_all_fields()
+
+        # zone 0 (or no zone) is a global update, every zone gets it once
+        if zone is None or zone == GLOBAL_ZONE:
+            for listener in list(self._listeners.values()):
+                self.callbacks_dispatched += 1
+                listener(GLOBAL_ZONE)
+
+            return
+
+        self.zone_updates[zone] = now
+        self._async_dispatch_fields(zone)
+
+        listener = self._listeners.get(zone)
+        listener_count = len(self._listeners)
+
+        if listener is None:
+            self.callbacks_avoided += listener_count
+            return
+
+        self.callbacks_avoided += listener_count - 1
+        self.callbacks_dispatched += 1
+        listener(zone)
+
+    @callback
+    def _async_dispatch_fields(self, zone: int) -> None:
+        # the store collected the fields that changed since the last update of the zone
+        changed = self.zones.pop_changes(zone) if zone <= self.zones.zone_count else 0
+
+        for mask, listener in list(self._field_listeners.get(zone, ())):
+            if mask & changed:
+                self.callbacks_dispatched += 1
+                listener()
+            else:
+                self.callbacks_avoided += 1
+
+    @callback
+    def _async_dispatch_all_fields(self) -> None:
+        for listeners in list(self._field_listeners.values()):
+            for _, listener in list(listeners):
+                self.callbacks_dispatched += 1
+                listener()
+
+    @callback
+    def _async_check_first_state(self) -> None:
+        if not self.client.connected:
+            return
+
+        # keypad frames create empty zones, only a status frame sets the power
+        for zone in range(1, self.client.get_zone_count() + 1):
+            if not self.zones.has_state(zone):
+                return
+
+        self.first_consistent_state = time.monotonic() - self._started_at
+        self._first_state.set_result(self.first_consistent_state)
+
+        _LOGGER.debug(
+            "All %d zones reported state %.3f seconds after subscribing",
+            self.client.get_zone_count(),
+            self.first_consistent_state,
+        )
+
+    @property
+    def stats(self) -> dict[str, int | float | None]:
+        return {
+            "updates_received": self.updates_received,
+            "callbacks_dispatched": self.callbacks_dispatched,
+            "callbacks_avoided": self.callbacks_avoided,
+            "updates_ignored": self.updates_ignored,
+            "state_writes": self.state_writes,
+            "state_writes_skipped": self.state_writes_skipped,
+            "updates_per_second": self.frame_rate.rate(self.hass.loop.time()),
+            "seconds_since_last_update": self.seconds_since_last_update,
+            "first_consistent_state": self.first_consistent_state,
+        }
+
+    @property
+    def seconds_since_last_update(self) -> float | None:
+        if self.last_update is None:
+            return None
+
+        return self.hass.loop.time() - self.last_update
@@ -0,0 +1,165 @@
+"""Entities for single fields of HTD zones, e.g. the bass of a zone"""
+
+from typing import Any, Callable, Iterable
+
+from homeassistant.const import CONF_UNIQUE_ID
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from homeassistant.helpers.entity import Entity, EntityDescription
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from htd_client import BaseClient
+
+from .const import SIGNAL_OPTIONS_UPDATED
+from .dispatcher import HtdZoneDispatcher
+from .media_player import make_alphanumeric
+from .models import HtdClientConfigEntry, HtdRuntimeData
+from .scheduler import HtdCommandScheduler
+from .state import HtdZoneStore
+from .utils import get_active_zones, get_entity_zones
+
+ZoneEntityFactory = Callable[[str, str, int, HtdRuntimeData], Iterable["HtdZoneEntity"]]
+
+
+def get_zone_entity_unique_id(unique_id: str, zone: int, key: str) -> str:
+    # the media player of the zone has the same id without the key
+    return f"{unique_id}_{zone:02}_{key}"
+
+
+@callback
+def async_setup_zone_entities(
+    hass: HomeAssistant,
+    config_entry: HtdClientConfigEntry,
+    async_add_entities: AddEntitiesCallback,
+    create: ZoneEntityFactory,
+) -> None:
+    """
+    Add the entities of every zone that has a media player, and follow the
+    options like the media players do: zones are added and removed, and a
+    new device name is picked up in place.
+    """
+    unique_id = config_entry.data.get(CONF_UNIQUE_ID)
+    runtime_data = config_entry.runtime_data
+    zone_count = runtime_data.client.get_zone_count()
+    entities: dict[int, list[HtdZoneEntity]] = {}
+
+    @callback
+    def _async_add(zones: Iterable[int]) -> None:
+        added = []
+
+        for zone in zones:
+            entities[zone] = list(create(unique_id, config_entry.title, zone, runtime_data))
+            added += entities[zone]
+
+        if added:
+            async_add_entities(added)
+
+    _async_add(get_entity_zones(config_entry.data, zone_count))
+
+    @callback
+    def _async_options_updated() -> None:
+        zones = get_entity_zones(config_entry.data, zone_count)
+        active_zones = get_active_zones(config_entry.data, zone_count)
+
+        # the registry cleanup already removed the entities of the zones that were turned off,
+        # the entities of zones disabled on the gateway stay and become unavailable
+        for zone in [zone for zone in entities if zone not in active_zones]:
+            del entities[zone]
+
+        for zone_entities in entities.values():
+            for entity in zone_entities:
+                entity.async_apply_options(config_entry.title)
+
+        _async_add([zone for zone in zones if zone not in entities])
+
+    config_entry.async_on_unload(
+        async_dispatcher_connect(hass, SIGNAL_OPTIONS_UPDATED.format(config_entry.entry_id), _async_options_updated)
+    )
+
+
+class HtdZoneEntity(Entity):
+    """
+    A view of some fields of a zone in the zone store. The dispatcher only
+    calls it when one of its fields changed, or when the availability may
+    have, and the state is only written when what it shows is different.
+    """
+
+    should_poll = False
+
+    # the domain of the platform, for the entity id
+    platform_domain: str = None
+
+    device_name: str
+    zone: int
+    client: BaseClient
+    zones: HtdZoneStore
+    dispatcher: HtdZoneDispatcher
+    scheduler: HtdCommandScheduler
+    _fields: tuple[str, ...]
+    _state_fingerprint: tuple | None
+
+    def __init__(
+        self,
+        unique_id: str,
+        device_name: str,
+        zone: int,
+        runtime_data: HtdRuntimeData,
+        description: EntityDescription,
+        fields: tuple[str, ...],
+    ):
+        self.entity_description = description
+        self.device_name = device_name
+        self.zone = zone
+        self.client = runtime_data.client
+        self.zones = runtime_data.dispatcher.zones
+        self.dispatcher = runtime_data.dispatcher
+        self.scheduler = runtime_data.scheduler
+        self._fields = fields
+        self._state_fingerprint = None
+
+        self._attr_unique_id = get_zone_entity_unique_id(unique_id, zone, description.key)
+
+        zone_fmt = "02" if self.client.model["zones"] > 10 else "01"
+        self.entity_id = (
+            f"{self.platform_domain}.{make_alphanumeric(device_name)}_zone_{zone:{zone_fmt}}_{description.key}"
+        ).lower()
+
+    @property
+    def name(self) -> str:
+        return f"Zone {self.zone} {self.entity_description.name} ({self.device_name})"
+
+    @property
+    def available(self) -> bool:
+        # a zone disabled on the gateway keeps its entity, with its name and area, but shows no state
+        return self.client.ready and self.zones.has_state(self.zone) and not self.zones.is_disabled(self.zone)
+
+    @callback
+    def async_apply_options(self, device_name: str) -> None:
+        """Pick up a new device name or source labels without being recreated."""
+        self.device_name = device_name
+        self._state_fingerprint = None
+
+        if self.hass is not None:
+            self._async_write_state_if_changed()
+
+    async def async_added_to_hass(self) -> None:
+        self.async_on_remove(
+            self.dispatcher.async_register_fields(self.zone, self._fields, self._async_write_state_if_changed)
+        )
+
+        # the state is written once right after this
+        self._state_fingerprint = self._get_state_fingerprint()
+
+    def _get_state_fingerprint(self) -> tuple[Any, ...]:
+        return self.available, *(self.zones.get(self.zone, field) for field in self._fields)
+
+    @callback
+    def _async_write_state_if_changed(self) -> None:
+        fingerprint = self._get_state_fingerprint()
+
+        if fingerprint == self._state_fingerprint:
+            self.dispatcher.async_record_state_write(False)
+            return
+
+        self._state_fingerprint = fingerprint
+        self.dispatcher.async_record_state_write(True)
+        self.async_write_ha_state()
@@ -0,0 +1,134 @@
+"""Zone grouping (party mode) for HTD gateways"""
+
+import logging
+from typing import Any
+
+from homeassistant.core import CALLBACK_TYPE, callback
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class HtdZoneGroups:
+    """
+    Keeps track of which zones of a gateway are joined together. Each group
+    has a leader, power, source and volume changes on the leader are sent to
+    every zone in the group.
+    """
+
+    def __init__(self):
+        self._leaders: dict[int, int] = {}
+        self._entities: dict[int, Any] = {}
+
+    @callback
+    def async_register(self, zone: int, entity: Any) -> CALLBACK_TYPE:
+        """
+        Register the entity for a zone, its `async_group_changed` is called
+        when the group the zone belongs to changes.
+        """
+        self._entities[zone] = entity
+
+        @callback
+        def _remove() -> None:
+            self.async_unjoin(zone)
+            self._entities.pop(zone, None)
+
+        return _remove
+
+    def get_zone(self, entity_id: str) -> int | None:
+        for zone, entity in self._entities.items():
+            if entity.entity_id == entity_id:
+                return zone
+
+        return None
+
+    def get_entity(self, zone: int) -> Any | None:
+        return self._entities.get(zone)
+
+    def get_zones(self, zone: int) -> list[int]:
+        """
+        Get the zones a command for this zone should be sent to.
+
+        Returns:
+            list[int]: every zone of the group if the zone leads one, otherwise only the zone
+        """
+        if self._leaders.get(zone) != zone:
+            return [zone]
+
+        return sorted(member for member, leader in self._leaders.items() if leader == zone)
+
+    def get_members(self, zone: int) -> list[str]:
+        """Get the entity ids of the group, leader first, or an empty list."""
+        leader = self._leaders.get(zone)
+
+        if leader is None:
+            return []
+
+        return [
+            self._entities[member].entity_id
+            for member in sorted(self.get_zones(leader), key=lambda member: member != leader)
+            if member in self._entities
+        ]
+
+    @callback
+    def async_join(self, leader: int, members: list[int]) -> None:
+        """Join the members to the group led by the leader."""
+        changed = {leader}
+
+        # a leader can't also be a member of another group
+        if self._leaders.get(leader) not in (None, leader):
+            changed.update(self._async_leave(leader))
+
+        self._leaders[leader] = leader
+
+        for member in members:
+            if member == leader:
+                continue
+
+            changed.update(self._async_leave(member))
+            self._leaders[member] = leader
+            changed.add(member)
+
+        # joining nothing doesn't make a group
+        if list(self._leaders.values()).count(leader) == 1:
+            del self._leaders[leader]
+
+        _LOGGER.debug("Zone %d now leads zones %s", leader, self.get_zones(leader))
+
+        self._async_notify(changed)
+
+    @callback
+    def async_unjoin(self, zone: int) -> None:
+        """Remove the zone from its group, a leader dissolves the whole group."""
+        self._async_notify(self._async_leave(zone))
+
+    @callback
+    def _async_leave(self, zone: int) -> set[int]:
+        leader = self._leaders.get(zone)
+
+        if leader is None:
+            return set()
+
+        if leader == zone:
+            changed = {member for member, member_leader in self._leaders.items() if member_leader == zone}
+
+            for member in changed:
+                del self._leaders[member]
+
+            return changed
+
+        del self._leaders[zone]
+        changed = {zone, leader}
+
+        # a leader without members is no longer a group
+        if list(self._leaders.values()).count(leader) == 1:
+            del self._leaders[leader]
+
+        return changed
+
+    @callback
+    def _async_notify(self, zones: set[int]) -> None:
+        for zone in zones:
+            entity = self._entities.get(zone)
+
+            if entity is not None:
+                entity.async_group_changed()
@@ -1,11 +1,12 @@
 """Support for HTD"""
 
+import asyncio
 import logging
 import re
+from typing import Callable, Coroutine, Iterable
 
 from homeassistant.components.media_player import MediaPlayerEntity, MediaPlayerDeviceClass
 from homeassistant.components.media_player.const import MediaPlayerEntityFeature, MediaType
-from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import (
     CONF_UNIQUE_ID,
     STATE_OFF,
@@ -13,11 +14,21 @@ from homeassistant.const import (
     STATE_UNKNOWN,
     STATE_UNAVAILABLE,
 )
-from homeassistant.core import HomeAssistant
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.exceptions import ServiceValidationError
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from homeassistant.helpers.event import async_call_later
 from htd_client import BaseClient, HtdConstants, HtdMcaClient
-from htd_client.models import ZoneDetail
 
-from .const import DOMAIN, CONF_DEVICE_NAME
+from .const import DOMAIN, CONF_DEVICE_NAME, CONF_OPTIMISTIC, OPTIMISTIC_TIMEOUT, SIGNAL_OPTIONS_UPDATED
+from .dispatcher import HtdZoneDispatcher
+from .group import HtdZoneGroups
+from .models import HtdClientConfigEntry, HtdRuntimeData
+from .optimistic import FIELD_MUTE, FIELD_POWER, FIELD_SOURCE, FIELD_VOLUME, HtdOptimisticState
+from .ramp import HtdVolumeRamps
+from .scheduler import HtdCommandScheduler
+from .state import FIELD_ENABLED, HtdZoneStore
+from .utils import get_active_zones, get_entity_zones, get_option
 
 
 def make_alphanumeric(input_string):
@@ -29,19 +40,18 @@ get_media_player_entity_id = lambda name, zone_number, zone_fmt: f"media_player.
 SUPPORT_HTD = (
     MediaPlayerEntityFeature.SELECT_SOURCE |
     MediaPlayerEntityFeature.TURN_OFF |
-    MediaPlayerEntityEntityFeature.TURN_ON |
+    MediaPlayerEntityFeature.TURN_ON |
     MediaPlayerEntityFeature.VOLUME_MUTE |
     MediaPlayerEntityFeature.VOLUME_SET |
     MediaPlayerEntityFeature.VOLUME_STEP |
     MediaPlayerEntityFeature.PLAY |
     MediaPlayerEntityFeature.PAUSE |
-    MediaPlayerEntityFeature.STOP
+    MediaPlayerEntityFeature.STOP |
+    MediaPlayerEntityFeature.GROUPING
 )
 
 _LOGGER = logging.getLogger(__name__)
 
-HtdClientConfigEntry = ConfigEntry[BaseClient]
-
 
 async def async_setup_platform(hass, _, async_add_entities, __=None):
     htd_configs = hass.data[DOMAIN]
@@ -52,108 +62,165 @@ async def async_setup_platform(hass, _, async_add_entities, __=None):
 
         unique_id = config[CONF_UNIQUE_ID]
         device_name = config[CONF_DEVICE_NAME]
-        client = config["client"]
-
-        zone_count = client.get_zone_count()
-        source_count = client.get_source_count()
-        sources = [f"Source {i + 1}" for i in range(source_count)]
-        for zone in range(1, zone_count + 1):
-            entity = HtdDevice(
-                unique_id,
-                device_name,
-                zone,
-                sources,
-                client
-            )
+        runtime_data = config["runtime_data"]
+        client = runtime_data.client
 
-            entities.append(entity)
+        entities += _build_zone_entities(
+            unique_id,
+            device_name,
+            runtime_data,
+            range(1, client.get_zone_count() + 1),
+        )
 
     async_add_entities(entities)
 
-    return True
+    for config in htd_configs:
+        config["runtime_data"].dispatcher.async_request_refresh()
 
+    return True
 
-async def async_setup_entry(_: HomeAssistant, config_entry: HtdClientConfigEntry, async_add_entities):
-    entities = []
 
-    client = config_entry.runtime_data
-    zone_count = client.get_zone_count()
-    source_count = client.get_source_count()
-    device_name = config_entry.title
+async def async_setup_entry(hass: HomeAssistant, config_entry: HtdClientConfigEntry, async_add_entities):
     unique_id = config_entry.data.get(CONF_UNIQUE_ID)
-    sources = [f"Source {i + 1}" for i in range(source_count)]
-    for zone in range(1, zone_count + 1):
-        entity = HtdDevice(
+    optimistic = get_option(config_entry.data, CONF_OPTIMISTIC)
+    runtime_data = config_entry.runtime_data
+    client = runtime_data.client
+
+    entities = {
+        entity.zone: entity
+        for entity in _build_zone_entities(
             unique_id,
-            device_name,
-            zone,
-            sources,
-            client
+            config_entry.title,
+            runtime_data,
+            get_entity_zones(config_entry.data, client.get_zone_count()),
+            optimistic,
         )
+    }
 
-        entities.append(entity)
+    async_add_entities(entities.values())
 
-    async_add_entities(entities)
+    runtime_data.dispatcher.async_request_refresh()
 
+    @callback
+    def _async_options_updated() -> None:
+        zones = get_entity_zones(config_entry.data, client.get_zone_count())
+        active_zones = get_active_zones(config_entry.data, client.get_zone_count())
+
+        # the registry cleanup already removed the entities of the zones that were turned off,
+        # the entities of zones disabled on the gateway stay and become unavailable
+        for zone in [zone for zone in entities if zone not in active_zones]:
+            del entities[zone]
+
+        for entity in entities.values():
+            entity.async_apply_options(config_entry.title)
+
+        added = _build_zone_entities(
+            unique_id,
+            config_entry.title,
+            runtime_data,
+            [zone for zone in zones if zone not in entities],
+            optimistic,
+        )
+
+        if added:
+            entities.update((entity.zone, entity) for entity in added)
+            async_add_entities(added)
+
+    config_entry.async_on_unload(
+        async_dispatcher_connect(hass, SIGNAL_OPTIONS_UPDATED.format(config_entry.entry_id), _async_options_updated)
+    )
+
+
+def _build_zone_entities(
+    unique_id: str,
+    device_name: str,
+    runtime_data: HtdRuntimeData,
+    zones: Iterable[int],
+    optimistic: bool = False
+):
+    return [
+        HtdDevice(
+            unique_id,
+            device_name,
+            zone,
+            runtime_data,
+            optimistic
+        )
+        for zone in zones
+    ]
 
 
 class HtdDevice(MediaPlayerEntity):
+    """
+    A zone of a gateway. It keeps no copy of the zone, every property is read
+    from the zone store of the client, which the codec fills once per frame.
+    """
+
     should_poll = False
 
     _attr_supported_features = SUPPORT_HTD
     _attr_device_class = MediaPlayerDeviceClass.SPEAKER
     _attr_media_content_type = MediaType.MUSIC
 
-
-    device_name: str = None
-    client: BaseClient = None
-    sources: [str] = None
-    zone: int = None
-    changing_volume: int | None = None
-    zone_info: ZoneDetail = None
-    _attr_volume_level: float | None = None
-    _attr_is_volume_muted: bool | None = None
-    _attr_source: str | None = None
+    device_name: str
+    zone: int
+    client: BaseClient
+    zones: HtdZoneStore
+    dispatcher: HtdZoneDispatcher
+    scheduler: HtdCommandScheduler
+    ramps: HtdVolumeRamps
+    groups: HtdZoneGroups
+    _optimistic: HtdOptimisticState | None
+    _optimistic_timer: CALLBACK_TYPE | None
+    _state_fingerprint: tuple | None
+    _write_handle: asyncio.Handle | None
 
     def __init__(
         self,
         unique_id,
         device_name,
         zone,
-        sources,
-        client
+        runtime_data: HtdRuntimeData,
+        optimistic: bool = False
     ):
         self._attr_unique_id = f"{unique_id}_{zone:02}"
         self.device_name = device_name
         self.zone = zone
-        self.client = client
-        self.sources = sources
+        self.client = runtime_data.client
+        self.zones = runtime_data.dispatcher.zones
+        self.dispatcher = runtime_data.dispatcher
+        self.scheduler = runtime_data.scheduler
+        self.ramps = runtime_data.ramps
+        self.groups = runtime_data.groups
+        self._optimistic = None
+        self._optimistic_timer = None
+        self._state_fingerprint = None
+        self._write_handle = None
+
+        if optimistic:
+            self._optimistic = HtdOptimisticState(runtime_data.optimistic_stats, OPTIMISTIC_TIMEOUT)
+
         zone_fmt = f"02" if self.client.model["zones"] > 10 else "01"
         self.entity_id = get_media_player_entity_id(device_name, zone, zone_fmt)
 
     @property
     def enabled(self) -> bool:
-        return self.zone_info is not None and self.zone_info.enabled
+        return bool(self.zones.get(self.zone, FIELD_ENABLED))
 
 
     @property
     def name(self):
         return f"Zone {self.zone} ({self.device_name})"
 
-    def update(self):
-        # This method is not used as should_poll is False.
-        # State updates are handled via _do_update callback.
-        pass
-
     @property
     def state(self):
         if not self.client.connected:
             return STATE_UNAVAILABLE
 
-        if self.zone_info is None:
+        if not self.zones.has_state(self.zone):
             return STATE_UNKNOWN
 
-        if self.zone_info.power:
+        if self._get(FIELD_POWER):
             return STATE_ON
 
         return STATE_OFF
@@ -163,15 +230,19 @@ class HtdDevice(MediaPlayerEntity):
         return 1 / HtdConstants.MAX_VOLUME
 
     async def async_volume_up(self) -> None:
-        await self.client.async_volume_up(self.zone)
+        self.ramps.async_cancel(self.zone)
+        await self.scheduler.async_volume_up(self.zone)
 
     async def async_volume_down(self) -> None:
-        await self.client.async_volume_down(self.zone)
+        self.ramps.async_cancel(self.zone)
+        await self.scheduler.async_volume_down(self.zone)
 
     async def async_turn_on(self):
         _LOGGER.debug("Attempting to turn on zone %d for device %s", self.zone, self.device_name)
         try:
-            await self.client.async_power_on(self.zone)
+            await self._async_send_to_group(
+                FIELD_POWER, True, lambda zone: self.scheduler.async_power(zone, True)
+            )
             _LOGGER.debug("Successfully called async_power_on for zone %d", self.zone)
         except Exception as e:
             _LOGGER.error("Error turning on zone %d: %s", self.zone, e)
@@ -181,7 +252,9 @@ class HtdDevice(MediaPlayerEntity):
     async def async_turn_off(self):
         _LOGGER.debug("Attempting to turn off zone %d for device %s", self.zone, self.device_name)
         try:
-            await self.client.async_power_off(self.zone)
+            await self._async_send_to_group(
+                FIELD_POWER, False, lambda zone: self.scheduler.async_power(zone, False)
+            )
             _LOGGER.debug("Successfully called async_power_off for zone %d", self.zone)
         except Exception as e:
             _LOGGER.error("Error turning off zone %d: %s", self.zone, e)
@@ -189,29 +262,40 @@ class HtdDevice(MediaPlayerEntity):
 
     @property
     def volume_level(self) -> float | None:
-        return self._attr_volume_level
+        volume = self._get(FIELD_VOLUME)
+
+        # a zone the keypad frame announced has no status yet
+        return volume / HtdConstants.MAX_VOLUME if volume is not None else None
 
 
     @property
     def available(self) -> bool:
-        return self.client.ready and self.zone_info is not None
+        # a zone disabled on the gateway keeps its entity, with its name and area, but shows no state
+        return self.client.ready and self.zones.has_state(self.zone) and not self.zones.is_disabled(self.zone)
 
     async def async_set_volume_level(self, volume: float):
         converted_volume = int(volume * HtdConstants.MAX_VOLUME)
-        _LOGGER.info("setting new volume for zone %d to %f, raw htd = %d" % (self.zone, volume, converted_volume))
-        await self.client.async_set_volume(self.zone, converted_volume)
+        _LOGGER.debug("setting new volume for zone %d to %f, raw htd = %d", self.zone, volume, converted_volume)
+        # intermediate volumes of a slider drag are dropped by the scheduler
+        await self._async_send_to_group(
+            FIELD_VOLUME, converted_volume, lambda zone: self._async_set_zone_volume(zone, converted_volume)
+        )
+
+    async def _async_set_zone_volume(self, zone: int, volume: int) -> None:
+        # a volume set by hand wins over a ramp that is still running
+        self.ramps.async_cancel(zone)
+        await self.scheduler.async_set_volume(zone, volume)
 
     @property
     def is_volume_muted(self) -> bool | None:
-        return self._attr_is_volume_muted
+        return self._get(FIELD_MUTE)
 
     async def async_mute_volume(self, mute):
         _LOGGER.debug("Attempting to set mute state to %s for zone %d", mute, self.zone)
         try:
-            if mute:
-                await self.client.async_mute(self.zone)
-            else:
-                await self.client.async_unmute(self.zone)
+            await self._async_send_optimistic(
+                FIELD_MUTE, mute, self.scheduler.async_mute(self.zone, mute)
+            )
             _LOGGER.debug("Successfully set mute state to %s for zone %d", mute, self.zone)
         except Exception as e:
             _LOGGER.error("Error setting mute state for zone %d: %s", self.zone, e)
@@ -220,19 +304,87 @@ class HtdDevice(MediaPlayerEntity):
 
     @property
     def source(self) -> str | None:
-        return self._attr_source
+        return self.zones.get_source_name(self._get(FIELD_SOURCE))
 
     @property
     def source_list(self):
-        return self.sources
+        return self.zones.sources
 
     @property
     def media_title(self):
         return self.source
 
     async def async_select_source(self, source: str):
-        source_index = self.sources.index(source)
-        await self.client.async_set_source(self.zone, source_index + 1)
+        source_index = self.zones.sources.index(source)
+        await self._async_send_to_group(
+            FIELD_SOURCE, source_index + 1, lambda zone: self.scheduler.async_set_source(zone, source_index + 1)
+        )
+
+    @property
+    def group_members(self) -> list[str]:
+        return self.groups.get_members(self.zone)
+
+    async def async_join_players(self, group_members: list[str]) -> None:
+        zones = []
+
+        for entity_id in group_members:
+            zone = self.groups.get_zone(entity_id)
+
+            if zone is None:
+                raise ServiceValidationError(
+                    f"{entity_id} can't be joined to {self.entity_id}, only zones of the same gateway can be grouped"
+                )
+
+            zones.append(zone)
+
+        self.groups.async_join(self.zone, zones)
+
+        if not self.zones.has_state(self.zone):
+            return
+
+        power = self.zones.get(self.zone, FIELD_POWER)
+        source = self.zones.get(self.zone, FIELD_SOURCE)
+
+        # the members follow the leader, bring them to its power and source in one batch
+        await self._async_send_to_group(
+            FIELD_POWER, power, lambda zone: self.scheduler.async_power(zone, power)
+        )
+        await self._async_send_to_group(
+            FIELD_SOURCE, source, lambda zone: self.scheduler.async_set_source(zone, source)
+        )
+
+    async def async_unjoin_player(self) -> None:
+        self.groups.async_unjoin(self.zone)
+
+    @callback
+    def async_group_changed(self) -> None:
+        self._async_schedule_state_write()
+
+    async def _async_send_to_group(
+        self,
+        field: str,
+        expected,
+        send: Callable[[int], Coroutine]
+    ) -> None:
+        """
+        Send a command to this zone, or to every zone of the group it leads.
+        The commands are queued together so they go out as one pipelined batch.
+        """
+        entities = [self.groups.get_entity(zone) or self for zone in self.groups.get_zones(self.zone)]
+
+        await asyncio.gather(
+            *(entity._async_send_optimistic(field, expected, send(entity.zone)) for entity in entities)
+        )
+
+    @callback
+    def async_apply_options(self, device_name: str) -> None:
+        """Pick up a new device name or source labels without being recreated."""
+        self.device_name = device_name
+
+        # the labels are read from the store, but neither the name nor the source list
+        # is part of the fingerprint, so the next write must not be skipped
+        self._state_fingerprint = None
+        self._async_schedule_state_write()
 
     async def async_media_play(self):
         await self.async_turn_on()
@@ -254,49 +406,145 @@ class HtdDevice(MediaPlayerEntity):
 
     async def async_added_to_hass(self):
         """Run when this Entity has been added to HA."""
-        # Sensors should also register callbacks to HA when their state changes
-        # print('registering callback')
-        await self.client.async_subscribe(self._do_update)
-        self.client.refresh()
-
-    async def async_will_remove_from_hass(self):
-        """Entity being removed from hass."""
-        # The opposite of async_added_to_hass. Remove any registered call backs here.
-        await self.client.async_unsubscribe(self._do_update)
-
-    def _update_properties(self) -> None:
-        """Update entity attributes from the latest zone information."""
-        if self.zone_info is None:
-            self._attr_volume_level = None
-            self._attr_is_volume_muted = None
-            self._attr_source = None
+        # the dispatcher only calls us back for our own zone and global updates
+        self.async_on_remove(
+            self.dispatcher.async_register(self.zone, self._do_update)
+        )
+
+        self.async_on_remove(self._cancel_state_write)
+        self.async_on_remove(self.groups.async_register(self.zone, self))
+
+        # the gateway is refreshed once per client after all zones are added,
+        # pick up whatever that refresh has already delivered
+        self._do_update(0)
+
+    @callback
+    def _cancel_state_write(self) -> None:
+        if self._write_handle is not None:
+            self._write_handle.cancel()
+            self._write_handle = None
+
+        if self._optimistic_timer is not None:
+            self._optimistic_timer()
+            self._optimistic_timer = None
+
+    def _get(self, field: str):
+        """A field of the zone, or the value a pending optimistic command expects."""
+        value = self.zones.get(self.zone, field)
+
+        if self._optimistic is not None and self._optimistic.has_pending:
+            value = self._optimistic.get(field, value)
+
+        return value
+
+    @callback
+    def _async_reconcile_optimistic(self) -> None:
+        """Settle the optimistic values the gateway confirmed or that timed out."""
+        if self._optimistic is None or not self._optimistic.has_pending:
             return
 
-        self._attr_volume_level = (
-            self.zone_info.volume / HtdConstants.MAX_VOLUME
-        )
-        self._attr_is_volume_muted = self.zone_info.mute
+        now = self.hass.loop.time()
+
+        for field in self._optimistic.pending_fields:
+            self._optimistic.reconcile(field, self.zones.get(self.zone, field), now)
+
+    async def _async_send_optimistic(self, field: str, expected, command: Coroutine) -> None:
+        """
+        Send a command, showing the expected value right away when optimistic
+        mode is on. The value is rolled back if the command fails.
+        """
+        if self._optimistic is None or not self.zones.has_state(self.zone):
+            await command
+            return
+
+        previous = self.zones.get(self.zone, field)
+        self._optimistic.set(field, expected, previous, self.hass.loop.time())
+        self._async_schedule_state_write()
+
         try:
-            self._attr_source = self.sources[self.zone_info.source - 1]
-        except (IndexError, TypeError):
-            self._attr_source = None
+            await command
+        except Exception:
+            self._optimistic.cancel(field)
+            self._async_schedule_state_write()
+            raise
+
+    @callback
+    def _async_schedule_optimistic_timeout(self) -> None:
+        if self._optimistic_timer is not None:
+            self._optimistic_timer()
+            self._optimistic_timer = None
+
+        deadline = self._optimistic.next_deadline
+
+        if deadline is None:
+            return
+
+        self._optimistic_timer = async_call_later(
+            self.hass,
+            max(deadline - self.hass.loop.time(), 0),
+            self._async_optimistic_timeout
+        )
+
+    @callback
+    def _async_optimistic_timeout(self, _) -> None:
+        # nothing confirmed the command in time, reconcile with what the gateway reported
+        self._optimistic_timer = None
+        self._async_reconcile_optimistic()
+        self._async_schedule_state_write()
+
+    def _get_state_fingerprint(self) -> tuple:
+        """A compact snapshot of everything this entity writes to the state machine."""
+        return (
+            self.available,
+            self.state,
+            self.volume_level,
+            self.is_volume_muted,
+            self.source,
+            tuple(self.group_members),
+        )
+
+    @callback
+    def _async_schedule_state_write(self) -> None:
+        # frames that arrive within the same loop iteration collapse into one write
+        if self._write_handle is not None:
+            return
+
+        self._write_handle = self.hass.loop.call_soon(self._async_write_state_if_changed)
+
+    @callback
+    def _async_write_state_if_changed(self) -> None:
+        self._write_handle = None
+        fingerprint = self._get_state_fingerprint()
+
+        # the values still pending need a timeout, the settled ones no longer do
+        if self._optimistic is not None:
+            self._async_schedule_optimistic_timeout()
 
+        if fingerprint == self._state_fingerprint:
+            self.dispatcher.async_record_state_write(False)
+            return
+
+        self._state_fingerprint = fingerprint
+        self.dispatcher.async_record_state_write(True)
+        self.async_write_ha_state()
+
+    @callback
     def _do_update(self, zone: int):
-        # If a specific zone is provided and it's not this entity's zone, ignore.
-        # Zone 0 typically indicates a global update, which we should process.
-        if zone is not None and zone != 0 and zone != self.zone:
+        # The dispatcher only routes this zone's updates and zone 0 (global) updates here.
+        # Without a connection there is no zone data, but availability may have changed.
+        if not self.client.connected:
+            self._async_schedule_state_write()
             return
 
-        # If the client does not have data for this specific zone yet, do not proceed.
-        if not self.client.has_zone_data(self.zone):
+        # If the store has no status for this specific zone yet, do not proceed.
+        if not self.zones.has_state(self.zone):
+            self.dispatcher.async_record_ignored()
             return
 
         # If it's an MCA client and a volume target is set, defer the update for volume-related properties.
         if isinstance(self.client, HtdMcaClient) and self.client.has_volume_target(self.zone):
+            self.dispatcher.async_record_ignored()
             return
 
-        # Update this entity's zone information regardless of the update source (specific zone or global).
-        self.zone_info = self.client.get_zone(self.zone)
-        self._update_properties()
-        self.schedule_update_ha_state(force_refresh=True)
-
+        self._async_reconcile_optimistic()
+        self._async_schedule_state_write()
@@ -0,0 +1,86 @@
+"""Fixed-size runtime metrics for HTD gateways"""
+
+from array import array
+
+# the upper bounds of the command latency buckets, in seconds, slower
+# commands land in one last bucket
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# the number of recent latencies kept for percentiles
+LATENCY_SAMPLES = 128
+
+# the number of one second buckets the frame rate is averaged over
+FRAME_RATE_WINDOW = 60
+
+
+class HtdLatencyHistogram:
+    """
+    Counts command latencies into fixed buckets and keeps the most recent
+    ones in a ring buffer, recording never allocates.
+    """
+
+    def __init__(self, samples: int = LATENCY_SAMPLES):
+        self._counts = array("L", [0] * (len(LATENCY_BUCKETS) + 1))
+        self._samples = array("d", [0.0] * samples)
+        self._next = 0
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds: float) -> None:
+        bucket = 0
+
+        while bucket < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[bucket]:
+            bucket += 1
+
+        self._counts[bucket] += 1
+        self._samples[self._next] = seconds
+        self._next = (self._next + 1) % len(self._samples)
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, percent: float) -> float | None:
+        """The percentile of the recent latencies, or None before the first command."""
+        recent = sorted(self._samples[:min(self.count, len(self._samples))])
+
+        if not recent:
+            return None
+
+        return recent[min(int(len(recent) * percent / 100), len(recent) - 1)]
+
+    def as_dict(self) -> dict:
+        labels = [f"<={bound}" for bound in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}"]
+
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "buckets": dict(zip(labels, self._counts)),
+        }
+
+
+class HtdFrameRate:
+    """Counts frames into one second buckets of a fixed window."""
+
+    def __init__(self, window: int = FRAME_RATE_WINDOW):
+        self._buckets = array("L", [0] * window)
+        self._second = 0
+
+    def record(self, now: float) -> None:
+        self._advance(int(now))
+        self._buckets[self._second % len(self._buckets)] += 1
+
+    def rate(self, now: float) -> float:
+        """The average number of frames per second over the window."""
+        self._advance(int(now))
+        return sum(self._buckets) / len(self._buckets)
+
+    def _advance(self, second: int) -> None:
+        if second == self._second:
+            return
+
+        # clear the buckets of the seconds without frames
+        for skipped in range(self._second + 1, self._second + 1 + min(second - self._second, len(self._buckets))):
+            self._buckets[skipped % len(self._buckets)] = 0
+
+        self._second = second
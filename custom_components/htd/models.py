@@ -0,0 +1,39 @@
+"""Runtime models for the HTD integration"""
+
+from dataclasses import dataclass, field
+from typing import Any
+
+from homeassistant.config_entries import ConfigEntry
+
+from .capture import HtdTrafficCapture
+from .client import HtdGatewayClient
+from .connection import HtdConnectionManager
+from .dispatcher import HtdZoneDispatcher
+from .group import HtdZoneGroups
+from .optimistic import OptimisticStats
+from .ramp import HtdVolumeRamps
+from .scheduler import HtdCommandScheduler
+from .snapshot import ZoneSnapshot
+from .watchdog import HtdStaleWatchdog
+
+
+@dataclass
+class HtdRuntimeData:
+    """Everything the platforms need to talk to one gateway."""
+
+    client: HtdGatewayClient
+    dispatcher: HtdZoneDispatcher
+    connection: HtdConnectionManager
+    scheduler: HtdCommandScheduler
+    watchdog: HtdStaleWatchdog
+    ramps: HtdVolumeRamps
+    groups: HtdZoneGroups = field(default_factory=HtdZoneGroups)
+    optimistic_stats: OptimisticStats = field(default_factory=dict)
+    snapshots: dict[str, ZoneSnapshot] = field(default_factory=dict)
+    # only config entries can turn the capture on
+    capture: HtdTrafficCapture | None = None
+    # the entry data the runtime was last configured from, to tell what an update changed
+    applied_data: dict[str, Any] = field(default_factory=dict)
+
+
+HtdClientConfigEntry = ConfigEntry[HtdRuntimeData]
@@ -0,0 +1,89 @@
+"""Bass, treble and balance of HTD zones"""
+
+import logging
+from dataclasses import dataclass
+
+from homeassistant.components.number import NumberEntity, NumberEntityDescription, NumberMode
+from homeassistant.const import EntityCategory, Platform
+from homeassistant.core import HomeAssistant
+from htd_client import HtdConstants
+
+from .entity import HtdZoneEntity, async_setup_zone_entities
+from .models import HtdClientConfigEntry, HtdRuntimeData
+from .optimistic import FIELD_BALANCE, FIELD_BASS, FIELD_TREBLE
+
+_LOGGER = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, kw_only=True)
+class HtdToneNumberEntityDescription(NumberEntityDescription):
+    field: str
+
+
+TONE_NUMBERS = (
+    HtdToneNumberEntityDescription(
+        key=FIELD_BASS,
+        name="Bass",
+        icon="mdi:speaker",
+        field=FIELD_BASS,
+        native_min_value=HtdConstants.MIN_BASS,
+        native_max_value=HtdConstants.MAX_BASS,
+    ),
+    HtdToneNumberEntityDescription(
+        key=FIELD_TREBLE,
+        name="Treble",
+        icon="mdi:music-clef-treble",
+        field=FIELD_TREBLE,
+        native_min_value=HtdConstants.MIN_TREBLE,
+        native_max_value=HtdConstants.MAX_TREBLE,
+    ),
+    HtdToneNumberEntityDescription(
+        key=FIELD_BALANCE,
+        name="Balance",
+        icon="mdi:scale-balance",
+        field=FIELD_BALANCE,
+        native_min_value=HtdConstants.MIN_BALANCE,
+        native_max_value=HtdConstants.MAX_BALANCE,
+    ),
+)
+
+
+async def async_setup_entry(hass: HomeAssistant, config_entry: HtdClientConfigEntry, async_add_entities):
+    def _create(unique_id: str, device_name: str, zone: int, runtime_data: HtdRuntimeData):
+        return [
+            HtdToneNumber(unique_id, device_name, zone, runtime_data, description)
+            for description in TONE_NUMBERS
+        ]
+
+    async_setup_zone_entities(hass, config_entry, async_add_entities, _create)
+
+
+class HtdToneNumber(HtdZoneEntity, NumberEntity):
+    entity_description: HtdToneNumberEntityDescription
+
+    platform_domain = Platform.NUMBER
+
+    _attr_entity_category = EntityCategory.CONFIG
+    _attr_mode = NumberMode.SLIDER
+    _attr_native_step = 1
+
+    def __init__(
+        self,
+        unique_id: str,
+        device_name: str,
+        zone: int,
+        runtime_data: HtdRuntimeData,
+        description: HtdToneNumberEntityDescription,
+    ):
+        super().__init__(unique_id, device_name, zone, runtime_data, description, (description.field,))
+
+    @property
+    def native_value(self) -> int | None:
+        return self.zones.get(self.zone, self.entity_description.field)
+
+    async def async_set_native_value(self, value: float) -> None:
+        field = self.entity_description.field
+        _LOGGER.debug("Setting the %s of zone %d to %d", field, self.zone, value)
+
+        # the values of a slider drag replace each other in the queue, only the last one is sent
+        await self.scheduler.async_set_tone(self.zone, field, int(value))
@@ -0,0 +1,112 @@
+"""Optimistic zone state for HTD entities"""
+
+from collections import Counter
+from typing import Any
+
+FIELD_POWER = "power"
+FIELD_MUTE = "mute"
+FIELD_SOURCE = "source"
+FIELD_VOLUME = "volume"
+FIELD_BASS = "bass"
+FIELD_TREBLE = "treble"
+FIELD_BALANCE = "balance"
+
+# what happened to an optimistic value once the gateway had its say
+OUTCOME_CONFIRMED = "confirmed"
+OUTCOME_CORRECTED = "corrected"
+OUTCOME_ROLLED_BACK = "rolled_back"
+
+OptimisticStats = dict[str, Counter]
+
+
+class HtdOptimisticState:
+    """
+    Tracks the values a zone was optimistically set to until the gateway
+    confirms them, or until they time out and the reported value wins.
+    """
+
+    def __init__(self, stats: OptimisticStats, timeout: float):
+        self._stats = stats
+        self._timeout = timeout
+        self._pending: dict[str, tuple[Any, Any, float]] = {}
+
+    @property
+    def has_pending(self) -> bool:
+        return len(self._pending) > 0
+
+    @property
+    def pending_fields(self) -> list[str]:
+        return list(self._pending)
+
+    @property
+    def next_deadline(self) -> float | None:
+        if not self._pending:
+            return None
+
+        return min(deadline for _, _, deadline in self._pending.values())
+
+    def set(self, field: str, expected: Any, previous: Any, now: float) -> None:
+        """
+        Record a value that was applied before the gateway confirmed it.
+
+        Args:
+            field (str): the zone field, e.g. FIELD_VOLUME
+            expected (Any): the value the command should result in
+            previous (Any): the value the gateway reported before the command
+            now (float): the current loop time
+        """
+        # a newer command for the same field keeps the original previous value
+        if field in self._pending:
+            previous = self._pending[field][1]
+
+        self._pending[field] = (expected, previous, now + self._timeout)
+
+    def cancel(self, field: str) -> None:
+        """The command failed, the reported value is shown again."""
+        if self._pending.pop(field, None) is not None:
+            self._record(field, OUTCOME_ROLLED_BACK)
+
+    def get(self, field: str, actual: Any) -> Any:
+        """The value to show for a field, the optimistic one while it is pending."""
+        pending = self._pending.get(field)
+
+        return actual if pending is None else pending[0]
+
+    def reconcile(self, field: str, actual: Any, now: float) -> Any:
+        """
+        Settle a pending value once the gateway confirmed it or it timed out.
+
+        Args:
+            field (str): the zone field
+            actual (Any): the value the gateway reported
+            now (float): the current loop time
+
+        Returns:
+            Any: the optimistic value while it is pending, otherwise the reported one
+        """
+        pending = self._pending.get(field)
+
+        if pending is None:
+            return actual
+
+        expected, previous, deadline = pending
+
+        if actual == expected:
+            del self._pending[field]
+            self._record(field, OUTCOME_CONFIRMED)
+            return actual
+
+        if now < deadline:
+            return expected
+
+        del self._pending[field]
+
+        if actual == previous:
+            self._record(field, OUTCOME_ROLLED_BACK)
+        else:
+            self._record(field, OUTCOME_CORRECTED)
+
+        return actual
+
+    def _record(self, field: str, outcome: str) -> None:
+        self._stats.setdefault(field, Counter())[outcome] += 1
@@ -0,0 +1,353 @@
+"""
+The HTD frame format, decoded and encoded without going through htd_client.
+
+Every frame is the header (``0x02 0x00``), the zone, the command, its data
+and a checksum, the low byte of the sum of everything before it, see
+`HTD MCA-66 Hex Codes.pdf`. The command of a frame from the gateway decides
+how much data follows, a command sent to the gateway has one data byte and
+some lync commands one more.
+"""
+
+import logging
+from typing import Callable, Iterator, Tuple
+
+from htd_client.constants import (
+    HtdCommonCommands,
+    HtdConstants,
+    HtdDeviceKind,
+    HtdLyncCommands,
+    HtdLyncConstants,
+    HtdMcaCommands,
+    HtdMcaConstants,
+    HtdModelInfo,
+)
+from htd_client.utils import convert_volume_to_raw
+
+_LOGGER = logging.getLogger(__name__)
+
+HEADER = bytes(HtdConstants.MESSAGE_HEADER)
+HEADER_BYTE = HtdConstants.HEADER_BYTE
+RESERVED_BYTE = HtdConstants.RESERVED_BYTE
+
+# header + zone + command, the data starts right after it
+FRAME_PREFIX_LENGTH = HtdConstants.MESSAGE_HEADER_LENGTH + 2
+
+# the shortest frame the gateway sends, one data byte and the checksum
+MIN_FRAME_LENGTH = FRAME_PREFIX_LENGTH + 2
+
+# the data length of every command the gateway sends, indexed by the command, 0 if it sends no such command
+RECEIVE_DATA_LENGTHS = bytes(
+    HtdCommonCommands.EXPECTED_MESSAGE_LENGTH_MAP.get(command, 0) for command in range(256)
+)
+
+# a little over a second of traffic at 38400 baud, far more than a frame
+DEFAULT_BUFFER_SIZE = 4096
+
+# the frames that are parsed straight from the buffer, htd_client only indexes their data
+VIEW_COMMANDS = frozenset((HtdCommonCommands.ZONE_STATUS_RECEIVE_COMMAND,))
+
+# the direction of the bytes handed to a recorder
+DIRECTION_RECEIVED = 0
+DIRECTION_SENT = 1
+
+Frame = Tuple[int, int, memoryview]
+FrameHandler = Callable[[int, int, memoryview], None]
+Recorder = Callable[[int, bytes], None]
+
+
+def calculate_checksum(frame) -> int:
+    return sum(frame) & 0xff
+
+
+def build_frame(zone: int, command: int, data: bytes | list[int]) -> bytes:
+    frame = bytearray(HEADER)
+    frame.append(zone)
+    frame.append(command)
+    frame += bytes(data)
+    frame.append(calculate_checksum(frame))
+    return bytes(frame)
+
+
+def _lync_command_codes(source_count: int) -> list[Tuple[int, int]]:
+    common = HtdLyncCommands.COMMON_COMMAND_CODE
+    codes = [
+        (common, HtdLyncCommands.POWER_ON_ZONE_COMMAND_CODE),
+        (common, HtdLyncCommands.POWER_OFF_ZONE_COMMAND_CODE),
+        (common, HtdLyncCommands.POWER_ON_ALL_ZONES_COMMAND_CODE),
+        (common, HtdLyncCommands.POWER_OFF_ALL_ZONES_COMMAND_CODE),
+        (common, HtdLyncCommands.MUTE_ON_COMMAND_CODE),
+        (common, HtdLyncCommands.MUTE_OFF_COMMAND_CODE),
+        (common, HtdLyncConstants.INTERCOM_SOURCE_DATA),
+        (HtdLyncCommands.QUERY_COMMAND_CODE, 1),
+    ]
+
+    # the last source is the intercom, the others are split in two ranges
+    for source in range(1, source_count):
+        offset = HtdLyncConstants.SOURCE_13_HIGHER_COMMAND_OFFSET if source > 12 else HtdLyncConstants.SOURCE_COMMAND_OFFSET
+        codes.append((common, source + offset))
+
+    for volume in range(HtdConstants.MAX_VOLUME + 1):
+        codes.append((HtdLyncCommands.VOLUME_SETTING_CONTROL_COMMAND_CODE, convert_volume_to_raw(volume)))
+
+    return codes
+
+
+def _mca_command_codes(source_count: int) -> list[Tuple[int, int]]:
+    common = HtdMcaCommands.COMMON_COMMAND_CODE
+    codes = [
+        (common, HtdMcaCommands.POWER_ON_ZONE_COMMAND_CODE),
+        (common, HtdMcaCommands.POWER_OFF_ZONE_COMMAND_CODE),
+        (common, HtdMcaCommands.POWER_ON_ALL_ZONES_COMMAND_CODE),
+        (common, HtdMcaCommands.POWER_OFF_ALL_ZONES_COMMAND_CODE),
+        (common, HtdMcaCommands.TOGGLE_MUTE_COMMAND),
+        (common, HtdMcaCommands.VOLUME_UP_COMMAND),
+        (common, HtdMcaCommands.VOLUME_DOWN_COMMAND),
+        (common, HtdMcaCommands.BASS_UP_COMMAND),
+        (common, HtdMcaCommands.BASS_DOWN_COMMAND),
+        (common, HtdMcaCommands.TREBLE_UP_COMMAND),
+        (common, HtdMcaCommands.TREBLE_DOWN_COMMAND),
+        (common, HtdMcaCommands.BALANCE_RIGHT_COMMAND),
+        (common, HtdMcaCommands.BALANCE_LEFT_COMMAND),
+        (HtdMcaCommands.QUERY_COMMAND_CODE, 0),
+    ]
+
+    for source in range(1, source_count + 1):
+        codes.append((common, HtdMcaConstants.SOURCE_COMMAND_OFFSET + source))
+
+    return codes
+
+
+class HtdCommandTable:
+    """
+    Every command frame with a single data byte that a client sends, built
+    once for each zone of the model. Anything else, like the bass of a lync
+    with its extra data byte, is built when it's sent.
+    """
+
+    def __init__(self, kind: HtdDeviceKind, zone_count: int, source_count: int):
+        codes = _lync_command_codes(source_count) if kind == HtdDeviceKind.lync else _mca_command_codes(source_count)
+
+        # zone 0 addresses every zone at once
+        self._frames: dict[Tuple[int, int, int], bytes] = {
+            (zone, command, data_code): build_frame(zone, command, (data_code,))
+            for zone in range(zone_count + 1)
+            for command, data_code in codes
+        }
+
+        self.frames_built = 0
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def get(self, zone: int, command: int, data_code: int, extra_data: bytes | None = None) -> bytes:
+        if extra_data is None:
+            frame = self._frames.get((zone, command, data_code))
+
+            if frame is not None:
+                return frame
+
+        self.frames_built += 1
+        return build_frame(zone, command, (data_code, *(extra_data or ())))
+
+
+class HtdFrameDecoder:
+    """
+    Splits the byte stream of a gateway into frames. The bytes are kept in
+    one buffer that is never reallocated, frames are checked and handed out
+    as views into it, and anything that isn't a valid frame is skipped up to
+    the next header.
+    """
+
+    def __init__(self, size: int = DEFAULT_BUFFER_SIZE):
+        self._size = size
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+
+        self.frames_decoded = 0
+        self.checksum_errors = 0
+        self.unknown_commands = 0
+        self.resyncs = 0
+        self.bytes_discarded = 0
+        self.overflows = 0
+
+    def __len__(self) -> int:
+        """The bytes waiting for the rest of their frame."""
+        return self._end - self._start
+
+    def reset(self) -> None:
+        """Drop the buffered bytes, e.g. when a new connection starts a new stream."""
+        self._start = self._end = 0
+
+    def feed(self, data: bytes | bytearray | memoryview) -> None:
+        """Append received bytes, the views of frames handed out before become invalid."""
+        size = len(data)
+
+        if self._end + size > self._size:
+            self._make_room(size)
+
+            if size > self._size:
+                data = memoryview(data)[size - self._size:]
+                size = self._size
+
+        self._view[self._end:self._end + size] = data
+        self._end += size
+
+    def frames(self) -> Iterator[Frame]:
+        """
+        Yield the zone, command and data of each complete frame, leaving a
+        partial frame for the next feed. The data is a view into the buffer,
+        it's only valid until the next feed.
+        """
+        buffer = self._buffer
+        view = self._view
+        lengths = RECEIVE_DATA_LENGTHS
+
+        start = self._start
+
+        while self._end - start >= MIN_FRAME_LENGTH:
+            if buffer[start] != HEADER_BYTE or buffer[start + 1] != RESERVED_BYTE:
+                start = self._resync(start)
+                continue
+
+            command = buffer[start + 3]
+            length = lengths[command]
+
+            if not length:
+                self.unknown_commands += 1
+                start = self._resync(start + 1)
+                continue
+
+            checksum_index = start + FRAME_PREFIX_LENGTH + length
+
+            # not complete yet
+            if checksum_index >= self._end:
+                break
+
+            if sum(view[start:checksum_index]) & 0xff != buffer[checksum_index]:
+                self.checksum_errors += 1
+                start = self._resync(start + 1)
+                continue
+
+            self.frames_decoded += 1
+            self._start = checksum_index + 1
+
+            yield buffer[start + 2], command, view[start + FRAME_PREFIX_LENGTH:checksum_index]
+
+            # the consumer may have fed more in the meantime
+            start = self._start
+
+        self._start = start
+
+        # an empty buffer starts over at the front, it never has to be compacted
+        if start == self._end:
+            self._start = self._end = 0
+
+    def _resync(self, start: int) -> int:
+        """Skip to the next header after the start, or to the end of what's buffered."""
+        end = self._end
+        index = self._buffer.find(HEADER, start, end)
+
+        if index < 0:
+            # the last byte may be the first half of the next header
+            index = end - 1 if self._buffer[end - 1] == HEADER_BYTE else end
+
+        if index > self._start:
+            self.resyncs += 1
+            self.bytes_discarded += index - self._start
+
+        self._start = index
+        return index
+
+    def _make_room(self, size: int) -> None:
+        pending = self._end - self._start
+
+        # more than the buffer holds, the oldest bytes can't be part of a frame anymore
+        if pending + size > self._size:
+            drop = min(pending + size - self._size, pending)
+            self.overflows += 1
+            self.resyncs += 1
+            self.bytes_discarded += drop + max(size - self._size, 0)
+            self._start += drop
+            pending -= drop
+
+        # a partial frame is all that is ever left over, moving it is cheap
+        self._view[:pending] = self._view[self._start:self._end]
+        self._start = 0
+        self._end = pending
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "frames_decoded": self.frames_decoded,
+            "checksum_errors": self.checksum_errors,
+            "unknown_commands": self.unknown_commands,
+            "resyncs": self.resyncs,
+            "bytes_discarded": self.bytes_discarded,
+            "overflows": self.overflows,
+            "bytes_buffered": len(self),
+        }
+
+
+class HtdClientCodec:
+    """
+    The framing of a client: the bytes it receives are split into checked
+    frames by the decoder, and the commands it sends come from the prebuilt
+    table. Both directions are handed to the recorder while the traffic is
+    captured.
+    """
+
+    def __init__(self, model_info: HtdModelInfo, decoder: HtdFrameDecoder | None = None):
+        self.decoder = decoder or HtdFrameDecoder()
+        self.commands = HtdCommandTable(model_info["kind"], model_info["zones"], model_info["sources"])
+        self._transport = None
+        self._frame_handlers: list[FrameHandler] = []
+
+        # called with every read and write while the traffic is captured
+        self.recorder: Recorder | None = None
+
+    def add_frame_handler(self, handler: FrameHandler) -> None:
+        """Called with the zone, command and data of each frame before the client parses it."""
+        self._frame_handlers.append(handler)
+
+    def remove_frame_handler(self, handler: FrameHandler) -> None:
+        if handler in self._frame_handlers:
+            self._frame_handlers.remove(handler)
+
+    def decode(self, data: bytes, transport) -> Iterator[Frame]:
+        """
+        Yield the zone, command and data of each frame completed by what the
+        transport received. The data is only valid until the next call.
+        """
+        # the tail of a lost connection never completes a frame of the next one
+        if transport is not self._transport:
+            self._transport = transport
+            self.decoder.reset()
+
+        if self.recorder is not None:
+            self.recorder(DIRECTION_RECEIVED, data)
+
+        self.decoder.feed(data)
+
+        for zone, command, frame_data in self.decoder.frames():
+            for handler in self._frame_handlers:
+                handler(zone, command, frame_data)
+
+            yield zone, command, frame_data
+
+    def encode(self, zone: int, command: int, data_code: int, extra_data: bytes | None = None) -> bytes:
+        frame = self.commands.get(zone, command, data_code, extra_data)
+
+        if self.recorder is not None:
+            self.recorder(DIRECTION_SENT, frame)
+
+        return frame
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            **self.decoder.stats,
+            "command_frames": len(self.commands),
+            "command_frames_built": self.commands.frames_built,
+        }
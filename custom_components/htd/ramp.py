@@ -0,0 +1,134 @@
+"""Volume ramps for HTD zones, e.g. a fade-in for a wake-up"""
+
+import asyncio
+import logging
+
+from homeassistant.core import HomeAssistant, callback
+from htd_client import BaseClient
+
+from .scheduler import HtdCommandScheduler
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class HtdVolumeRamps:
+    """
+    Moves the volume of zones to a target over a duration, with one task per
+    zone. Every step waits until the gateway confirmed the one before it, and
+    the next step is worked out from the time that has passed, so a slow link
+    gets fewer, bigger steps instead of falling behind. A new ramp of a zone
+    cancels the one still running there.
+    """
+
+    hass: HomeAssistant = None
+    client: BaseClient = None
+
+    def __init__(self, hass: HomeAssistant, client: BaseClient, scheduler: HtdCommandScheduler):
+        self.hass = hass
+        self.client = client
+        self._scheduler = scheduler
+        self._tasks: dict[int, asyncio.Task] = {}
+
+        self.ramps_started = 0
+        self.ramps_replaced = 0
+        self.steps_sent = 0
+
+    @callback
+    def async_start(self, zone: int, volume: int, duration: float) -> asyncio.Task:
+        """
+        Start ramping a zone, replacing a ramp that is still running.
+
+        Args:
+            zone (int): the zone to ramp
+            volume (int): the target as an HTD volume, between 0 and 60
+            duration (float): the number of seconds until the target is reached
+
+        Returns:
+            asyncio.Task: the ramp, its result is the number of steps it sent
+        """
+        if self.async_cancel(zone):
+            self.ramps_replaced += 1
+
+        self.ramps_started += 1
+
+        task = self.hass.async_create_background_task(
+            self._async_ramp(zone, volume, duration),
+            f"htd zone {zone} volume ramp",
+            eager_start=False,
+        )
+        self._tasks[zone] = task
+
+        return task
+
+    @callback
+    def async_cancel(self, zone: int) -> bool:
+        """Stop the ramp of a zone where it is, e.g. when the volume is set by hand."""
+        task = self._tasks.pop(zone, None)
+
+        if task is None or task.done():
+            return False
+
+        task.cancel()
+        return True
+
+    async def async_stop(self) -> None:
+        tasks = list(self._tasks.values())
+        self._tasks.clear()
+
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _async_ramp(self, zone: int, volume: int, duration: float) -> int:
+        loop = self.hass.loop
+        steps = 0
+
+        try:
+            if not self.client.get_zone(zone).power:
+                await self._scheduler.async_power(zone, True)
+
+            start_volume = current = self.client.get_zone(zone).volume
+            distance = abs(volume - start_volume)
+            direction = 1 if volume > start_volume else -1
+            start = loop.time()
+
+            while current != volume:
+                progress = min((loop.time() - start) / duration, 1) if duration else 1
+                step_volume = start_volume + direction * round(distance * progress)
+
+                if step_volume == current:
+                    # sleep until the volume is due to move by the next step
+                    due = start + duration * (abs(current - start_volume) + 0.5) / distance
+                    await asyncio.sleep(max(due - loop.time(), 0))
+                    continue
+
+                # returns once the gateway confirmed it, however long that took
+                await self._scheduler.async_set_volume(zone, step_volume)
+                current = step_volume
+                steps += 1
+                self.steps_sent += 1
+
+            _LOGGER.debug(
+                "Ramped zone %d from %d to %d in %d steps over %.1f seconds",
+                zone,
+                start_volume,
+                volume,
+                steps,
+                loop.time() - start,
+            )
+
+            return steps
+
+        finally:
+            if self._tasks.get(zone) is asyncio.current_task():
+                del self._tasks[zone]
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "ramps_started": self.ramps_started,
+            "ramps_replaced": self.ramps_replaced,
+            "ramps_running": len(self._tasks),
+            "steps_sent": self.steps_sent,
+        }
@@ -0,0 +1,330 @@
+"""Per-zone command scheduling for HTD gateways"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable
+
+from homeassistant.core import HomeAssistant, callback
+from htd_client import BaseClient, HtdDeviceKind
+from htd_client.constants import HtdLyncCommands, HtdMcaCommands
+
+from .const import DEFAULT_COMMAND_INTERVAL
+from .metrics import HtdLatencyHistogram
+
+_LOGGER = logging.getLogger(__name__)
+
+CommandFactory = Callable[[], Awaitable[Any]]
+
+# commands for every zone at once are queued on zone 0
+ALL_ZONES = 0
+
+# the zone byte of a frame for every zone, htd_client sends them to zone 1
+ALL_ZONES_FRAME_ZONE = 1
+
+# commands with the same key replace each other while they are still queued,
+# a key of None is never replaced (e.g. relative volume steps)
+COMMAND_POWER = "power"
+COMMAND_MUTE = "mute"
+COMMAND_SOURCE = "source"
+COMMAND_VOLUME = "volume"
+
+# the mca can only step tone fields, the data codes that step them down and up
+MCA_TONE_STEPS = {
+    "bass": (HtdMcaCommands.BASS_DOWN_COMMAND, HtdMcaCommands.BASS_UP_COMMAND),
+    "treble": (HtdMcaCommands.TREBLE_DOWN_COMMAND, HtdMcaCommands.TREBLE_UP_COMMAND),
+    "balance": (HtdMcaCommands.BALANCE_LEFT_COMMAND, HtdMcaCommands.BALANCE_RIGHT_COMMAND),
+}
+
+# the command that turns every zone off and on, and its data codes for off and on
+POWER_ALL_COMMANDS = {
+    HtdDeviceKind.lync: (
+        HtdLyncCommands.COMMON_COMMAND_CODE,
+        HtdLyncCommands.POWER_OFF_ALL_ZONES_COMMAND_CODE,
+        HtdLyncCommands.POWER_ON_ALL_ZONES_COMMAND_CODE,
+    ),
+    HtdDeviceKind.mca: (
+        HtdMcaCommands.COMMON_COMMAND_CODE,
+        HtdMcaCommands.POWER_OFF_ALL_ZONES_COMMAND_CODE,
+        HtdMcaCommands.POWER_ON_ALL_ZONES_COMMAND_CODE,
+    ),
+}
+
+# the lync sets tone fields directly, the command and data code of each, the value
+# goes in the data code if there is none and in an extra byte otherwise
+LYNC_TONE_COMMANDS = {
+    "bass": (HtdLyncCommands.COMMON_COMMAND_CODE, HtdLyncCommands.BASS_SETTING_CONTROL_COMMAND_CODE),
+    "treble": (HtdLyncCommands.COMMON_COMMAND_CODE, HtdLyncCommands.TREBLE_SETTING_CONTROL_COMMAND_CODE),
+    "balance": (HtdLyncCommands.BALANCE_SETTING_CONTROL_COMMAND_CODE, None),
+}
+
+
+class _QueuedCommand:
+    def __init__(self, key: str | None, factory: CommandFactory, future: asyncio.Future):
+        self.key = key
+        self.factory = factory
+        self.futures = [future]
+
+
+class HtdCommandScheduler:
+    """
+    Queues commands per zone and sends them one at a time, paced so the
+    gateway is never flooded. A queued command is replaced by a newer one
+    with the same key, so only the last volume of a slider drag is sent.
+    """
+
+    hass: HomeAssistant = None
+    client: BaseClient = None
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        client: BaseClient,
+        command_interval: float = DEFAULT_COMMAND_INTERVAL,
+    ):
+        self.hass = hass
+        self.client = client
+        self.command_interval = command_interval
+        self._queues: dict[int, list[_QueuedCommand]] = {}
+        self._workers: dict[int, asyncio.Task] = {}
+        self._next_slot = 0.0
+
+        self.commands_queued = 0
+        self.commands_sent = 0
+        self.commands_dropped = 0
+        self.commands_failed = 0
+        self.latency = HtdLatencyHistogram()
+
+    async def async_power(self, zone: int, power: bool) -> None:
+        if power:
+            await self.async_submit(zone, COMMAND_POWER, lambda: self.client.async_power_on(zone))
+        else:
+            await self.async_submit(zone, COMMAND_POWER, lambda: self.client.async_power_off(zone))
+
+    async def async_power_all(self, power: bool) -> None:
+        """Turn every zone on or off, done once every zone reports the new power."""
+        await self.async_submit(ALL_ZONES, COMMAND_POWER, lambda: self._async_power_all(power))
+
+    async def _async_power_all(self, power: bool) -> None:
+        # disabled zones, and zones that never reported, may never echo the new power
+        zones = [
+            zone
+            for zone in range(1, self.client.get_zone_count() + 1)
+            if self.client.has_zone_data(zone)
+            and self.client.get_zone(zone).enabled
+            and self.client.get_zone(zone).power is not None
+        ]
+
+        # htd_client reads the zone the frame goes to before it checks anything
+        if not zones or not self.client.has_zone_data(ALL_ZONES_FRAME_ZONE):
+            if power:
+                self.client.power_on_all_zones()
+            else:
+                self.client.power_off_all_zones()
+
+            return
+
+        command, data_off, data_on = POWER_ALL_COMMANDS[self.client.model["kind"]]
+
+        # a command for a single zone sent right after this must not see the old power
+        await self.client._async_send_and_validate(
+            lambda _: all(self.client.get_zone(zone).power == power for zone in zones),
+            ALL_ZONES_FRAME_ZONE,
+            command,
+            data_on if power else data_off,
+        )
+
+    async def async_mute(self, zone: int, mute: bool) -> None:
+        if mute:
+            await self.async_submit(zone, COMMAND_MUTE, lambda: self.client.async_mute(zone))
+        else:
+            await self.async_submit(zone, COMMAND_MUTE, lambda: self.client.async_unmute(zone))
+
+    async def async_set_source(self, zone: int, source: int) -> None:
+        await self.async_submit(zone, COMMAND_SOURCE, lambda: self.client.async_set_source(zone, source))
+
+    async def async_set_volume(self, zone: int, volume: int) -> None:
+        await self.async_submit(zone, COMMAND_VOLUME, lambda: self.client.async_set_volume(zone, volume))
+
+    async def async_set_tone(self, zone: int, field: str, value: int) -> None:
+        """Set the bass, treble or balance of a zone."""
+        await self.async_submit(zone, field, lambda: self._async_set_tone(zone, field, value))
+
+    async def _async_set_tone(self, zone: int, field: str, value: int) -> None:
+        if getattr(self.client.get_zone(zone), field) == value:
+            return
+
+        if self.client.model["kind"] == HtdDeviceKind.lync:
+            # the gateway takes a signed byte, htd_client's setters fail on negative values
+            command, data_code = LYNC_TONE_COMMANDS[field]
+            signed = value & 0xff
+
+            await self.client._async_send_and_validate(
+                lambda zone_info: getattr(zone_info, field) == value,
+                zone,
+                command,
+                signed if data_code is None else data_code,
+                None if data_code is None else bytes((signed,)),
+            )
+            return
+
+        # each step is confirmed before the next one, htd_client's own bass and
+        # treble up never send anything
+        step_down, step_up = MCA_TONE_STEPS[field]
+
+        for _ in range(abs(value - getattr(self.client.get_zone(zone), field))):
+            current = getattr(self.client.get_zone(zone), field)
+
+            if current == value:
+                return
+
+            target = current + 1 if value > current else current - 1
+
+            await self.client._async_send_and_validate(
+                lambda zone_info: getattr(zone_info, field) == target,
+                zone,
+                HtdMcaCommands.COMMON_COMMAND_CODE,
+                step_up if value > current else step_down,
+            )
+
+    async def async_volume_up(self, zone: int) -> None:
+        await self.async_submit(zone, None, lambda: self.client.async_volume_up(zone))
+
+    async def async_volume_down(self, zone: int) -> None:
+        await self.async_submit(zone, None, lambda: self.client.async_volume_down(zone))
+
+    async def async_submit(self, zone: int, key: str | None, factory: CommandFactory) -> None:
+        """
+        Queue a command for a zone and wait until it, or the command that
+        replaced it, has been sent.
+
+        Args:
+            zone (int): the zone the command is for
+            key (str): commands with the same key replace each other, None never replaces
+            factory (CommandFactory): creates the client coroutine when it is time to send
+        """
+        future = self.hass.loop.create_future()
+        self._async_enqueue(zone, key, factory, future)
+        await future
+
+    @callback
+    def _async_enqueue(
+        self,
+        zone: int,
+        key: str | None,
+        factory: CommandFactory,
+        future: asyncio.Future
+    ) -> None:
+        queue = self._queues.setdefault(zone, [])
+        command = _QueuedCommand(key, factory, future)
+        self.commands_queued += 1
+
+        index = None
+
+        if key is not None:
+            index = next((index for index, queued in enumerate(queue) if queued.key == key), None)
+
+        if index is None:
+            queue.append(command)
+
+        else:
+            # last write wins, in the old command's place so the order of the other keys is kept,
+            # whoever waited on the old command now waits on this one
+            command.futures = queue[index].futures + command.futures
+            queue[index] = command
+            self.commands_dropped += 1
+
+        if zone not in self._workers:
+            self._workers[zone] = self.hass.async_create_background_task(
+                self._async_run_zone(zone),
+                f"htd zone {zone} commands",
+                eager_start=False,
+            )
+
+    async def _async_run_zone(self, zone: int) -> None:
+        queue = self._queues[zone]
+
+        try:
+            while queue:
+                await self._async_wait_for_slot()
+
+                command = queue.pop(0)
+                start = self.hass.loop.time()
+
+                try:
+                    # the client returns once the gateway echoed the new state
+                    await command.factory()
+
+                except asyncio.CancelledError:
+                    _cancel_futures(command.futures)
+                    raise
+
+                except Exception as e:
+                    self.commands_failed += 1
+                    _LOGGER.warning("Command %s for zone %d failed: %s", command.key, zone, e)
+                    _set_futures(command.futures, exception=e)
+
+                else:
+                    self.commands_sent += 1
+                    self.latency.record(self.hass.loop.time() - start)
+                    _set_futures(command.futures)
+
+        finally:
+            del self._workers[zone]
+
+    async def _async_wait_for_slot(self) -> None:
+        # the slot is reserved before sleeping so zones never share one
+        now = self.hass.loop.time()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.command_interval
+
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pending_count(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def pending_zones(self) -> set[int]:
+        """The zones with a command queued or waiting for the gateway."""
+        return {zone for zone, queue in self._queues.items() if queue} | set(self._workers)
+
+    async def async_stop(self) -> None:
+        """Cancel everything that is still queued."""
+        workers = list(self._workers.values())
+
+        for worker in workers:
+            worker.cancel()
+
+        await asyncio.gather(*workers, return_exceptions=True)
+        self._workers.clear()
+
+        for queue in self._queues.values():
+            for command in queue:
+                _cancel_futures(command.futures)
+
+            queue.clear()
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "commands_queued": self.commands_queued,
+            "commands_sent": self.commands_sent,
+            "commands_dropped": self.commands_dropped,
+            "commands_failed": self.commands_failed,
+            "commands_pending": self.pending_count(),
+        }
+
+
+def _set_futures(futures: list[asyncio.Future], exception: BaseException | None = None) -> None:
+    for future in futures:
+        if future.done():
+            continue
+
+        if exception is None:
+            future.set_result(None)
+        else:
+            future.set_exception(exception)
+
+
+def _cancel_futures(futures: list[asyncio.Future]) -> None:
+    for future in futures:
+        future.cancel()
@@ -0,0 +1,220 @@
+"""Zone and debug sensors for HTD gateways"""
+
+import logging
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any, Callable
+
+from homeassistant.components.sensor import (
+    SensorDeviceClass,
+    SensorEntity,
+    SensorEntityDescription,
+    SensorStateClass,
+)
+from homeassistant.const import CONF_UNIQUE_ID, EntityCategory, Platform, UnitOfTime
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from homeassistant.helpers.typing import StateType
+from htd_client import HtdConstants
+
+from .const import CONF_DEBUG_SENSORS, SIGNAL_OPTIONS_UPDATED
+from .entity import HtdZoneEntity, async_setup_zone_entities
+from .models import HtdClientConfigEntry, HtdRuntimeData
+from .optimistic import FIELD_SOURCE, FIELD_VOLUME
+from .state import HtdZoneStore
+from .utils import get_option
+
+_LOGGER = logging.getLogger(__name__)
+
+# the debug sensors are polled, so watching them costs nothing per frame
+SCAN_INTERVAL = timedelta(seconds=10)
+
+UNIT_DECIBEL = "dB"
+
+
+@dataclass(frozen=True, kw_only=True)
+class HtdDebugSensorEntityDescription(SensorEntityDescription):
+    value_fn: Callable[[HtdRuntimeData], StateType]
+    attributes_fn: Callable[[HtdRuntimeData], dict[str, Any]] | None = None
+
+
+@dataclass(frozen=True, kw_only=True)
+class HtdZoneSensorEntityDescription(SensorEntityDescription):
+    field: str
+    value_fn: Callable[[HtdZoneStore, int], StateType]
+
+
+def _volume_db(zones: HtdZoneStore, zone: int) -> int | None:
+    # the gateways attenuate in steps of one dB, the highest volume is 0 dB
+    volume = zones.get(zone, FIELD_VOLUME)
+    return None if volume is None else volume - HtdConstants.MAX_VOLUME
+
+
+ZONE_SENSORS = (
+    HtdZoneSensorEntityDescription(
+        key=FIELD_SOURCE,
+        name="Source",
+        icon="mdi:import",
+        device_class=SensorDeviceClass.ENUM,
+        field=FIELD_SOURCE,
+        value_fn=lambda zones, zone: zones.get_source_name(zones.get(zone, FIELD_SOURCE)),
+    ),
+    HtdZoneSensorEntityDescription(
+        key="volume_db",
+        name="Volume",
+        icon="mdi:volume-high",
+        native_unit_of_measurement=UNIT_DECIBEL,
+        state_class=SensorStateClass.MEASUREMENT,
+        field=FIELD_VOLUME,
+        value_fn=_volume_db,
+    ),
+)
+
+
+def _latency_ms(runtime_data: HtdRuntimeData) -> float | None:
+    p50 = runtime_data.scheduler.latency.percentile(50)
+    return None if p50 is None else round(p50 * 1000, 1)
+
+
+DEBUG_SENSORS = (
+    HtdDebugSensorEntityDescription(
+        key="updates_per_second",
+        name="Updates per second",
+        state_class=SensorStateClass.MEASUREMENT,
+        suggested_display_precision=2,
+        value_fn=lambda data: data.dispatcher.frame_rate.rate(data.dispatcher.hass.loop.time()),
+    ),
+    HtdDebugSensorEntityDescription(
+        key="updates_ignored",
+        name="Updates ignored",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda data: data.dispatcher.updates_ignored,
+    ),
+    HtdDebugSensorEntityDescription(
+        key="state_writes",
+        name="State writes",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda data: data.dispatcher.state_writes,
+        attributes_fn=lambda data: {"skipped": data.dispatcher.state_writes_skipped},
+    ),
+    HtdDebugSensorEntityDescription(
+        key="reconnects",
+        name="Reconnects",
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        value_fn=lambda data: data.connection.reconnects,
+    ),
+    HtdDebugSensorEntityDescription(
+        key="time_since_last_update",
+        name="Time since last update",
+        device_class=SensorDeviceClass.DURATION,
+        native_unit_of_measurement=UnitOfTime.SECONDS,
+        state_class=SensorStateClass.MEASUREMENT,
+        suggested_display_precision=0,
+        value_fn=lambda data: data.dispatcher.seconds_since_last_update,
+    ),
+    HtdDebugSensorEntityDescription(
+        key="pending_commands",
+        name="Pending commands",
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=lambda data: data.scheduler.pending_count(),
+    ),
+    HtdDebugSensorEntityDescription(
+        key="command_latency",
+        name="Command latency",
+        device_class=SensorDeviceClass.DURATION,
+        native_unit_of_measurement=UnitOfTime.MILLISECONDS,
+        state_class=SensorStateClass.MEASUREMENT,
+        value_fn=_latency_ms,
+        attributes_fn=lambda data: data.scheduler.latency.as_dict(),
+    ),
+)
+
+
+async def async_setup_entry(hass: HomeAssistant, config_entry: HtdClientConfigEntry, async_add_entities):
+    def _create(unique_id: str, device_name: str, zone: int, runtime_data: HtdRuntimeData):
+        return [
+            HtdZoneSensor(unique_id, device_name, zone, runtime_data, description)
+            for description in ZONE_SENSORS
+        ]
+
+    async_setup_zone_entities(hass, config_entry, async_add_entities, _create)
+
+    if not get_option(config_entry.data, CONF_DEBUG_SENSORS):
+        return
+
+    unique_id = config_entry.data.get(CONF_UNIQUE_ID)
+
+    sensors = [
+        HtdDebugSensor(unique_id, config_entry.title, config_entry.runtime_data, description)
+        for description in DEBUG_SENSORS
+    ]
+
+    async_add_entities(sensors)
+
+    @callback
+    def _async_options_updated() -> None:
+        for sensor in sensors:
+            sensor.async_set_device_name(config_entry.title)
+
+    config_entry.async_on_unload(
+        async_dispatcher_connect(hass, SIGNAL_OPTIONS_UPDATED.format(config_entry.entry_id), _async_options_updated)
+    )
+
+
+class HtdDebugSensor(SensorEntity):
+    entity_description: HtdDebugSensorEntityDescription
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    def __init__(
+        self,
+        unique_id: str,
+        device_name: str,
+        runtime_data: HtdRuntimeData,
+        description: HtdDebugSensorEntityDescription,
+    ):
+        self.entity_description = description
+        self.runtime_data = runtime_data
+        self._attr_unique_id = f"{unique_id}_{description.key}"
+        self._attr_name = f"{device_name} {description.name}"
+
+    @callback
+    def async_set_device_name(self, device_name: str) -> None:
+        self._attr_name = f"{device_name} {self.entity_description.name}"
+
+        if self.hass is not None:
+            self.async_write_ha_state()
+
+    async def async_update(self) -> None:
+        description = self.entity_description
+        self._attr_native_value = description.value_fn(self.runtime_data)
+
+        if description.attributes_fn is not None:
+            self._attr_extra_state_attributes = description.attributes_fn(self.runtime_data)
+
+
+class HtdZoneSensor(HtdZoneEntity, SensorEntity):
+    entity_description: HtdZoneSensorEntityDescription
+
+    platform_domain = Platform.SENSOR
+
+    def __init__(
+        self,
+        unique_id: str,
+        device_name: str,
+        zone: int,
+        runtime_data: HtdRuntimeData,
+        description: HtdZoneSensorEntityDescription,
+    ):
+        super().__init__(unique_id, device_name, zone, runtime_data, description, (description.field,))
+
+    @property
+    def native_value(self) -> StateType:
+        return self.entity_description.value_fn(self.zones, self.zone)
+
+    @property
+    def options(self) -> list[str] | None:
+        if self.entity_description.device_class != SensorDeviceClass.ENUM:
+            return None
+
+        return self.zones.sources
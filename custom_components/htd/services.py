@@ -0,0 +1,380 @@
+"""Services for the HTD integration"""
+
+import asyncio
+import logging
+from typing import Any
+
+import voluptuous as vol
+from homeassistant.config_entries import ConfigEntryState
+from homeassistant.core import HomeAssistant, ServiceCall, ServiceResponse, SupportsResponse, callback
+from homeassistant.exceptions import HomeAssistantError, ServiceValidationError
+from homeassistant.helpers import config_validation as cv
+from htd_client import BaseClient, HtdConstants
+
+from .const import DOMAIN
+from .models import HtdRuntimeData
+from .optimistic import (
+    FIELD_BALANCE,
+    FIELD_BASS,
+    FIELD_MUTE,
+    FIELD_POWER,
+    FIELD_SOURCE,
+    FIELD_TREBLE,
+    FIELD_VOLUME,
+)
+from .scheduler import ALL_ZONES, HtdCommandScheduler
+from .snapshot import HtdSnapshotStore, capture_snapshot, snapshot_to_targets
+
+_LOGGER = logging.getLogger(__name__)
+
+SERVICE_APPLY_ZONES = "apply_zones"
+SERVICE_SNAPSHOT = "snapshot"
+SERVICE_RESTORE = "restore"
+SERVICE_RAMP_VOLUME = "ramp_volume"
+
+ATTR_CONFIG_ENTRY_ID = "config_entry_id"
+ATTR_ZONES = "zones"
+ATTR_ZONE = "zone"
+ATTR_POWER = "power"
+ATTR_SOURCE = "source"
+ATTR_VOLUME_LEVEL = "volume_level"
+ATTR_VOLUME = "volume"
+ATTR_MUTE = "mute"
+ATTR_BASS = "bass"
+ATTR_TREBLE = "treble"
+ATTR_BALANCE = "balance"
+ATTR_ALL_OFF = "all_off"
+ATTR_SNAPSHOT_ID = "snapshot_id"
+ATTR_PERSIST = "persist"
+ATTR_DURATION = "duration"
+
+DEFAULT_SNAPSHOT_ID = "default"
+
+ZONE_TARGET_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_ZONE): cv.positive_int,
+        vol.Optional(ATTR_POWER): cv.boolean,
+        vol.Optional(ATTR_SOURCE): cv.positive_int,
+        vol.Optional(ATTR_VOLUME_LEVEL): vol.All(vol.Coerce(float), vol.Range(min=0, max=1)),
+        vol.Optional(ATTR_MUTE): cv.boolean,
+        vol.Optional(ATTR_BASS): vol.All(vol.Coerce(int), vol.Range(min=HtdConstants.MIN_BASS, max=HtdConstants.MAX_BASS)),
+        vol.Optional(ATTR_TREBLE): vol.All(vol.Coerce(int), vol.Range(min=HtdConstants.MIN_TREBLE, max=HtdConstants.MAX_TREBLE)),
+        vol.Optional(ATTR_BALANCE): vol.All(vol.Coerce(int), vol.Range(min=HtdConstants.MIN_BALANCE, max=HtdConstants.MAX_BALANCE)),
+    }
+)
+
+APPLY_ZONES_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_CONFIG_ENTRY_ID): cv.string,
+        vol.Optional(ATTR_ZONES, default=[]): vol.All(cv.ensure_list, [ZONE_TARGET_SCHEMA]),
+        vol.Optional(ATTR_ALL_OFF, default=False): cv.boolean,
+    }
+)
+
+SNAPSHOT_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_CONFIG_ENTRY_ID): cv.string,
+        vol.Optional(ATTR_SNAPSHOT_ID, default=DEFAULT_SNAPSHOT_ID): cv.string,
+        vol.Optional(ATTR_PERSIST, default=False): cv.boolean,
+    }
+)
+
+RESTORE_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_CONFIG_ENTRY_ID): cv.string,
+        vol.Optional(ATTR_SNAPSHOT_ID, default=DEFAULT_SNAPSHOT_ID): cv.string,
+    }
+)
+
+RAMP_VOLUME_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_CONFIG_ENTRY_ID): cv.string,
+        vol.Required(ATTR_ZONES): vol.All(cv.ensure_list, [cv.positive_int], vol.Length(min=1)),
+        vol.Required(ATTR_VOLUME_LEVEL): vol.All(vol.Coerce(float), vol.Range(min=0, max=1)),
+        vol.Required(ATTR_DURATION): vol.All(vol.Coerce(float), vol.Range(min=0, max=3600)),
+    }
+)
+
+# a planned command, (zone, field, value)
+ZoneCommand = tuple[int, str, Any]
+
+
+@callback
+def async_setup_services(hass: HomeAssistant) -> None:
+    """Register the HTD services, they work on any loaded gateway."""
+    snapshot_store = HtdSnapshotStore(hass)
+
+    async def async_apply_zones(call: ServiceCall) -> ServiceResponse:
+        runtime_data = _get_runtime_data(hass, call.data[ATTR_CONFIG_ENTRY_ID])
+
+        return await _async_apply_targets(
+            hass,
+            runtime_data,
+            call.data[ATTR_ZONES],
+            call.data[ATTR_ALL_OFF],
+        )
+
+    async def async_snapshot(call: ServiceCall) -> None:
+        entry_id = call.data[ATTR_CONFIG_ENTRY_ID]
+        snapshot_id = call.data[ATTR_SNAPSHOT_ID]
+        runtime_data = _get_runtime_data(hass, entry_id)
+
+        snapshot = capture_snapshot(runtime_data.client)
+        runtime_data.snapshots[snapshot_id] = snapshot
+
+        if call.data[ATTR_PERSIST]:
+            await snapshot_store.async_save(entry_id, snapshot_id, snapshot)
+
+    async def async_restore(call: ServiceCall) -> ServiceResponse:
+        entry_id = call.data[ATTR_CONFIG_ENTRY_ID]
+        snapshot_id = call.data[ATTR_SNAPSHOT_ID]
+        runtime_data = _get_runtime_data(hass, entry_id)
+
+        snapshot = runtime_data.snapshots.get(snapshot_id)
+
+        if snapshot is None:
+            snapshot = await snapshot_store.async_get(entry_id, snapshot_id)
+
+        if snapshot is None:
+            raise ServiceValidationError(f"There is no snapshot named {snapshot_id}")
+
+        # no lock on purpose, a newer restore replaces whatever an older one still has queued
+        return await _async_apply_targets(hass, runtime_data, snapshot_to_targets(snapshot))
+
+    async def async_ramp_volume(call: ServiceCall) -> ServiceResponse:
+        runtime_data = _get_runtime_data(hass, call.data[ATTR_CONFIG_ENTRY_ID])
+
+        return await _async_ramp_volume(
+            hass,
+            runtime_data,
+            call.data[ATTR_ZONES],
+            int(call.data[ATTR_VOLUME_LEVEL] * HtdConstants.MAX_VOLUME),
+            call.data[ATTR_DURATION],
+        )
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_APPLY_ZONES,
+        async_apply_zones,
+        schema=APPLY_ZONES_SCHEMA,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_SNAPSHOT,
+        async_snapshot,
+        schema=SNAPSHOT_SCHEMA,
+    )
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_RESTORE,
+        async_restore,
+        schema=RESTORE_SCHEMA,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_RAMP_VOLUME,
+        async_ramp_volume,
+        schema=RAMP_VOLUME_SCHEMA,
+        supports_response=SupportsResponse.OPTIONAL,
+    )
+
+
+async def _async_apply_targets(
+    hass: HomeAssistant,
+    runtime_data: HtdRuntimeData,
+    targets: list[dict[str, Any]],
+    all_off: bool = False,
+) -> ServiceResponse:
+    commands = plan_zone_commands(runtime_data.client, targets, all_off)
+
+    start = hass.loop.time()
+    await async_send_zone_commands(runtime_data.scheduler, commands)
+    duration = hass.loop.time() - start
+
+    _LOGGER.debug("Applied %d zone commands in %.3f seconds", len(commands), duration)
+
+    return {
+        "commands": len(commands),
+        "zones": sorted({zone for zone, _, _ in commands}),
+        "duration": round(duration, 3),
+    }
+
+
+async def _async_ramp_volume(
+    hass: HomeAssistant,
+    runtime_data: HtdRuntimeData,
+    zones: list[int],
+    volume: int,
+    duration: float,
+) -> ServiceResponse:
+    client = runtime_data.client
+    zone_count = client.get_zone_count()
+
+    for zone in zones:
+        if zone > zone_count:
+            raise ServiceValidationError(f"Zone {zone} does not exist, there are {zone_count} zones")
+
+        if not client.has_zone_data(zone) or client.get_zone(zone).volume is None:
+            raise ServiceValidationError(f"Zone {zone} has not reported its volume yet")
+
+    start = hass.loop.time()
+    ramps = {zone: runtime_data.ramps.async_start(zone, volume, duration) for zone in dict.fromkeys(zones)}
+
+    # the ramps run on their own, a script that stops waiting doesn't stop them
+    await asyncio.wait(ramps.values())
+
+    stopped = sorted(zone for zone, ramp in ramps.items() if ramp.cancelled())
+    failed = {zone: ramp.exception() for zone, ramp in ramps.items() if not ramp.cancelled() and ramp.exception()}
+
+    if failed:
+        raise HomeAssistantError(
+            "Unable to ramp " + ", ".join(f"zone {zone}: {e}" for zone, e in sorted(failed.items()))
+        )
+
+    return {
+        "steps": sum(ramp.result() for ramp in ramps.values() if not ramp.cancelled()),
+        "zones": sorted(ramps),
+        "stopped": stopped,
+        "duration": round(hass.loop.time() - start, 3),
+    }
+
+
+def _get_runtime_data(hass: HomeAssistant, entry_id: str) -> HtdRuntimeData:
+    entry = hass.config_entries.async_get_entry(entry_id)
+
+    if entry is None or entry.domain != DOMAIN or entry.state is not ConfigEntryState.LOADED:
+        raise ServiceValidationError(f"{entry_id} is not a loaded HTD gateway")
+
+    if not entry.runtime_data.client.connected:
+        raise HomeAssistantError(f"{entry.title} is not connected")
+
+    return entry.runtime_data
+
+
+def plan_zone_commands(
+    client: BaseClient,
+    targets: list[dict[str, Any]],
+    all_off: bool = False,
+) -> list[ZoneCommand]:
+    """
+    Compare the targets to the current state of each zone and work out the
+    smallest ordered list of commands that gets there.
+
+    Args:
+        client (BaseClient): the client holding the current zone state
+        targets (list): per zone targets, see ZONE_TARGET_SCHEMA
+        all_off (bool): turn every zone off before applying the targets
+
+    Returns:
+        list[ZoneCommand]: the commands to send, in order
+    """
+    zone_count = client.get_zone_count()
+    power = {
+        zone: client.has_zone_data(zone) and bool(client.get_zone(zone).power)
+        for zone in range(1, zone_count + 1)
+    }
+
+    for target in targets:
+        if target[ATTR_ZONE] > zone_count:
+            raise ServiceValidationError(f"Zone {target[ATTR_ZONE]} does not exist, there are {zone_count} zones")
+
+        if target.get(ATTR_SOURCE, 1) > client.get_source_count():
+            raise ServiceValidationError(f"Source {target[ATTR_SOURCE]} does not exist")
+
+    commands: list[ZoneCommand] = []
+    zones_on = {zone for zone, is_on in power.items() if is_on}
+    zones_off = {target[ATTR_ZONE] for target in targets if target.get(ATTR_POWER) is False} & zones_on
+
+    # one frame turns everything off, use it when nothing that is on stays on
+    if all_off or (len(zones_off) > 1 and zones_off == zones_on):
+        if len(zones_on) > 1:
+            commands.append((ALL_ZONES, FIELD_POWER, False))
+        else:
+            commands += [(zone, FIELD_POWER, False) for zone in zones_on]
+
+        for zone in zones_on:
+            power[zone] = False
+
+    for target in targets:
+        zone = target[ATTR_ZONE]
+        zone_info = client.get_zone(zone) if client.has_zone_data(zone) else None
+        target_power = target.get(ATTR_POWER)
+
+        if target_power is False:
+            if power[zone]:
+                commands.append((zone, FIELD_POWER, False))
+                power[zone] = False
+
+            # nothing else matters for a zone that is off
+            continue
+
+        if target_power is True and not power[zone]:
+            commands.append((zone, FIELD_POWER, True))
+            power[zone] = True
+
+        if ATTR_SOURCE in target and (zone_info is None or zone_info.source != target[ATTR_SOURCE]):
+            commands.append((zone, FIELD_SOURCE, target[ATTR_SOURCE]))
+
+        # snapshots carry the raw volume, so nothing is lost to rounding
+        if ATTR_VOLUME in target or ATTR_VOLUME_LEVEL in target:
+            volume = target.get(ATTR_VOLUME)
+
+            if volume is None:
+                volume = int(target[ATTR_VOLUME_LEVEL] * HtdConstants.MAX_VOLUME)
+
+            if zone_info is None or zone_info.volume != volume:
+                commands.append((zone, FIELD_VOLUME, volume))
+
+        if ATTR_MUTE in target and (zone_info is None or zone_info.mute != target[ATTR_MUTE]):
+            commands.append((zone, FIELD_MUTE, target[ATTR_MUTE]))
+
+        for field in (FIELD_BASS, FIELD_TREBLE, FIELD_BALANCE):
+            if field in target and (zone_info is None or getattr(zone_info, field) != target[field]):
+                commands.append((zone, field, target[field]))
+
+    return commands
+
+
+async def async_send_zone_commands(scheduler: HtdCommandScheduler, commands: list[ZoneCommand]) -> None:
+    """
+    Send the commands for every zone first and wait until the gateway
+    confirmed them, they would undo any zone command that went out next to
+    them. Then queue the rest at once so they go out as one ordered burst,
+    the order is kept per zone and the scheduler paces the gateway.
+    """
+    for zone, field, value in commands:
+        if zone == ALL_ZONES:
+            await _async_send_zone_command(scheduler, zone, field, value)
+
+    await asyncio.gather(
+        *(
+            _async_send_zone_command(scheduler, zone, field, value)
+            for zone, field, value in commands
+            if zone != ALL_ZONES
+        )
+    )
+
+
+async def _async_send_zone_command(scheduler: HtdCommandScheduler, zone: int, field: str, value: Any) -> None:
+    if zone == ALL_ZONES:
+        await scheduler.async_power_all(value)
+
+    elif field == FIELD_POWER:
+        await scheduler.async_power(zone, value)
+
+    elif field == FIELD_SOURCE:
+        await scheduler.async_set_source(zone, value)
+
+    elif field == FIELD_VOLUME:
+        await scheduler.async_set_volume(zone, value)
+
+    elif field == FIELD_MUTE:
+        await scheduler.async_mute(zone, value)
+
+    elif field in (FIELD_BASS, FIELD_TREBLE, FIELD_BALANCE):
+        await scheduler.async_set_tone(zone, field, value)
@@ -0,0 +1,94 @@
+"""Zone snapshots for HTD gateways"""
+
+import logging
+from typing import Any
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+from htd_client import BaseClient
+
+from .const import DOMAIN
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_KEY = f"{DOMAIN}.snapshots"
+STORAGE_VERSION = 1
+
+# the order of the values in a snapshot of a zone
+SNAPSHOT_FIELDS = ("power", "mute", "source", "volume", "bass", "treble", "balance")
+
+# zone number -> the values of SNAPSHOT_FIELDS
+ZoneSnapshot = dict[int, tuple]
+
+
+def capture_snapshot(client: BaseClient) -> ZoneSnapshot:
+    """
+    Capture the state of every zone the client knows about.
+
+    Args:
+        client (BaseClient): the client holding the current zone state
+
+    Returns:
+        ZoneSnapshot: a tuple of values per zone, see SNAPSHOT_FIELDS
+    """
+    snapshot = {}
+
+    for zone in range(1, client.get_zone_count() + 1):
+        if not client.has_zone_data(zone):
+            continue
+
+        zone_info = client.get_zone(zone)
+
+        if zone_info.power is None:
+            continue
+
+        snapshot[zone] = tuple(getattr(zone_info, field) for field in SNAPSHOT_FIELDS)
+
+    return snapshot
+
+
+def snapshot_to_targets(snapshot: ZoneSnapshot) -> list[dict[str, Any]]:
+    """Turn a snapshot into zone targets, a zone that was off only needs to be off again."""
+    targets = []
+
+    for zone, values in snapshot.items():
+        target = dict(zip(SNAPSHOT_FIELDS, values))
+        target["zone"] = zone
+
+        if not target["power"]:
+            target = {"zone": zone, "power": False}
+
+        targets.append(target)
+
+    return targets
+
+
+class HtdSnapshotStore:
+    """Keeps snapshots on disk, per config entry and snapshot id."""
+
+    def __init__(self, hass: HomeAssistant):
+        self._store = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        self._data: dict[str, dict[str, dict[str, list]]] | None = None
+
+    async def _async_load(self) -> dict:
+        if self._data is None:
+            self._data = await self._store.async_load() or {}
+
+        return self._data
+
+    async def async_get(self, entry_id: str, snapshot_id: str) -> ZoneSnapshot | None:
+        data = await self._async_load()
+        stored = data.get(entry_id, {}).get(snapshot_id)
+
+        if stored is None:
+            return None
+
+        # json turns the zone numbers into strings and the tuples into lists
+        return {int(zone): tuple(values) for zone, values in stored.items()}
+
+    async def async_save(self, entry_id: str, snapshot_id: str, snapshot: ZoneSnapshot) -> None:
+        data = await self._async_load()
+        data.setdefault(entry_id, {})[snapshot_id] = {
+            str(zone): list(values) for zone, values in snapshot.items()
+        }
+        self._store.async_delay_save(lambda: self._data, 1)
@@ -0,0 +1,117 @@
+"""Compact zone state of an HTD gateway, shared by all of its entities"""
+
+from array import array
+from typing import Any
+
+from htd_client.models import ZoneDetail
+
+from .optimistic import (
+    FIELD_BALANCE,
+    FIELD_BASS,
+    FIELD_MUTE,
+    FIELD_POWER,
+    FIELD_SOURCE,
+    FIELD_TREBLE,
+    FIELD_VOLUME,
+)
+
+# the columns of a zone row, in the order the bits of a change mask
+ZONE_FIELDS = (FIELD_POWER, FIELD_MUTE, FIELD_VOLUME, FIELD_SOURCE, FIELD_BASS, FIELD_TREBLE, FIELD_BALANCE)
+FIELD_ENABLED = "enabled"
+
+FIELD_INDEX = {field: index for index, field in enumerate((*ZONE_FIELDS, FIELD_ENABLED))}
+FIELD_MASK = {field: 1 << index for field, index in FIELD_INDEX.items()}
+BOOLEAN_FIELDS = {FIELD_POWER, FIELD_MUTE, FIELD_ENABLED}
+
+ROW_SIZE = len(FIELD_INDEX)
+POWER = FIELD_INDEX[FIELD_POWER]
+ENABLED = FIELD_INDEX[FIELD_ENABLED]
+
+# a field the gateway has not reported yet, every real value fits a signed byte
+UNKNOWN = -0x8000
+
+
+class HtdZoneStore:
+    """
+    The state of every zone of a client in one flat array of shorts, a row
+    per zone. The codec copies each status frame into it once, and entities
+    read their zone from it instead of keeping their own copy. The fields that
+    changed are collected per zone until the dispatcher picks them up. The
+    source labels of the gateway are kept here too, one list for all zones.
+    """
+
+    def __init__(self, zone_count: int, sources: list[str] | None = None):
+        self.zone_count = zone_count
+        self.sources = sources or []
+        self._values = array("h", [UNKNOWN]) * ((zone_count + 1) * ROW_SIZE)
+        self._changes = array("B", bytes(zone_count + 1))
+
+        self.updates = 0
+        self.updates_unchanged = 0
+
+    def update(self, zone: int, zone_info: ZoneDetail) -> int:
+        """
+        Copy the state of a zone the client parsed.
+
+        Returns:
+            int: a mask of the fields that changed, see FIELD_MASK
+        """
+        values = self._values
+        offset = zone * ROW_SIZE
+        changed = 0
+
+        for index, field in enumerate(ZONE_FIELDS):
+            value = getattr(zone_info, field)
+            value = UNKNOWN if value is None else int(value)
+
+            if values[offset + index] != value:
+                values[offset + index] = value
+                changed |= 1 << index
+
+        self.updates += 1
+
+        if not changed:
+            self.updates_unchanged += 1
+
+        self._changes[zone] |= changed
+        return changed
+
+    def pop_changes(self, zone: int) -> int:
+        """The mask of the fields of a zone that changed since the last call."""
+        changed = self._changes[zone]
+        self._changes[zone] = 0
+        return changed
+
+    def set_enabled(self, zone: int, enabled: bool) -> None:
+        self._values[zone * ROW_SIZE + ENABLED] = enabled
+
+    def get(self, zone: int, field: str) -> Any:
+        """The value of a field, None while the gateway has not reported it."""
+        value = self._values[zone * ROW_SIZE + FIELD_INDEX[field]]
+
+        if value == UNKNOWN:
+            return None
+
+        return bool(value) if field in BOOLEAN_FIELDS else value
+
+    def is_disabled(self, zone: int) -> bool:
+        """Whether a keypad frame reported the zone as disabled on the gateway."""
+        return self._values[zone * ROW_SIZE + ENABLED] == 0
+
+    def has_state(self, zone: int) -> bool:
+        """Whether a status frame of the zone arrived, keypad frames only set the enabled flag."""
+        return self._values[zone * ROW_SIZE + POWER] != UNKNOWN
+
+    def get_source_name(self, source: int | None) -> str | None:
+        if source is None or not 1 <= source <= len(self.sources):
+            return None
+
+        return self.sources[source - 1]
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "updates": self.updates,
+            "updates_unchanged": self.updates_unchanged,
+            "bytes": self._values.itemsize * len(self._values),
+        }
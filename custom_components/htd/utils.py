@@ -1,43 +1,168 @@
 import logging
+from typing import Any, Mapping
 
 from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import CONF_UNIQUE_ID
 from homeassistant.core import callback, HomeAssistant
+from homeassistant.helpers import entity_registry as er
+from htd_client import HtdConstants
+from htd_client.constants import HtdModelInfo
+
+from .const import CONF_ACTIVE_ZONES, CONF_ENABLED_ZONES, CONF_MODEL, CONF_SOURCES, OPTION_DEFAULTS
 
 _LOGGER = logging.getLogger(__name__)
 
+# the parts of the model info that are kept in the config entry, the rest is
+# looked up from the supported models so nothing un-serializable is stored
+STORED_MODEL_KEYS = ("name", "zones", "sources", "friendly_name")
+
+
+def get_option(data: Mapping[str, Any], key: str) -> Any:
+    """Get an option from the entry data, falling back to its default."""
+    return data.get(key, OPTION_DEFAULTS.get(key))
+
+
+def get_source_names(data: Mapping[str, Any], source_count: int) -> list[str]:
+    """
+    Get the label of every source, sources without a label are called
+    Source 1, Source 2 and so on.
+
+    Args:
+        data (Mapping): the entry data
+        source_count (int): the number of sources of the model
+
+    Returns:
+        list[str]: one label per source
+    """
+    labels = data.get(CONF_SOURCES) or []
+
+    return [
+        labels[index] if index < len(labels) and labels[index] else f"Source {index + 1}"
+        for index in range(source_count)
+    ]
+
+
+def get_active_zones(data: Mapping[str, Any], zone_count: int) -> list[int]:
+    """
+    Get the zones that have an entity, every zone unless some were turned
+    off in the options.
+
+    Args:
+        data (Mapping): the entry data
+        zone_count (int): the number of zones of the model
+
+    Returns:
+        list[int]: the active zone numbers
+    """
+    active_zones = data.get(CONF_ACTIVE_ZONES)
+
+    if active_zones is None:
+        return list(range(1, zone_count + 1))
+
+    return [zone for zone in active_zones if 1 <= zone <= zone_count]
+
+
+def get_entity_zones(data: Mapping[str, Any], zone_count: int) -> list[int]:
+    """
+    Get the zones that get a new entity, the active zones that the gateway
+    reported as enabled. Until it has, every active zone gets one. Entities
+    that already exist are kept for every active zone, see
+    _async_cleanup_registry_entries.
+
+    Args:
+        data (Mapping): the entry data
+        zone_count (int): the number of zones of the model
+
+    Returns:
+        list[int]: the zone numbers
+    """
+    enabled_zones = data.get(CONF_ENABLED_ZONES)
+    active_zones = get_active_zones(data, zone_count)
+
+    if enabled_zones is None:
+        return active_zones
+
+    return [zone for zone in active_zones if zone in enabled_zones]
+
+
+def model_info_to_dict(model_info: HtdModelInfo) -> dict:
+    """
+    Convert the model info into something that can be stored in a config entry.
+
+    Args:
+        model_info (HtdModelInfo): the model info reported by the gateway
+
+    Returns:
+        dict: the name, zones, sources and friendly name of the model
+    """
+    return {key: model_info[key] for key in STORED_MODEL_KEYS}
+
+
+def model_info_from_dict(stored: dict | None) -> HtdModelInfo | None:
+    """
+    Look up the full model info for a model stored in a config entry.
+
+    Args:
+        stored (dict): the stored model, see `model_info_to_dict`
+
+    Returns:
+        HtdModelInfo: the supported model with the same name, or None if unknown
+    """
+    if not stored:
+        return None
+
+    for model_info in HtdConstants.SUPPORTED_MODELS.values():
+        if model_info["name"] == stored.get("name"):
+            return model_info
+
+    return None
+
+
+def _get_zone_id(entity_unique_id: str, unique_id: str) -> str | None:
+    # the media player of a zone has the zone id, its other entities add a key, e.g. _01_bass
+    zone_id_length = len(unique_id) + 3
+    zone_id = entity_unique_id[:zone_id_length]
+
+    if entity_unique_id[zone_id_length:zone_id_length + 1] not in ("", "_"):
+        return None
+
+    return zone_id
+
 
 @callback
 def _async_cleanup_registry_entries(
     hass: HomeAssistant,
     config_entry: ConfigEntry
 ) -> None:
-    """Remove extra entities that are no longer part of the integration."""
-    pass
-
-    # entity_registry = er.async_get(hass)
-
-    # existing_entries = er.async_entries_for_config_entry(
-    #     entity_registry,
-    #     config_entry.entry_id
-    # )
-    # entities = {(entity.domain, entity.unique_id): entity.entity_id for entity
-    #             in existing_entries}
-
-    # active_zones = config_entry.options.get(CONF_ACTIVE_ZONES)
-    #
-    # extra_entities = existing_entries[active_zones:]
-    #
-    # # extra_entities = set(entities.keys()).difference(htd_data.unique_ids)
-    # # if not extra_entities:
-    # #     return
-    #
-    # for entity in extra_entities:
-    #     if entity_registry.async_is_registered(entity.entity_id):
-    #         entity_registry.async_remove(entity.entity_id)
-    #
-    # _LOGGER.info(
-    #     "Cleaning up  HTD entities: removed %s extra entities for config "
-    #     "entry %s",
-    #     len(extra_entities),
-    #     config_entry.entry_id
-    # )
+    """
+    Remove the entities of zones that are turned off in the options. Zones
+    the gateway reports as disabled keep theirs, a keypad frame must never
+    throw away the names and areas a user gave them.
+    """
+    zone_count = (config_entry.data.get(CONF_MODEL) or {}).get("zones", 0)
+    unique_id = config_entry.data.get(CONF_UNIQUE_ID)
+    active_zones = get_active_zones(config_entry.data, zone_count)
+
+    inactive = {
+        f"{unique_id}_{zone:02}" for zone in range(1, zone_count + 1) if zone not in active_zones
+    }
+
+    entity_registry = er.async_get(hass)
+
+    extra_entities = [
+        entity for entity in er.async_entries_for_config_entry(entity_registry, config_entry.entry_id)
+        if _get_zone_id(entity.unique_id, unique_id) in inactive
+    ]
+
+    if not extra_entities:
+        return
+
+    # removing the registry entry also removes the entity from Home Assistant
+    for entity in extra_entities:
+        entity_registry.async_remove(entity.entity_id)
+
+    _LOGGER.info(
+        "Cleaning up HTD entities: removed %s entities of turned off zones of %s",
+        len(extra_entities),
+        config_entry.title
+    )
@@ -0,0 +1,157 @@
+"""Recovery from gateways that silently stop sending updates"""
+
+import asyncio
+import logging
+
+from homeassistant.core import HomeAssistant, callback
+from htd_client import BaseClient
+
+from .connection import HtdConnectionManager
+from .const import DEFAULT_STALE_TIMEOUT, RESYNC_TIMEOUT
+from .dispatcher import HtdZoneDispatcher
+from .scheduler import HtdCommandScheduler
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class HtdStaleWatchdog:
+    """
+    Notices when a connected gateway has been silent for too long, e.g. on a
+    half-open connection. The zones that matter are queried first, every zone
+    is refreshed only if they stay silent, and as a last resort the
+    connection is dropped so it is reopened.
+    """
+
+    hass: HomeAssistant = None
+    client: BaseClient = None
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        client: BaseClient,
+        dispatcher: HtdZoneDispatcher,
+        scheduler: HtdCommandScheduler,
+        connection: HtdConnectionManager,
+    ):
+        self.hass = hass
+        self.client = client
+        self._dispatcher = dispatcher
+        self._scheduler = scheduler
+        self._connection = connection
+        self._wake = asyncio.Event()
+        # nothing is expected from the gateway before this, the start or the last reconnect
+        self._expect_updates_from: float | None = None
+
+        self.timeout: float = DEFAULT_STALE_TIMEOUT
+
+        self.zone_resyncs = 0
+        self.full_refreshes = 0
+        self.reconnects = 0
+
+    @callback
+    def async_configure(self, timeout: float) -> None:
+        """Change the stale timeout, 0 turns the watchdog off."""
+        self.timeout = timeout
+        self._wake.set()
+
+    async def async_run(self) -> None:
+        """Run for the lifetime of the client, cancelled on unload."""
+        self._expect_updates_from = self.hass.loop.time()
+
+        while True:
+            wait = self._seconds_until_stale()
+
+            if wait is not None and wait <= 0:
+                await self._async_recover()
+                continue
+
+            self._wake.clear()
+
+            try:
+                async with asyncio.timeout(wait):
+                    await self._wake.wait()
+            except TimeoutError:
+                pass
+
+    def _seconds_until_stale(self) -> float | None:
+        if not self.timeout:
+            return None
+
+        # the connection manager takes care of a client that is not connected
+        if not self.client.connected:
+            return self.timeout
+
+        # a reconnect gets the whole timeout, whether or not the connection was already replaced
+        last_update = max(self._dispatcher.last_update or 0, self._expect_updates_from)
+
+        return last_update + self.timeout - self.hass.loop.time()
+
+    async def _async_recover(self) -> None:
+        name = self._connection.name
+        zones = self._get_resync_zones()
+        zone_count = self.client.get_zone_count()
+
+        # when most zones need it, one full refresh is cheaper than a query per zone
+        if len(zones) <= zone_count // 2:
+            _LOGGER.debug(
+                "No updates from %s for %d seconds, querying zones %s",
+                name,
+                self.timeout,
+                ", ".join(map(str, zones)),
+            )
+
+            self.zone_resyncs += 1
+
+            for zone in zones:
+                self.client.refresh(zone)
+
+            if await self._async_wait_for_update():
+                return
+
+        _LOGGER.info("%s did not answer, refreshing every zone", name)
+
+        self.full_refreshes += 1
+        self.client.refresh()
+
+        if await self._async_wait_for_update():
+            return
+
+        _LOGGER.warning("%s stopped answering, reconnecting", name)
+
+        self.reconnects += 1
+        self._expect_updates_from = self.hass.loop.time()
+        self._connection.async_reconnect()
+
+    def _get_resync_zones(self) -> list[int]:
+        """The zones with commands waiting on the gateway, or without a state yet."""
+        zone_count = self.client.get_zone_count()
+        enabled_zones = self._dispatcher.enabled_zones or range(1, zone_count + 1)
+        zones = {zone for zone in self._scheduler.pending_zones() if 1 <= zone <= zone_count}
+
+        # disabled zones may never report, they don't count as missing
+        for zone in enabled_zones:
+            if not self.client.has_zone_data(zone) or self.client.get_zone(zone).power is None:
+                zones.add(zone)
+
+        # nothing is waiting on the gateway, the zone heard from least recently
+        # tells whether it still answers at all
+        if not zones:
+            zone_updates = self._dispatcher.zone_updates
+            zones.add(min(enabled_zones, key=lambda zone: zone_updates.get(zone, 0)))
+
+        return sorted(zones)
+
+    async def _async_wait_for_update(self) -> bool:
+        updates_received = self._dispatcher.updates_received
+        await asyncio.sleep(RESYNC_TIMEOUT)
+
+        return self._dispatcher.updates_received > updates_received
+
+    @property
+    def stats(self) -> dict[str, int | float]:
+        return {
+            "stale_timeout": self.timeout,
+            "zone_resyncs": self.zone_resyncs,
+            "full_refreshes": self.full_refreshes,
+            "reconnects": self.reconnects,
+        }
@@ -0,0 +1,53 @@
+"""Fixtures for the tests, a bare Home Assistant instance and simulated gateways"""
+
+from typing import Awaitable, Callable
+
+import pytest_asyncio
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from tools.harness import HOST, async_create_hass, create_entry, get_free_port
+from tools.simulator import HtdGatewaySimulator
+
+GatewayFactory = Callable[..., Awaitable[tuple[ConfigEntry, HtdGatewaySimulator]]]
+
+
+@pytest_asyncio.fixture
+async def hass(tmp_path) -> HomeAssistant:
+    hass = await async_create_hass(str(tmp_path))
+    yield hass
+    await hass.async_stop()
+
+
+@pytest_asyncio.fixture
+async def add_gateway(hass: HomeAssistant) -> GatewayFactory:
+    """Start a simulated gateway and set up a config entry for it, returns once every zone has a state."""
+    entries = []
+    servers = []
+    simulators = []
+
+    async def _add_gateway(model: str = "lync6", **options) -> tuple[ConfigEntry, HtdGatewaySimulator]:
+        port = get_free_port()
+        simulator = HtdGatewaySimulator(model=model, seed=0)
+        servers.append(await simulator.async_start_tcp(HOST, port))
+        simulators.append(simulator)
+
+        entry = create_entry(model, port, **options)
+        await hass.config_entries.async_add(entry)
+        entries.append(entry)
+
+        await entry.runtime_data.dispatcher.async_wait_for_first_state()
+        await hass.async_block_till_done()
+
+        return entry, simulator
+
+    yield _add_gateway
+
+    for entry in entries:
+        await hass.config_entries.async_remove(entry.entry_id)
+
+    for server in servers:
+        server.close()
+
+    for simulator in simulators:
+        simulator.stop()
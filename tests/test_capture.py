@@ -0,0 +1,50 @@
+"""Tests for the traffic capture"""
+
+import asyncio
+
+from homeassistant.core import HomeAssistant
+
+from custom_components.htd.capture import CaptureRecord, read_capture
+from custom_components.htd.const import CONF_CAPTURE
+from custom_components.htd.protocol import DIRECTION_RECEIVED, DIRECTION_SENT
+
+
+def read_capture_records(path: str) -> tuple[str, list[CaptureRecord]]:
+    model_name, records = read_capture(path)
+    return model_name, list(records)
+
+
+async def test_capture_to_file(hass: HomeAssistant, add_gateway):
+    # turned on when the entry is set up, like the option is after a restart
+    entry, simulator = await add_gateway(**{CONF_CAPTURE: True})
+    capture = entry.runtime_data.capture
+    client = entry.runtime_data.client
+    assert capture.enabled
+
+    simulator.zones[2].power = not client.get_zone(2).power
+
+    for zone in (1, 2, 3):
+        simulator.broadcast_zone(zone)
+
+    async with asyncio.timeout(5):
+        while client.get_zone(2).power != simulator.zones[2].power:
+            await asyncio.sleep(0.01)
+
+    capture.async_configure(False)
+    records = capture.records
+    await capture.async_flush()
+
+    # nothing is recorded once it's off
+    simulator.broadcast_zone(1)
+    await asyncio.sleep(0.1)
+    assert capture.records == records
+
+    model_name, captured = await hass.async_add_executor_job(read_capture_records, capture.path)
+
+    assert model_name == client.model["name"]
+    assert len(captured) == records
+    assert {record.direction for record in captured} == {DIRECTION_RECEIVED, DIRECTION_SENT}
+    assert [record.timestamp for record in captured] == sorted(record.timestamp for record in captured)
+
+    received = b"".join(record.data for record in captured if record.direction == DIRECTION_RECEIVED)
+    assert simulator.build_status_frame(2) in received
@@ -0,0 +1,102 @@
+"""Tests for the connection manager"""
+
+import asyncio
+
+from homeassistant.core import HomeAssistant
+
+from custom_components.htd.client import HtdGatewayClient
+from tools.harness import HOST, get_free_port
+from tools.simulator import HtdGatewaySimulator
+
+
+async def async_wait_until_ready(client: HtdGatewayClient) -> None:
+    async with asyncio.timeout(5):
+        while not client.ready:
+            await asyncio.sleep(0.01)
+
+
+async def test_reconnect_opens_one_connection(hass: HomeAssistant, add_gateway):
+    entry, simulator = await add_gateway()
+    runtime_data = entry.runtime_data
+    opened = simulator.connections_opened
+
+    runtime_data.connection.async_reconnect()
+    await asyncio.sleep(0)
+    assert not runtime_data.client.ready
+
+    await async_wait_until_ready(runtime_data.client)
+
+    # give a second connection, like the one htd_client opens on its own, the time to show up
+    await asyncio.sleep(0.2)
+
+    assert simulator.connections_opened == opened + 1
+    assert simulator.open_connections == 1
+    assert runtime_data.connection.reconnects == 1
+
+
+async def test_lost_connection_opens_one_connection(hass: HomeAssistant, add_gateway):
+    entry, simulator = await add_gateway()
+    runtime_data = entry.runtime_data
+    opened = simulator.connections_opened
+
+    # the gateway drops the connection
+    runtime_data.client._connection.close()
+    await asyncio.sleep(0)
+
+    await async_wait_until_ready(runtime_data.client)
+    await asyncio.sleep(0.2)
+
+    assert simulator.connections_opened == opened + 1
+    assert simulator.open_connections == 1
+
+
+async def test_new_address_moves_the_connection(hass: HomeAssistant, add_gateway):
+    entry, old = await add_gateway()
+    runtime_data = entry.runtime_data
+
+    new = HtdGatewaySimulator(model="lync6", seed=0)
+    port = get_free_port()
+    server = await new.async_start_tcp(HOST, port)
+
+    try:
+        runtime_data.connection.async_set_network_address((HOST, port))
+        await asyncio.sleep(0)
+
+        await async_wait_until_ready(runtime_data.client)
+        await asyncio.sleep(0.2)
+
+        assert old.open_connections == 0
+        assert new.connections_opened == 1
+        assert new.open_connections == 1
+
+    finally:
+        server.close()
+
+
+async def test_new_address_while_connecting(hass: HomeAssistant, add_gateway):
+    entry, old = await add_gateway()
+    runtime_data = entry.runtime_data
+
+    new = HtdGatewaySimulator(model="lync6", seed=0)
+    port = get_free_port()
+    server = await new.async_start_tcp(HOST, port)
+
+    try:
+        # the manager starts connecting to the old address again
+        runtime_data.connection.async_reconnect()
+
+        async with asyncio.timeout(5):
+            while runtime_data.connection.connect_attempts < 2:
+                await asyncio.sleep(0)
+
+        runtime_data.connection.async_set_network_address((HOST, port))
+
+        await async_wait_until_ready(runtime_data.client)
+        await asyncio.sleep(0.2)
+
+        assert old.open_connections == 0
+        assert new.open_connections == 1
+        assert runtime_data.client.network_address == (HOST, port)
+
+    finally:
+        server.close()
@@ -0,0 +1,41 @@
+"""Tests for the network scan"""
+
+import pytest
+from htd_client import HtdConstants
+
+from custom_components.htd.discovery import async_probe_gateway, async_scan_network
+from tools.harness import HOST, get_free_port
+from tools.simulator import HtdGatewaySimulator
+
+
+@pytest.fixture
+async def simulator():
+    simulator = HtdGatewaySimulator(model="lync6", seed=0)
+    simulator.port = get_free_port()
+    server = await simulator.async_start_tcp(HOST, simulator.port)
+    yield simulator
+    server.close()
+    simulator.stop()
+
+
+async def test_probe_opens_one_connection(simulator: HtdGatewaySimulator):
+    model_info = await async_probe_gateway(HOST, simulator.port)
+
+    assert model_info == HtdConstants.SUPPORTED_MODELS["lync6"]
+    assert simulator.connections_opened == 1
+
+
+async def test_probe_without_gateway():
+    assert await async_probe_gateway(HOST, get_free_port()) is None
+
+
+async def test_scan_skips_hosts_before_probing(simulator: HtdGatewaySimulator):
+    network = f"{HOST}/32"
+
+    found = [host async for host, _ in async_scan_network(network, simulator.port)]
+    assert found == [HOST]
+    assert simulator.connections_opened == 1
+
+    found = [host async for host, _ in async_scan_network(network, simulator.port, skip={HOST})]
+    assert found == []
+    assert simulator.connections_opened == 1
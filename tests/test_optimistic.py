@@ -0,0 +1,81 @@
+"""Tests for the optimistic zone state"""
+
+import asyncio
+
+from homeassistant.const import CONF_UNIQUE_ID, STATE_ON
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers import entity_registry as er
+
+from custom_components.htd.const import CONF_OPTIMISTIC
+from custom_components.htd.optimistic import (
+    FIELD_POWER,
+    FIELD_VOLUME,
+    OUTCOME_CONFIRMED,
+    OUTCOME_ROLLED_BACK,
+    HtdOptimisticState,
+)
+
+
+def test_get_does_not_settle():
+    stats = {}
+    state = HtdOptimisticState(stats, timeout=5)
+    state.set(FIELD_VOLUME, 30, 20, now=0)
+
+    # reading the confirmed value, or reading after the deadline, leaves it pending
+    assert state.get(FIELD_VOLUME, 30) == 30
+    assert state.get(FIELD_VOLUME, 20) == 30
+    assert state.get(FIELD_POWER, True) is True
+    assert state.pending_fields == [FIELD_VOLUME]
+    assert stats == {}
+
+
+def test_reconcile_settles():
+    stats = {}
+    state = HtdOptimisticState(stats, timeout=5)
+    state.set(FIELD_VOLUME, 30, 20, now=0)
+    state.set(FIELD_POWER, True, False, now=0)
+
+    assert state.reconcile(FIELD_VOLUME, 30, now=1) == 30
+    assert state.reconcile(FIELD_POWER, False, now=1) is True
+    assert state.pending_fields == [FIELD_POWER]
+
+    assert state.reconcile(FIELD_POWER, False, now=5) is False
+    assert not state.has_pending
+    assert stats[FIELD_VOLUME][OUTCOME_CONFIRMED] == 1
+    assert stats[FIELD_POWER][OUTCOME_ROLLED_BACK] == 1
+
+
+async def test_entity_settles_on_update(hass: HomeAssistant, add_gateway):
+    entry, simulator = await add_gateway(**{CONF_OPTIMISTIC: True})
+    stats = entry.runtime_data.optimistic_stats
+    entity_registry = er.async_get(hass)
+    entity_id = entity_registry.async_get_entity_id("media_player", "htd", f"{entry.data[CONF_UNIQUE_ID]}_02")
+
+    simulator.zones[2].power = True
+    simulator.broadcast_zone(2)
+
+    async with asyncio.timeout(5):
+        while hass.states.get(entity_id).state != STATE_ON:
+            await asyncio.sleep(0.01)
+
+    simulator.latency = 0.2
+
+    task = hass.async_create_task(
+        hass.services.async_call(
+            "media_player", "volume_set", {"entity_id": entity_id, "volume_level": 0.5}, blocking=True
+        )
+    )
+    await asyncio.sleep(0.1)
+
+    # the expected volume shows right away, reading it settles nothing
+    assert hass.states.get(entity_id).attributes["volume_level"] == 0.5
+    assert stats == {}
+
+    await task
+    await hass.async_block_till_done()
+
+    async with asyncio.timeout(5):
+        while not stats:
+            await asyncio.sleep(0.01)
+
+    assert stats[FIELD_VOLUME][OUTCOME_CONFIRMED] == 1
@@ -0,0 +1,67 @@
+"""Tests for the frame decoder"""
+
+from htd_client.constants import HtdCommonCommands
+
+from custom_components.htd.protocol import RECEIVE_DATA_LENGTHS, HtdFrameDecoder, build_frame
+
+STATUS = HtdCommonCommands.ZONE_STATUS_RECEIVE_COMMAND
+
+
+def status_frame(zone: int, fill: int = 0) -> bytes:
+    return build_frame(zone, STATUS, [fill] * RECEIVE_DATA_LENGTHS[STATUS])
+
+
+def decode(decoder: HtdFrameDecoder, data: bytes) -> list[tuple[int, int, bytes]]:
+    decoder.feed(data)
+    return [(zone, command, bytes(frame_data)) for zone, command, frame_data in decoder.frames()]
+
+
+def test_frames_split_across_feeds():
+    decoder = HtdFrameDecoder()
+    stream = status_frame(1, 1) + status_frame(2, 2)
+
+    # one byte at a time, nothing comes out before a frame is complete
+    frames = []
+
+    for index in range(len(stream)):
+        frames += decode(decoder, stream[index:index + 1])
+
+    assert [(zone, command) for zone, command, _ in frames] == [(1, STATUS), (2, STATUS)]
+    assert frames[1][2] == bytes([2] * RECEIVE_DATA_LENGTHS[STATUS])
+    assert len(decoder) == 0
+    assert decoder.checksum_errors == 0
+    assert decoder.bytes_discarded == 0
+
+
+def test_bad_checksum_is_skipped():
+    decoder = HtdFrameDecoder()
+    corrupt = bytearray(status_frame(1))
+    corrupt[-1] ^= 0xff
+
+    frames = decode(decoder, bytes(corrupt) + status_frame(2))
+
+    assert [zone for zone, _, _ in frames] == [2]
+    assert decoder.checksum_errors == 1
+    assert decoder.bytes_discarded == len(corrupt)
+
+
+def test_bad_checksum_in_split_frame():
+    decoder = HtdFrameDecoder()
+    corrupt = bytearray(status_frame(1))
+    corrupt[5] ^= 0xff
+    stream = bytes(corrupt) + status_frame(2) + status_frame(3)
+
+    frames = decode(decoder, stream[:len(corrupt) + 3])
+    frames += decode(decoder, stream[len(corrupt) + 3:])
+
+    assert [zone for zone, _, _ in frames] == [2, 3]
+    assert decoder.checksum_errors == 1
+
+
+def test_garbage_before_header():
+    decoder = HtdFrameDecoder()
+
+    frames = decode(decoder, b"\x00\x13\x37" + status_frame(4))
+
+    assert [zone for zone, _, _ in frames] == [4]
+    assert decoder.bytes_discarded == 3
@@ -0,0 +1,105 @@
+"""Tests for the command scheduler"""
+
+import asyncio
+
+from homeassistant.core import HomeAssistant
+
+from custom_components.htd.scheduler import (
+    COMMAND_MUTE,
+    COMMAND_SOURCE,
+    COMMAND_VOLUME,
+    CommandFactory,
+    POWER_ALL_COMMANDS,
+    HtdCommandScheduler,
+)
+
+
+def make_command(sent: list, key: str | None, value) -> CommandFactory:
+    """A command that only notes that it was sent."""
+    async def _send():
+        sent.append((key, value))
+
+    return _send
+
+
+async def test_last_write_wins(hass: HomeAssistant):
+    scheduler = HtdCommandScheduler(hass, None, command_interval=0)
+    sent = []
+
+    # queued within one loop iteration, before the zone's worker starts
+    await asyncio.gather(
+        scheduler.async_submit(1, COMMAND_VOLUME, make_command(sent, COMMAND_VOLUME, 10)),
+        scheduler.async_submit(1, COMMAND_MUTE, make_command(sent, COMMAND_MUTE, True)),
+        scheduler.async_submit(1, COMMAND_VOLUME, make_command(sent, COMMAND_VOLUME, 20)),
+        scheduler.async_submit(1, None, make_command(sent, None, "up")),
+        scheduler.async_submit(1, None, make_command(sent, None, "up")),
+        scheduler.async_submit(1, COMMAND_VOLUME, make_command(sent, COMMAND_VOLUME, 30)),
+        scheduler.async_submit(2, COMMAND_VOLUME, make_command(sent, COMMAND_VOLUME, 40)),
+    )
+
+    # every waiter returned, only the last volume of zone 1 went out, commands without a key never merge
+    assert [command for command in sent if command != (COMMAND_VOLUME, 40)] == [
+        (COMMAND_VOLUME, 30),
+        (COMMAND_MUTE, True),
+        (None, "up"),
+        (None, "up"),
+    ]
+    assert (COMMAND_VOLUME, 40) in sent
+    assert scheduler.commands_dropped == 2
+    assert scheduler.pending_count() == 0
+
+
+async def test_replacing_keeps_the_order(hass: HomeAssistant):
+    scheduler = HtdCommandScheduler(hass, None, command_interval=0)
+    sent = []
+
+    await asyncio.gather(
+        scheduler.async_submit(1, COMMAND_VOLUME, make_command(sent, COMMAND_VOLUME, 10)),
+        scheduler.async_submit(1, COMMAND_SOURCE, make_command(sent, COMMAND_SOURCE, 2)),
+        scheduler.async_submit(1, COMMAND_VOLUME, make_command(sent, COMMAND_VOLUME, 20)),
+    )
+
+    # the volume was queued first, a newer volume doesn't move it behind the source
+    assert sent == [(COMMAND_VOLUME, 20), (COMMAND_SOURCE, 2)]
+
+
+async def test_replaced_command_shares_the_failure(hass: HomeAssistant):
+    scheduler = HtdCommandScheduler(hass, None, command_interval=0)
+
+    async def _fail():
+        raise OSError("no gateway")
+
+    results = await asyncio.gather(
+        scheduler.async_submit(1, COMMAND_VOLUME, _fail),
+        scheduler.async_submit(1, COMMAND_VOLUME, _fail),
+        return_exceptions=True,
+    )
+
+    assert all(isinstance(result, OSError) for result in results)
+    assert scheduler.commands_failed == 1
+    assert scheduler.commands_dropped == 1
+
+
+async def test_power_all_frame_goes_to_zone_one(hass: HomeAssistant, add_gateway):
+    entry, simulator = await add_gateway()
+    client = entry.runtime_data.client
+    sent = []
+
+    # zone 1 disabled, so the first zone that is checked is zone 2
+    simulator.zones[1].enabled = False
+    simulator.zones[2].power = True
+    client.refresh()
+
+    async with asyncio.timeout(5):
+        while client.get_zone(1).enabled or not client.get_zone(2).power:
+            await asyncio.sleep(0.01)
+
+    client.codec.recorder = lambda direction, data: sent.append(bytes(data))
+    await entry.runtime_data.scheduler.async_power_all(False)
+    client.codec.recorder = None
+
+    command, data_off, _ = POWER_ALL_COMMANDS[client.model["kind"]]
+    frames = [frame for frame in sent if frame[3:5] == bytes((command, data_off))]
+
+    assert frames and all(frame[2] == 1 for frame in frames)
+    assert not client.get_zone(2).power
@@ -0,0 +1,137 @@
+"""Tests for the zone services and how they plan their commands"""
+
+import asyncio
+
+import pytest
+from homeassistant.core import HomeAssistant
+from homeassistant.exceptions import ServiceValidationError
+
+from custom_components.htd.const import DOMAIN
+from custom_components.htd.optimistic import FIELD_MUTE, FIELD_POWER, FIELD_SOURCE, FIELD_VOLUME
+from custom_components.htd.scheduler import ALL_ZONES
+from custom_components.htd.services import (
+    ATTR_ALL_OFF,
+    ATTR_CONFIG_ENTRY_ID,
+    ATTR_MUTE,
+    ATTR_POWER,
+    ATTR_SOURCE,
+    ATTR_VOLUME,
+    ATTR_ZONE,
+    ATTR_ZONES,
+    SERVICE_APPLY_ZONES,
+    plan_zone_commands,
+)
+from tools.simulator import HtdGatewaySimulator
+
+
+@pytest.mark.parametrize("model", ["lync6", "mca66"])
+async def test_all_off_before_zone_commands(hass: HomeAssistant, add_gateway, model: str):
+    entry, simulator = await add_gateway(model)
+    client = entry.runtime_data.client
+
+    for zone in (1, 3):
+        simulator.zones[zone].power = True
+        simulator.broadcast_zone(zone)
+
+    async with asyncio.timeout(5):
+        while not (client.get_zone(1).power and client.get_zone(3).power):
+            await asyncio.sleep(0.01)
+
+    # the gateway echoes the all off after the next command was due
+    simulator.latency = 0.2
+
+    await hass.services.async_call(
+        DOMAIN,
+        SERVICE_APPLY_ZONES,
+        {
+            ATTR_CONFIG_ENTRY_ID: entry.entry_id,
+            ATTR_ALL_OFF: True,
+            ATTR_ZONES: [{ATTR_ZONE: 3, ATTR_POWER: True}],
+        },
+        blocking=True,
+        return_response=True,
+    )
+
+    # every echo of the gateway has arrived
+    await asyncio.sleep(0.5)
+
+    assert not simulator.zones[1].power
+    assert simulator.zones[3].power
+    assert not client.get_zone(1).power
+    assert client.get_zone(3).power
+
+
+async def async_set_power(client, simulator: HtdGatewaySimulator, power: dict[int, bool]) -> None:
+    for zone, is_on in power.items():
+        simulator.zones[zone].power = is_on
+        simulator.broadcast_zone(zone)
+
+    async with asyncio.timeout(5):
+        while any(client.get_zone(zone).power != is_on for zone, is_on in power.items()):
+            await asyncio.sleep(0.01)
+
+
+async def test_plan_skips_what_is_already_set(hass: HomeAssistant, add_gateway):
+    entry, simulator = await add_gateway()
+    client = entry.runtime_data.client
+    await async_set_power(client, simulator, {1: True, 2: False})
+    zone_info = client.get_zone(1)
+
+    targets = [
+        {ATTR_ZONE: 1, ATTR_POWER: True, ATTR_SOURCE: zone_info.source, ATTR_VOLUME: zone_info.volume},
+        {ATTR_ZONE: 2, ATTR_POWER: False, ATTR_VOLUME: 10},
+    ]
+    assert plan_zone_commands(client, targets) == []
+
+    targets[0][ATTR_VOLUME] = zone_info.volume + 1
+    targets[0][ATTR_MUTE] = not zone_info.mute
+    assert plan_zone_commands(client, targets) == [
+        (1, FIELD_VOLUME, zone_info.volume + 1),
+        (1, FIELD_MUTE, not zone_info.mute),
+    ]
+
+
+async def test_plan_turns_zones_on_before_setting_them(hass: HomeAssistant, add_gateway):
+    entry, simulator = await add_gateway()
+    client = entry.runtime_data.client
+    await async_set_power(client, simulator, {2: False})
+    source = client.get_zone(2).source % client.get_source_count() + 1
+
+    assert plan_zone_commands(client, [{ATTR_ZONE: 2, ATTR_POWER: True, ATTR_SOURCE: source}]) == [
+        (2, FIELD_POWER, True),
+        (2, FIELD_SOURCE, source),
+    ]
+
+
+async def test_plan_uses_one_frame_to_turn_everything_off(hass: HomeAssistant, add_gateway):
+    entry, simulator = await add_gateway()
+    client = entry.runtime_data.client
+    await async_set_power(client, simulator, {zone: zone in (1, 3) for zone in simulator.zones})
+
+    targets = [{ATTR_ZONE: 1, ATTR_POWER: False}, {ATTR_ZONE: 3, ATTR_POWER: False}]
+    assert plan_zone_commands(client, targets) == [(ALL_ZONES, FIELD_POWER, False)]
+
+    # a zone that stays on needs the zones turned off one by one
+    targets[1] = {ATTR_ZONE: 3, ATTR_POWER: True}
+    assert plan_zone_commands(client, targets) == [(1, FIELD_POWER, False)]
+
+    # all off with the zone turned on again afterwards
+    assert plan_zone_commands(client, targets, all_off=True) == [
+        (ALL_ZONES, FIELD_POWER, False),
+        (3, FIELD_POWER, True),
+    ]
+
+    # only one zone is on, its own command does it
+    await async_set_power(client, simulator, {3: False})
+    assert plan_zone_commands(client, [], all_off=True) == [(1, FIELD_POWER, False)]
+
+
+async def test_plan_rejects_unknown_zones(hass: HomeAssistant, add_gateway):
+    entry, _ = await add_gateway()
+    client = entry.runtime_data.client
+
+    with pytest.raises(ServiceValidationError):
+        plan_zone_commands(client, [{ATTR_ZONE: client.get_zone_count() + 1, ATTR_POWER: True}])
+
+    with pytest.raises(ServiceValidationError):
+        plan_zone_commands(client, [{ATTR_ZONE: 1, ATTR_SOURCE: client.get_source_count() + 1}])
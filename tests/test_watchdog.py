@@ -0,0 +1,33 @@
+"""Tests for the recovery from silent gateways"""
+
+import asyncio
+
+from homeassistant.core import HomeAssistant
+
+from custom_components.htd import watchdog
+from custom_components.htd.const import CONF_STALE_TIMEOUT
+
+STALE_TIMEOUT = 0.5
+
+
+async def test_reconnect_waits_for_the_timeout(hass: HomeAssistant, add_gateway, monkeypatch):
+    monkeypatch.setattr(watchdog, "RESYNC_TIMEOUT", 0.05)
+
+    entry, simulator = await add_gateway(**{CONF_STALE_TIMEOUT: STALE_TIMEOUT})
+    stale_watchdog = entry.runtime_data.watchdog
+
+    # a gateway that still accepts connections but never answers
+    simulator.stalled = True
+
+    async with asyncio.timeout(5):
+        while not stale_watchdog.reconnects:
+            await asyncio.sleep(0.01)
+
+    full_refreshes = stale_watchdog.full_refreshes
+
+    # nothing is queried on the new connection before it had the whole timeout to answer
+    await asyncio.sleep(STALE_TIMEOUT * 0.8)
+
+    assert stale_watchdog.full_refreshes == full_refreshes
+    assert stale_watchdog.reconnects == 1
+    assert simulator.open_connections == 1
@@ -0,0 +1,37 @@
+"""Tests for zones that are disabled on the gateway"""
+
+import asyncio
+
+from homeassistant.const import CONF_UNIQUE_ID, STATE_UNAVAILABLE
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers import entity_registry as er
+
+
+async def async_wait_for_state(hass: HomeAssistant, entity_id: str, unavailable: bool) -> None:
+    async with asyncio.timeout(5):
+        while (hass.states.get(entity_id).state == STATE_UNAVAILABLE) != unavailable:
+            await asyncio.sleep(0.01)
+
+
+async def test_disabled_zone_keeps_its_entity(hass: HomeAssistant, add_gateway):
+    entry, simulator = await add_gateway()
+    client = entry.runtime_data.client
+    entity_registry = er.async_get(hass)
+
+    entity_id = entity_registry.async_get_entity_id("media_player", "htd", f"{entry.data[CONF_UNIQUE_ID]}_03")
+    entity_registry.async_update_entity(entity_id, name="Kitchen")
+    await async_wait_for_state(hass, entity_id, unavailable=False)
+
+    # a refresh of every zone is answered with the keypad frame too
+    simulator.zones[3].enabled = False
+    client.refresh()
+    await async_wait_for_state(hass, entity_id, unavailable=True)
+    await hass.async_block_till_done()
+
+    assert entity_registry.async_get(entity_id).name == "Kitchen"
+
+    simulator.zones[3].enabled = True
+    client.refresh()
+    await async_wait_for_state(hass, entity_id, unavailable=False)
+
+    assert entity_registry.async_get(entity_id).name == "Kitchen"
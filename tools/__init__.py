@@ -0,0 +1 @@
+"""Development tools for the HTD integration, they are not part of the release"""
@@ -0,0 +1,90 @@
+"""
+A bare Home Assistant instance that loads the integration from this
+repository, shared by the benchmarks, the replay and the tests.
+"""
+
+import asyncio
+import socket
+from types import MappingProxyType
+
+from homeassistant import auth, config_entries, core, loader
+from homeassistant.components.http import CONF_SERVER_HOST, CONF_SERVER_PORT
+from homeassistant.const import CONF_HOST, CONF_PORT, CONF_UNIQUE_ID
+from homeassistant.helpers import (
+    area_registry,
+    category_registry,
+    device_registry,
+    entity_registry,
+    floor_registry,
+    issue_registry,
+    label_registry,
+)
+from homeassistant.setup import async_setup_component
+from htd_client import HtdConstants
+
+from custom_components.htd.const import CONF_MODEL, DOMAIN
+from custom_components.htd.utils import model_info_to_dict
+
+HOST = "127.0.0.1"
+
+
+async def async_create_hass(config_dir: str) -> core.HomeAssistant:
+    """
+    Start Home Assistant with only the registries and http. The integration
+    is found because `custom_components` of this repository is already
+    imported, the config directory can stay empty.
+    """
+    hass = core.HomeAssistant(config_dir)
+    loader.async_setup(hass)
+
+    await asyncio.gather(
+        area_registry.async_load(hass),
+        category_registry.async_load(hass),
+        device_registry.async_load(hass),
+        entity_registry.async_load(hass),
+        floor_registry.async_load(hass),
+        issue_registry.async_load(hass),
+        label_registry.async_load(hass),
+    )
+
+    hass.auth = await auth.auth_manager_from_config(hass, [], [])
+    hass.config_entries = config_entries.ConfigEntries(hass, {})
+    await hass.config_entries.async_initialize()
+
+    # media_player needs http, keep it local and off the default port
+    await async_setup_component(
+        hass, "http", {"http": {CONF_SERVER_HOST: [HOST], CONF_SERVER_PORT: get_free_port()}}
+    )
+    await hass.async_start()
+
+    return hass
+
+
+def create_entry(model: str, port: int, **options) -> config_entries.ConfigEntry:
+    """A config entry for a simulated gateway of the model on the local port."""
+    unique_id = f"simulated-{port}"
+
+    return config_entries.ConfigEntry(
+        data={
+            CONF_HOST: HOST,
+            CONF_PORT: port,
+            CONF_UNIQUE_ID: unique_id,
+            CONF_MODEL: model_info_to_dict(HtdConstants.SUPPORTED_MODELS[model]),
+            **options,
+        },
+        discovery_keys=MappingProxyType({}),
+        domain=DOMAIN,
+        minor_version=1,
+        options={},
+        source=config_entries.SOURCE_USER,
+        title=f"Simulated {port}",
+        unique_id=unique_id,
+        version=1,
+    )
+
+
+def get_free_port() -> int:
+    """A local TCP port nothing listens on right now."""
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
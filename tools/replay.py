@@ -0,0 +1,237 @@
+"""
+Replays a traffic capture through the integration, to reproduce offline what
+a gateway sent in production and to catch performance regressions with it.
+
+A bare Home Assistant instance loads the integration from this repository
+against a simulated gateway of the captured model. Once every zone has a
+state the simulator goes quiet, and the captured reads are handed to the
+client like the transport would, at the recorded pace or as fast as
+possible. The commands in the capture are counted, not replayed. It reports
+the CPU time and a checksum of the final zone and entity state, the same
+capture always ends with the same checksum.
+
+.. code-block:: shell
+
+    # the rotated files oldest first, as fast as possible
+    python -m tools.replay capture_<entry id>.bin.1 capture_<entry id>.bin
+
+    # at the recorded pace
+    python -m tools.replay capture_<entry id>.bin --speed 1
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import tempfile
+import time
+from typing import Any
+
+from homeassistant import core
+from homeassistant.helpers import entity_registry
+from htd_client import HtdConstants
+
+from custom_components.htd.capture import CaptureRecord, read_capture
+from custom_components.htd.const import CONF_STALE_TIMEOUT, DOMAIN
+from custom_components.htd.protocol import DIRECTION_RECEIVED, DIRECTION_SENT
+from tools.harness import HOST, async_create_hass, create_entry
+from tools.simulator import HtdGatewaySimulator
+
+_LOGGER = logging.getLogger(__name__)
+
+REPLAY_PORT = 21006
+
+# the zone fields and media player attributes that make up the final state
+ZONE_FIELDS = ("enabled", "power", "mute", "mode", "source", "volume", "treble", "bass", "balance")
+ENTITY_ATTRIBUTES = ("volume_level", "is_volume_muted", "source")
+
+
+def load_records(paths: list[str]) -> tuple[str, list[CaptureRecord]]:
+    """
+    Read the capture files in order, the timestamps of each file continue
+    where the one before it ended.
+
+    Returns:
+        tuple[str, list[CaptureRecord]]: the model to simulate, and every record
+
+    Raises:
+        ValueError: the files are no captures, or of different models
+    """
+    model = None
+    records = []
+    offset = 0.0
+
+    for path in paths:
+        model_name, file_records = read_capture(path)
+        file_model = next(
+            (key for key, info in HtdConstants.SUPPORTED_MODELS.items() if info["name"] == model_name), None
+        )
+
+        if file_model is None or model not in (None, file_model):
+            raise ValueError(f"{path} is a capture of {model_name}, expected {model}")
+
+        model = file_model
+
+        for record in file_records:
+            records.append(record._replace(timestamp=record.timestamp + offset))
+
+        if records:
+            offset = records[-1].timestamp
+
+    if model is None:
+        raise ValueError("No capture files given")
+
+    return model, records
+
+
+def get_state_checksum(hass: core.HomeAssistant, entry) -> str:
+    """A checksum of the zones of the client and the state of their media players."""
+    client = entry.runtime_data.client
+    state = []
+
+    for zone in range(1, client.get_zone_count() + 1):
+        zone_info = client.get_zone(zone) if client.has_zone_data(zone) else None
+        state.append([zone, *(getattr(zone_info, field, None) for field in ZONE_FIELDS)])
+
+    registry = entity_registry.async_get(hass)
+
+    for registry_entry in sorted(
+        entity_registry.async_entries_for_config_entry(registry, entry.entry_id), key=lambda e: e.unique_id
+    ):
+        entity_state = hass.states.get(registry_entry.entity_id)
+
+        if entity_state is None:
+            state.append([registry_entry.unique_id, None])
+            continue
+
+        state.append(
+            [
+                registry_entry.unique_id,
+                entity_state.state,
+                *(entity_state.attributes.get(attribute) for attribute in ENTITY_ATTRIBUTES),
+            ]
+        )
+
+    return hashlib.sha256(json.dumps(state, default=str).encode()).hexdigest()[:16]
+
+
+async def async_replay(
+    hass: core.HomeAssistant,
+    model: str,
+    records: list[CaptureRecord],
+    speed: float,
+) -> dict[str, Any]:
+    simulator = HtdGatewaySimulator(model=model, seed=0)
+    server = await simulator.async_start_tcp(HOST, REPLAY_PORT)
+
+    # the watchdog would resync a capture with long silences against the simulator
+    entry = create_entry(model, REPLAY_PORT, **{CONF_STALE_TIMEOUT: 0})
+    received = [record for record in records if record.direction == DIRECTION_RECEIVED]
+
+    result: dict[str, Any] = {
+        "model": model,
+        "records": len(records),
+        "reads": len(received),
+        "bytes_received": sum(len(record.data) for record in received),
+        "commands_sent": sum(1 for record in records if record.direction == DIRECTION_SENT),
+        "capture_seconds": records[-1].timestamp if records else 0.0,
+    }
+
+    try:
+        await hass.config_entries.async_add(entry)
+
+        runtime_data = entry.runtime_data
+        client = runtime_data.client
+        dispatcher = runtime_data.dispatcher
+        decoder = client.codec.decoder
+
+        await dispatcher.async_wait_for_first_state()
+        await hass.async_block_till_done()
+
+        # from here on only the capture reaches the client, the refreshes it sends go unanswered
+        simulator.stalled = True
+
+        frames_before = decoder.frames_decoded
+        checksum_errors_before = decoder.checksum_errors
+        discarded_before = decoder.bytes_discarded
+        writes_before = dispatcher.state_writes
+        skipped_before = dispatcher.state_writes_skipped
+
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        started = hass.loop.time()
+
+        for record in received:
+            if speed:
+                delay = started + record.timestamp / speed - hass.loop.time()
+
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            client.data_received(record.data)
+
+            # the loop gets a turn between two reads, like it does with a transport
+            await asyncio.sleep(0)
+
+        # every parsed frame was dispatched before data_received returned
+        await hass.async_block_till_done()
+
+        # the coalesced state writes run on the next iteration of the loop
+        await asyncio.sleep(0)
+
+        result["cpu_seconds"] = time.process_time() - cpu
+        result["wall_seconds"] = time.perf_counter() - wall
+        result["frames_decoded"] = decoder.frames_decoded - frames_before
+        result["checksum_errors"] = decoder.checksum_errors - checksum_errors_before
+        result["bytes_discarded"] = decoder.bytes_discarded - discarded_before
+        result["state_writes"] = dispatcher.state_writes - writes_before
+        result["state_writes_skipped"] = dispatcher.state_writes_skipped - skipped_before
+        result["state_checksum"] = get_state_checksum(hass, entry)
+
+    finally:
+        await hass.config_entries.async_remove(entry.entry_id)
+
+        server.close()
+        simulator.stop()
+
+    return result
+
+
+async def async_main(args: argparse.Namespace) -> dict[str, Any]:
+    model, records = load_records(args.captures)
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = await async_create_hass(config_dir)
+
+        try:
+            return await async_replay(hass, model, records, args.speed)
+
+        finally:
+            await hass.async_stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=f"Replay {DOMAIN} traffic captures through the integration")
+    parser.add_argument("captures", nargs="+", help="the capture files, oldest first")
+    parser.add_argument(
+        "--speed", type=float, default=0, help="1 replays at the recorded pace, 2 twice as fast, 0 as fast as possible"
+    )
+    parser.add_argument("--output", help="also write the result to this json file")
+    parser.add_argument("--debug", action="store_true")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+
+    result = asyncio.run(async_main(args))
+
+    for key, value in result.items():
+        print("%-24s %s" % (key, f"{value:.3f}" if isinstance(value, float) else value))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,522 @@
+"""
+A simulated HTD gateway, for exercising the integration without hardware.
+
+It speaks the frame format from `HTD MCA-66 Hex Codes.pdf` (header, reserved
+byte, zone, command, data, checksum) and emulates an MCA-66, Lync 6 or
+Lync 12 over TCP, like the gateway on port 10006, or over a pseudo terminal
+that looks like a serial port.
+
+.. code-block:: shell
+
+    # two Lync 12 gateways on ports 10006 and 10007, with a keypad changing a zone every 2 seconds
+    python -m tools.simulator --model lync12 --count 2 --keypad-interval 2
+
+    # an MCA-66 on a pseudo terminal, the path to configure is printed on start
+    python -m tools.simulator --model mca66 --serial
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import tty
+from typing import Callable
+
+from htd_client.constants import (
+    HtdCommonCommands,
+    HtdConstants,
+    HtdDeviceKind,
+    HtdLyncCommands,
+    HtdLyncConstants,
+    HtdMcaCommands,
+    HtdMcaConstants,
+)
+
+from custom_components.htd.protocol import build_frame, calculate_checksum
+
+_LOGGER = logging.getLogger(__name__)
+
+# a command is header + reserved + zone + command + data + checksum, some
+# lync commands carry one extra data byte
+COMMAND_LENGTH = HtdConstants.MESSAGE_HEADER_LENGTH + 4
+EXTENDED_COMMAND_LENGTH = COMMAND_LENGTH + 1
+
+STATUS_DATA_LENGTH = HtdCommonCommands.EXPECTED_MESSAGE_LENGTH_MAP[HtdCommonCommands.ZONE_STATUS_RECEIVE_COMMAND]
+
+# the bit of the state toggles byte for power and mute, the lync reverses the order
+MCA_POWER_BIT = 0x80
+MCA_MUTE_BIT = 0x40
+LYNC_POWER_BIT = 0x01
+LYNC_MUTE_BIT = 0x02
+
+Writer = Callable[[bytes], None]
+
+
+class SimulatedZone:
+    __slots__ = ("power", "mute", "source", "volume", "bass", "treble", "balance", "enabled")
+
+    def __init__(self):
+        self.power = False
+        self.mute = False
+        self.source = 1
+        self.volume = 20
+        self.bass = 0
+        self.treble = 0
+        self.balance = 0
+        self.enabled = True
+
+
+class HtdGatewaySimulator:
+    """
+    The state of one simulated gateway and how it answers commands. The same
+    simulator can serve several TCP connections and a pseudo terminal at once.
+    """
+
+    def __init__(
+        self,
+        model: str = "lync12",
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        drop_rate: float = 0.0,
+        keypad_interval: float | None = None,
+        seed: int | None = None,
+    ):
+        self.model_info = HtdConstants.SUPPORTED_MODELS[model]
+        self.kind = self.model_info["kind"]
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.keypad_interval = keypad_interval
+        # while stalled nothing is sent back, like a half-open connection
+        self.stalled = False
+        self.zones = {zone: SimulatedZone() for zone in range(1, self.model_info["zones"] + 1)}
+
+        self._random = random.Random(seed)
+        self._writers: set[Writer] = set()
+        self._keypad_task: asyncio.Task | None = None
+
+        self.connections_opened = 0
+        self.frames_received = 0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.bytes_discarded = 0
+        self.keypad_changes = 0
+
+    async def async_start_tcp(self, host: str = "0.0.0.0", port: int = HtdConstants.DEFAULT_PORT) -> asyncio.Server:
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: _SimulatorProtocol(self), host, port)
+        self._start_keypad()
+        return server
+
+    def start_pty(self) -> str:
+        """
+        Serve the simulator on a pseudo terminal.
+
+        Returns:
+            str: the path of the serial port to connect to
+        """
+        loop = asyncio.get_running_loop()
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        os.set_blocking(master, False)
+
+        buffer = bytearray()
+        writer = lambda data: os.write(master, data)
+
+        def _on_readable():
+            try:
+                data = os.read(master, 1024)
+            except BlockingIOError:
+                return
+
+            buffer.extend(data)
+            self.feed(buffer, writer)
+
+        loop.add_reader(master, _on_readable)
+        self.add_writer(writer)
+        self._start_keypad()
+
+        return os.ttyname(slave)
+
+    def stop(self) -> None:
+        if self._keypad_task is not None:
+            self._keypad_task.cancel()
+            self._keypad_task = None
+
+    def feed(self, buffer: bytearray, writer: Writer) -> None:
+        """Consume every complete command in the buffer, leaving any partial one."""
+        while True:
+            start = buffer.find(HtdConstants.MESSAGE_HEADER)
+
+            if start < 0:
+                # keep a trailing header byte, the reserved byte may be on its way
+                keep = 1 if buffer[-1:] == bytes([HtdConstants.HEADER_BYTE]) else 0
+                self.bytes_discarded += len(buffer) - keep
+                del buffer[:len(buffer) - keep]
+                return
+
+            if start > 0:
+                self.bytes_discarded += start
+                del buffer[:start]
+
+            if len(buffer) < COMMAND_LENGTH:
+                return
+
+            # the checksum tells a plain command from one with an extra data byte
+            if calculate_checksum(buffer[:COMMAND_LENGTH - 1]) == buffer[COMMAND_LENGTH - 1]:
+                length = COMMAND_LENGTH
+
+            elif len(buffer) < EXTENDED_COMMAND_LENGTH:
+                return
+
+            elif calculate_checksum(buffer[:EXTENDED_COMMAND_LENGTH - 1]) == buffer[EXTENDED_COMMAND_LENGTH - 1]:
+                length = EXTENDED_COMMAND_LENGTH
+
+            else:
+                # corrupt, skip this header and look for the next one
+                self.bytes_discarded += HtdConstants.MESSAGE_HEADER_LENGTH
+                del buffer[:HtdConstants.MESSAGE_HEADER_LENGTH]
+                continue
+
+            frame = bytes(buffer[:length])
+            del buffer[:length]
+
+            self.frames_received += 1
+            self._handle_command(frame, writer)
+
+    def _handle_command(self, frame: bytes, writer: Writer) -> None:
+        zone = frame[2]
+        command = frame[3]
+        data = frame[4]
+        extra = frame[5] if len(frame) == EXTENDED_COMMAND_LENGTH else None
+
+        if command == HtdCommonCommands.MODEL_QUERY_COMMAND_CODE:
+            self._send(writer, self.model_info["identifier"])
+            return
+
+        if self.kind == HtdDeviceKind.lync:
+            changed = self._apply_lync(zone, command, data, extra)
+        else:
+            changed = self._apply_mca(zone, command, data)
+
+        if changed is None:
+            _LOGGER.debug("Ignoring unknown command %s", frame.hex(" "))
+            return
+
+        if len(changed) == len(self.zones) and self.kind == HtdDeviceKind.lync:
+            self._send(writer, self.build_keypad_frame())
+
+        for changed_zone in changed:
+            self._send(writer, self.build_status_frame(changed_zone))
+
+    def _apply_lync(self, zone: int, command: int, data: int, extra: int | None) -> list[int] | None:
+        if command == HtdLyncCommands.QUERY_COMMAND_CODE:
+            return self._query(zone)
+
+        if command == HtdLyncCommands.VOLUME_SETTING_CONTROL_COMMAND_CODE:
+            self.zones[zone].volume = 0 if data == 0 else data - HtdConstants.VOLUME_OFFSET
+            return [zone]
+
+        if command == HtdLyncCommands.BALANCE_SETTING_CONTROL_COMMAND_CODE:
+            self.zones[zone].balance = _signed(data)
+            return [zone]
+
+        if command != HtdLyncCommands.COMMON_COMMAND_CODE:
+            return None
+
+        if data == HtdLyncCommands.POWER_ON_ALL_ZONES_COMMAND_CODE:
+            return self._power_all(True)
+
+        if data == HtdLyncCommands.POWER_OFF_ALL_ZONES_COMMAND_CODE:
+            return self._power_all(False)
+
+        if zone not in self.zones:
+            return None
+
+        state = self.zones[zone]
+
+        if data == HtdLyncCommands.BASS_SETTING_CONTROL_COMMAND_CODE and extra is not None:
+            state.bass = _signed(extra)
+
+        elif data == HtdLyncCommands.TREBLE_SETTING_CONTROL_COMMAND_CODE and extra is not None:
+            state.treble = _signed(extra)
+
+        elif data == HtdLyncCommands.POWER_ON_ZONE_COMMAND_CODE:
+            state.power = True
+
+        elif data == HtdLyncCommands.POWER_OFF_ZONE_COMMAND_CODE:
+            state.power = False
+
+        elif data == HtdLyncCommands.MUTE_ON_COMMAND_CODE:
+            state.mute = True
+
+        elif data == HtdLyncCommands.MUTE_OFF_COMMAND_CODE:
+            state.mute = False
+
+        elif data == HtdLyncConstants.INTERCOM_SOURCE_DATA:
+            state.source = self.model_info["sources"]
+
+        elif HtdLyncConstants.SOURCE_COMMAND_OFFSET < data <= HtdLyncConstants.SOURCE_COMMAND_OFFSET + 12:
+            state.source = data - HtdLyncConstants.SOURCE_COMMAND_OFFSET
+
+        elif HtdLyncConstants.SOURCE_13_HIGHER_COMMAND_OFFSET + 12 < data < HtdLyncConstants.SOURCE_13_HIGHER_COMMAND_OFFSET + self.model_info["sources"]:
+            state.source = data - HtdLyncConstants.SOURCE_13_HIGHER_COMMAND_OFFSET
+
+        else:
+            return None
+
+        return [zone]
+
+    def _apply_mca(self, zone: int, command: int, data: int) -> list[int] | None:
+        if command == HtdMcaCommands.QUERY_COMMAND_CODE:
+            return self._query(zone)
+
+        if command != HtdMcaCommands.COMMON_COMMAND_CODE:
+            return None
+
+        if data == HtdMcaCommands.POWER_ON_ALL_ZONES_COMMAND_CODE:
+            return self._power_all(True)
+
+        if data == HtdMcaCommands.POWER_OFF_ALL_ZONES_COMMAND_CODE:
+            return self._power_all(False)
+
+        if zone not in self.zones:
+            return None
+
+        state = self.zones[zone]
+
+        if data == HtdMcaCommands.POWER_ON_ZONE_COMMAND_CODE:
+            state.power = True
+
+        elif data == HtdMcaCommands.POWER_OFF_ZONE_COMMAND_CODE:
+            state.power = False
+
+        elif data == HtdMcaCommands.TOGGLE_MUTE_COMMAND:
+            state.mute = not state.mute
+
+        elif data == HtdMcaCommands.VOLUME_UP_COMMAND:
+            state.volume = min(state.volume + 1, HtdConstants.MAX_VOLUME)
+
+        elif data == HtdMcaCommands.VOLUME_DOWN_COMMAND:
+            state.volume = max(state.volume - 1, 0)
+
+        elif data == HtdMcaCommands.BASS_UP_COMMAND:
+            state.bass = min(state.bass + 1, HtdConstants.MAX_BASS)
+
+        elif data == HtdMcaCommands.BASS_DOWN_COMMAND:
+            state.bass = max(state.bass - 1, HtdConstants.MIN_BASS)
+
+        elif data == HtdMcaCommands.TREBLE_UP_COMMAND:
+            state.treble = min(state.treble + 1, HtdConstants.MAX_TREBLE)
+
+        elif data == HtdMcaCommands.TREBLE_DOWN_COMMAND:
+            state.treble = max(state.treble - 1, HtdConstants.MIN_TREBLE)
+
+        elif data == HtdMcaCommands.BALANCE_RIGHT_COMMAND:
+            state.balance = min(state.balance + 1, HtdConstants.MAX_BALANCE)
+
+        elif data == HtdMcaCommands.BALANCE_LEFT_COMMAND:
+            state.balance = max(state.balance - 1, HtdConstants.MIN_BALANCE)
+
+        elif HtdMcaConstants.SOURCE_COMMAND_OFFSET < data <= HtdMcaConstants.SOURCE_COMMAND_OFFSET + self.model_info["sources"]:
+            state.source = data - HtdMcaConstants.SOURCE_COMMAND_OFFSET
+
+        else:
+            return None
+
+        return [zone]
+
+    def _query(self, zone: int) -> list[int]:
+        if zone == 0:
+            return list(self.zones)
+
+        return [zone] if zone in self.zones else []
+
+    def _power_all(self, power: bool) -> list[int]:
+        for state in self.zones.values():
+            state.power = power
+
+        return list(self.zones)
+
+    def build_status_frame(self, zone: int) -> bytes:
+        state = self.zones[zone]
+
+        if self.kind == HtdDeviceKind.lync:
+            toggles = (LYNC_POWER_BIT if state.power else 0) | (LYNC_MUTE_BIT if state.mute else 0)
+            raw_volume = 0 if state.volume == 0 else state.volume + HtdConstants.VOLUME_OFFSET
+        else:
+            toggles = (MCA_POWER_BIT if state.power else 0) | (MCA_MUTE_BIT if state.mute else 0)
+            raw_volume = (state.volume + HtdConstants.VOLUME_OFFSET) & 0xff
+
+        data = [0] * STATUS_DATA_LENGTH
+        data[HtdConstants.STATE_TOGGLES_ZONE_DATA_INDEX] = toggles
+        data[HtdConstants.SOURCE_ZONE_DATA_INDEX] = state.source - HtdConstants.SOURCE_QUERY_OFFSET
+        data[HtdConstants.VOLUME_ZONE_DATA_INDEX] = raw_volume
+        data[HtdConstants.TREBLE_ZONE_DATA_INDEX] = state.treble & 0xff
+        data[HtdConstants.BASS_ZONE_DATA_INDEX] = state.bass & 0xff
+        data[HtdConstants.BALANCE_ZONE_DATA_INDEX] = state.balance & 0xff
+
+        return build_frame(zone, HtdCommonCommands.ZONE_STATUS_RECEIVE_COMMAND, data)
+
+    def build_keypad_frame(self) -> bytes:
+        """The frame that tells the client which zones are enabled."""
+        enabled = sum(1 << (zone - 1) for zone, state in self.zones.items() if state.enabled)
+
+        data = [0] * STATUS_DATA_LENGTH
+        data[1] = enabled & 0xff
+        data[3] = (enabled >> 8) & 0xff
+
+        return build_frame(0, HtdCommonCommands.KEYPAD_EXISTS_RECEIVE_COMMAND, data)
+
+    def _send(self, writer: Writer, frame: bytes) -> None:
+        if self.stalled or self.drop_rate and self._random.random() < self.drop_rate:
+            self.frames_dropped += 1
+            return
+
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._write, writer, frame)
+        else:
+            self._write(writer, frame)
+
+    def _write(self, writer: Writer, frame: bytes) -> None:
+        if writer not in self._writers:
+            return
+
+        try:
+            writer(frame)
+            self.frames_sent += 1
+        except OSError as e:
+            _LOGGER.debug("Dropping a closed connection: %s", e)
+            self._writers.discard(writer)
+
+    def broadcast_zone(self, zone: int) -> None:
+        """Send a zone's status to every connection, the way a keypad change shows up."""
+        frame = self.build_status_frame(zone)
+
+        for writer in list(self._writers):
+            self._send(writer, frame)
+
+    def keypad_change(self, zone: int | None = None) -> int:
+        """
+        Change a zone the way someone at a keypad would.
+
+        Returns:
+            int: the zone that was changed
+        """
+        zone = zone if zone is not None else self._random.choice(list(self.zones))
+        state = self.zones[zone]
+        change = self._random.randrange(4)
+
+        if change == 0:
+            state.power = not state.power
+        elif change == 1:
+            state.mute = not state.mute
+        elif change == 2:
+            state.source = self._random.randint(1, self.model_info["sources"])
+        else:
+            state.volume = max(0, min(HtdConstants.MAX_VOLUME, state.volume + self._random.choice((-1, 1))))
+
+        self.keypad_changes += 1
+        self.broadcast_zone(zone)
+
+        return zone
+
+    def _start_keypad(self) -> None:
+        if self.keypad_interval and self._keypad_task is None:
+            self._keypad_task = asyncio.get_running_loop().create_task(self._async_keypad())
+
+    async def _async_keypad(self) -> None:
+        while True:
+            await asyncio.sleep(self.keypad_interval)
+            self.keypad_change()
+
+    @property
+    def open_connections(self) -> int:
+        return len(self._writers)
+
+    def add_writer(self, writer: Writer) -> None:
+        self._writers.add(writer)
+        self.connections_opened += 1
+
+    def remove_writer(self, writer: Writer) -> None:
+        self._writers.discard(writer)
+
+
+class _SimulatorProtocol(asyncio.Protocol):
+    def __init__(self, simulator: HtdGatewaySimulator):
+        self._simulator = simulator
+        self._buffer = bytearray()
+        self._transport: asyncio.Transport | None = None
+
+    def connection_made(self, transport: asyncio.Transport):
+        self._transport = transport
+        self._simulator.add_writer(self._write)
+
+    def data_received(self, data: bytes):
+        self._buffer += data
+        self._simulator.feed(self._buffer, self._write)
+
+    def connection_lost(self, exc):
+        self._simulator.remove_writer(self._write)
+
+    def _write(self, data: bytes):
+        if self._transport is not None and not self._transport.is_closing():
+            self._transport.write(data)
+
+
+def _signed(value: int) -> int:
+    return value - 0x100 if value > 0x7F else value
+
+
+async def async_main(args: argparse.Namespace) -> None:
+    simulators = []
+
+    for index in range(args.count):
+        simulator = HtdGatewaySimulator(
+            model=args.model,
+            latency=args.latency,
+            jitter=args.jitter,
+            drop_rate=args.drop,
+            keypad_interval=args.keypad_interval,
+            seed=None if args.seed is None else args.seed + index,
+        )
+
+        if args.serial:
+            print(f"{args.model} listening on {simulator.start_pty()}")
+        else:
+            await simulator.async_start_tcp(args.host, args.port + index)
+            print(f"{args.model} listening on {args.host}:{args.port + index}")
+
+        simulators.append(simulator)
+
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate HTD gateways")
+    parser.add_argument("--model", choices=list(HtdConstants.SUPPORTED_MODELS), default="lync12")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=HtdConstants.DEFAULT_PORT)
+    parser.add_argument("--count", type=int, default=1, help="the number of gateways, on consecutive ports")
+    parser.add_argument("--serial", action="store_true", help="serve on a pseudo terminal instead of TCP")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each frame is answered")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many seconds are added to the latency")
+    parser.add_argument("--drop", type=float, default=0.0, help="the chance a frame is never sent, 0 to 1")
+    parser.add_argument("--keypad-interval", type=float, default=None, help="seconds between keypad changes")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--debug", action="store_true")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    try:
+        asyncio.run(async_main(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()